@@ -1,13 +1,149 @@
+import datetime
+import functools
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, APIKey, CreditBalance, CreditTransaction, Location
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import CharField, Max, Q, QuerySet
+from django.db.models.functions import Substr
+from django.utils.functional import cached_property
+from .exports import export_current_version
+from .location_db import build_location_db
+from .models import (
+    User, APIKey, IdempotencyRecord, CreditBalance, CreditStripe, CreditTransaction, Location, DatasetVersion,
+    LocationSummary
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts rows exactly up to ADMIN_EXACT_COUNT_LIMIT, or up to PAGES_AHEAD
+    pages past the requested page when that is further, and estimates
+    beyond, so that large tables are never counted in full. Unfiltered lists
+    estimate with the largest primary key. Filtered ones report one row more
+    than was counted: the page links then end a few pages ahead, and paging
+    there counts further, so every page stays reachable.
+    """
+    PAGES_AHEAD = 10
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, page_number=1):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.page_number = page_number
+
+    @cached_property
+    def count(self):
+        limit = max(settings.ADMIN_EXACT_COUNT_LIMIT, (self.page_number + self.PAGES_AHEAD) * self.per_page)
+        queryset = self.object_list
+        count = queryset.order_by()[:limit + 1].count()
+        if count <= limit or queryset.query.where:
+            return count
+        return max(count, queryset.aggregate(last=Max('pk'))['last'] or 0)
+
+
+class DateHierarchyQuerySet(QuerySet):
+    """
+    Computes the admin date hierarchy's year/month/day choices by grouping
+    on a prefix of the stored value, which SQLite reads from the column's
+    index, instead of calling django_datetime_trunc() on every row.
+    Only used on SQLite with TIME_ZONE = 'UTC', where the stored text is
+    already the displayed date.
+    """
+    PREFIXES = {'year': (4, '%Y'), 'month': (7, '%Y-%m'), 'day': (10, '%Y-%m-%d')}
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, is_dst=None):
+        if (
+            kind not in self.PREFIXES or tzinfo is not None or settings.TIME_ZONE != 'UTC'
+            or connections[self.db].vendor != 'sqlite'
+        ):
+            return super().datetimes(field_name, kind, order=order, tzinfo=tzinfo, is_dst=is_dst)
+
+        length, date_format = self.PREFIXES[kind]
+        prefixes = self.order_by().annotate(
+            period=Substr(field_name, 1, length, output_field=CharField())
+        ).values_list('period', flat=True).distinct().order_by('period' if order == 'ASC' else '-period')
+        return [
+            datetime.datetime.strptime(prefix, date_format).replace(tzinfo=datetime.timezone.utc)
+            for prefix in prefixes if prefix
+        ]
+
+
+class ScalableAdminMixin:
+    """
+    Changelist settings for tables that grow large: no second full count
+    for the "N total" link, estimated pagination counts, an index-backed
+    date hierarchy, and search through indexed prefix ranges instead of
+    LIKE '%term%'.
+
+    prefix_search_fields lists unique or indexed text columns, optionally
+    across one relation ('user__username'); matching is case-sensitive.
+    """
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    prefix_search_fields = ()
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page_number = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            page_number = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_number=page_number)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.date_hierarchy:
+            queryset = DateHierarchyQuerySet(model=queryset.model, query=queryset.query.chain(), using=queryset.db)
+        return queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term or not self.prefix_search_fields:
+            return super().get_search_results(request, queryset, search_term)
+
+        condition = Q()
+        for field in self.prefix_search_fields:
+            relation, _, related_field = field.rpartition('__')
+            in_range = {f'{related_field}__gte': term, f'{related_field}__lt': term + '\U0010ffff'}
+            if relation:
+                # A subquery keeps the lookup on the related table's index
+                related_model = self.model._meta.get_field(relation).related_model
+                condition |= Q(**{f'{relation}__in': related_model.objects.filter(**in_range).values('pk')})
+            else:
+                condition |= Q(**in_range)
+        return queryset.filter(condition), False
+
+
+class DistrictListFilter(admin.SimpleListFilter):
+    """District choices, read once per dataset version instead of a DISTINCT per page view"""
+    title = 'district'
+    parameter_name = 'district'
+
+    def lookups(self, request, model_admin):
+        key = f'admin:districts:{DatasetVersion.current()}'
+        districts = cache.get(key)
+        if districts is None:
+            districts = list(
+                Location.objects.order_by('district').values_list('district', flat=True).distinct()
+            )
+            cache.set(key, districts, 24 * 60 * 60)
+        return [(district, district) for district in districts]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(district=self.value())
+        return queryset
 
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ScalableAdminMixin, BaseUserAdmin):
     list_display = ['username', 'email', 'first_name', 'last_name', 'is_staff', 'created_at']
     list_filter = ['is_staff', 'is_superuser', 'is_active', 'created_at']
-    search_fields = ['username', 'email', 'first_name', 'last_name']
+    search_fields = ['username', 'email']
+    prefix_search_fields = ['username', 'email']
+    search_help_text = 'Start of the username or email (case-sensitive)'
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Timestamps', {'fields': ('created_at', 'updated_at')}),
     )
@@ -15,10 +151,14 @@ class UserAdmin(BaseUserAdmin):
 
 
 @admin.register(APIKey)
-class APIKeyAdmin(admin.ModelAdmin):
-    list_display = ['name', 'user', 'key_preview', 'is_active', 'created_at', 'last_used']
-    list_filter = ['is_active', 'created_at']
-    search_fields = ['name', 'user__username', 'key']
+class APIKeyAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['name', 'user', 'key_preview', 'rate_limit_tier', 'is_active', 'created_at', 'last_used']
+    list_filter = ['is_active', 'rate_limit_tier']
+    date_hierarchy = 'created_at'
+    search_fields = ['key', 'user__username']
+    prefix_search_fields = ['key', 'user__username']
+    search_help_text = 'Start of the API key or username (case-sensitive)'
+    autocomplete_fields = ['user']
     readonly_fields = ['key', 'created_at', 'last_used']
 
     def key_preview(self, obj):
@@ -26,24 +166,101 @@ class APIKeyAdmin(admin.ModelAdmin):
     key_preview.short_description = 'API Key'
 
 
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['key', 'api_key', 'status_code', 'created_at', 'expires_at']
+    list_filter = ['status_code']
+    search_fields = ['key']
+    prefix_search_fields = ['key']
+    search_help_text = 'Start of the idempotency key (case-sensitive)'
+    raw_id_fields = ['api_key']
+    exclude = ['body']
+    readonly_fields = ['api_key', 'key', 'request_hash', 'status_code', 'headers', 'created_at', 'expires_at']
+
+
 @admin.register(CreditBalance)
-class CreditBalanceAdmin(admin.ModelAdmin):
+class CreditBalanceAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['user', 'credits', 'total_earned', 'total_spent', 'updated_at']
     search_fields = ['user__username']
+    prefix_search_fields = ['user__username']
+    search_help_text = 'Start of the username (case-sensitive)'
+    autocomplete_fields = ['user']
     readonly_fields = ['created_at', 'updated_at']
 
 
+@admin.register(CreditStripe)
+class CreditStripeAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['user', 'stripe', 'reserved', 'spent', 'updated_at']
+    search_fields = ['user__username']
+    prefix_search_fields = ['user__username']
+    search_help_text = 'Start of the username (case-sensitive)'
+    readonly_fields = ['user', 'stripe', 'reserved', 'spent', 'updated_at']
+
+
 @admin.register(CreditTransaction)
-class CreditTransactionAdmin(admin.ModelAdmin):
+class CreditTransactionAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['user', 'transaction_type', 'amount', 'balance_after', 'created_at']
-    list_filter = ['transaction_type', 'created_at']
-    search_fields = ['user__username', 'description']
+    list_filter = ['transaction_type']
+    date_hierarchy = 'created_at'
+    search_fields = ['user__username']
+    prefix_search_fields = ['user__username']
+    search_help_text = 'Start of the username (case-sensitive)'
+    autocomplete_fields = ['user']
     readonly_fields = ['created_at']
 
 
 @admin.register(Location)
-class LocationAdmin(admin.ModelAdmin):
+class LocationAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['name', 'location_type', 'district', 'is_active', 'created_at']
-    list_filter = ['location_type', 'district', 'is_active', 'created_at']
+    list_filter = ['location_type', DistrictListFilter, 'is_active', 'created_at']
     search_fields = ['name', 'address', 'district']
     readonly_fields = ['created_at', 'updated_at']
+
+    # Every change to locations publishes a new dataset version, with the
+    # changed ids and refreshed summary rows, so that snapshots, serve
+    # workers and delta sync clients pick it up. Its location database and
+    # export files are written once the admin's transaction commits, so the
+    # transaction is not held open while they are built.
+    def publish(self, **changes):
+        version = DatasetVersion.publish('admin', **changes)
+        transaction.on_commit(functools.partial(build_location_db, version.id))
+        transaction.on_commit(export_current_version)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.publish(upserted=[obj.pk])
+
+    def delete_model(self, request, obj):
+        pk = obj.pk
+        super().delete_model(request, obj)
+        self.publish(deleted=[pk])
+
+    def delete_queryset(self, request, queryset):
+        pks = list(queryset.values_list('pk', flat=True))
+        super().delete_queryset(request, queryset)
+        self.publish(deleted=pks)
+
+
+@admin.register(DatasetVersion)
+class DatasetVersionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'source', 'location_count', 'has_change_log', 'created_at']
+    list_filter = ['source', 'has_change_log']
+    readonly_fields = ['source', 'location_count', 'has_change_log', 'created_at']
+
+
+@admin.register(LocationSummary)
+class LocationSummaryAdmin(admin.ModelAdmin):
+    # version_id: no join, the table may be read from the location database
+    list_display = ['district', 'region', 'location_type', 'count', 'version_id']
+    list_filter = ['region', 'location_type']
+    search_fields = ['district']
+
+    # Rebuilt from Location with every dataset version
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,49 @@
+"""
+Bounded thread pool for blocking database work called from async views.
+
+Django's async ORM methods funnel every call through a single
+thread-sensitive executor. Heavier work (location queries, credit
+deduction) runs here instead, so that at most API_DB_THREADS threads
+hold SQLite connections no matter how many requests are in flight.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+
+
+def get_db_executor():
+    """Return the shared executor, creating it on first use"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.API_DB_THREADS,
+            thread_name_prefix='api-db',
+        )
+    return _executor
+
+
+def _with_connection_cleanup(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Pool threads never see request_started/request_finished, so expire
+        # connections here the same way the request cycle would.
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+async def run_in_db_pool(func, *args, **kwargs):
+    """Run a blocking callable on the database thread pool"""
+    return await sync_to_async(
+        _with_connection_cleanup(func),
+        thread_sensitive=False,
+        executor=get_db_executor(),
+    )(*args, **kwargs)
@@ -0,0 +1,142 @@
+"""
+Precompressed /api/locations payloads.
+
+The locations part of a response ({"count": ..., "locations": [...]) is the
+same for every caller of a given filter and dataset version; only the
+trailing credit fields differ. For the full dataset and filters without a
+search term, the locations part is compressed once per snapshot and every
+response appends its own small suffix:
+
+* gzip: the compressor is flushed with Z_SYNC_FLUSH after the shared part
+  and its state is kept; each response copies the state and compresses only
+  the suffix, which yields one ordinary gzip member with a correct trailer.
+* br: the shared part is flushed to a meta-block boundary; each response
+  appends the suffix as an uncompressed meta-block followed by an empty last
+  meta-block (RFC 7932, section 9.2).
+
+Brotli needs the optional `brotli` package; without it only gzip is offered.
+"""
+import threading
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Empty meta-block with ISLAST and ISLASTEMPTY set
+BROTLI_LAST_BLOCK = b'\x03'
+BROTLI_MAX_BLOCK = 1 << 16
+
+
+def _brotli_uncompressed(data):
+    """Encode bytes as uncompressed, non-final brotli meta-blocks"""
+    blocks = []
+    for start in range(0, len(data), BROTLI_MAX_BLOCK):
+        chunk = data[start:start + BROTLI_MAX_BLOCK]
+        # ISLAST=0, MNIBBLES=0 (4 nibbles), MLEN-1 (16 bits), ISUNCOMPRESSED=1,
+        # then zero padding to the byte boundary
+        header = ((len(chunk) - 1) << 3) | (1 << 19)
+        blocks.append(header.to_bytes(3, 'little') + chunk)
+    return b''.join(blocks)
+
+
+def accepted_encodings(request):
+    """Content codings the client accepts (q=0 entries excluded)"""
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if coding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.lower())
+    return accepted
+
+
+def decode(body, encoding):
+    """Undo a gzip or br Content-Encoding, or None when it cannot be decoded"""
+    encoding = encoding.lower()
+    try:
+        if encoding == 'gzip':
+            return zlib.decompress(body, 47)
+        if encoding == 'br' and brotli is not None:
+            return brotli.decompress(body)
+    except (zlib.error, getattr(brotli, 'error', zlib.error)):
+        pass
+    return None
+
+
+class CompressedPayload:
+    """
+    A JSON prefix stored uncompressed, gzip-compressed and (when available)
+    brotli-compressed, ready to be completed with a per-response suffix
+    """
+
+    def __init__(self, prefix):
+        self.identity = prefix
+
+        compressor = zlib.compressobj(settings.LOCATION_GZIP_LEVEL, zlib.DEFLATED, 31)
+        self.gzip = compressor.compress(prefix) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.gzip_state = compressor
+
+        self.br = None
+        if brotli is not None:
+            compressor = brotli.Compressor(quality=settings.LOCATION_BROTLI_QUALITY)
+            self.br = compressor.process(prefix) + compressor.flush()
+
+    def encodings(self):
+        return ('br', 'gzip') if self.br is not None else ('gzip',)
+
+    def negotiate(self, request):
+        """Pick the best encoding the client accepts, or 'identity'"""
+        accepted = accepted_encodings(request)
+        for encoding in self.encodings():
+            if encoding in accepted:
+                return encoding
+        return 'identity'
+
+    def render(self, suffix, encoding):
+        if encoding == 'br':
+            return self.br + _brotli_uncompressed(suffix) + BROTLI_LAST_BLOCK
+        if encoding == 'gzip':
+            compressor = self.gzip_state.copy()
+            return self.gzip + compressor.compress(suffix) + compressor.flush()
+        return self.identity + suffix
+
+
+_lock = threading.Lock()
+
+
+def payload_key(snapshot, params):
+    """
+    Cache key for a request's filters, or None when the response should not
+    be precompressed: searches are too varied to be worth caching, and a
+    type or district that is not exactly one of the snapshot's would let
+    arbitrary query strings fill the LOCATION_PRECOMPRESSED_VARIANTS slots
+    """
+    if params.get('search'):
+        return None
+    location_type = (params.get('type') or '').upper()
+    district = (params.get('district') or '').lower()
+    if location_type and location_type not in snapshot.by_type:
+        return None
+    if district and district not in snapshot.by_district:
+        return None
+    return (location_type, district)
+
+
+def get_payload(snapshot, key, build_prefix):
+    """
+    Return the CompressedPayload for `key` on this snapshot, building it
+    with build_prefix() on first use. Returns None once the snapshot holds
+    LOCATION_PRECOMPRESSED_VARIANTS payloads and `key` is not among them.
+    """
+    payload = snapshot.payloads.get(key)
+    if payload is not None:
+        return payload
+    if len(snapshot.payloads) >= settings.LOCATION_PRECOMPRESSED_VARIANTS:
+        return None
+    payload = CompressedPayload(build_prefix())
+    with _lock:
+        return snapshot.payloads.setdefault(key, payload)
@@ -0,0 +1,222 @@
+"""
+Credit deduction for API calls.
+
+By default every call updates the user's single CreditBalance row. With
+CREDIT_STRIPES > 0 calls are spread over that many CreditStripe rows per
+user instead:
+
+* credits are reserved from CreditBalance.credits into a stripe in chunks of
+  CREDIT_STRIPE_RESERVE, and spent from the stripe;
+* every decrement is a conditional UPDATE (... WHERE value >= amount), so
+  neither the balance nor a stripe can go negative;
+* the user's real balance is CreditBalance.credits plus the reserved credits
+  of all stripes, summed lazily when needed;
+* compact_credit_stripes() folds stripes back into CreditBalance.credits and
+  total_spent (see the compact_credits management command).
+
+Every charge records a CreditTransaction, whose post_save signal drops the
+user's cached dashboard summary (see api.dashboard).
+
+While `prepaid` is set, calls are served without a credit check or charge:
+api.idempotency sets it when a retry of a call that was already charged
+has to run the call again.
+"""
+import contextvars
+import random
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from .models import CreditBalance, CreditStripe, CreditTransaction
+
+
+prepaid = contextvars.ContextVar('prepaid', default=False)
+
+
+def striped():
+    return settings.CREDIT_STRIPES > 0
+
+
+def pick_stripe(stripe_key=None):
+    """Choose a stripe, deterministically when a key is given"""
+    if stripe_key is None:
+        return random.randrange(settings.CREDIT_STRIPES)
+    return zlib.crc32(str(stripe_key).encode()) % settings.CREDIT_STRIPES
+
+
+def unsettled(user_id):
+    """Return (reserved, spent) held in the user's stripes"""
+    totals = CreditStripe.objects.filter(user_id=user_id).aggregate(
+        reserved=Sum('reserved'), spent=Sum('spent')
+    )
+    return totals['reserved'] or 0, totals['spent'] or 0
+
+
+def available_credits(credit_balance):
+    """Credits the user can still spend"""
+    if not striped():
+        return credit_balance.credits
+    reserved, _ = unsettled(credit_balance.user_id)
+    return credit_balance.credits + reserved
+
+
+def can_afford(credit_balance, cost):
+    """
+    Whether the user can pay `cost`. Leaves the available credits in
+    credit_balance.credits (see apply_unsettled).
+    """
+    apply_unsettled(credit_balance)
+    return prepaid.get() or credit_balance.credits >= cost
+
+
+def apply_unsettled(credit_balance):
+    """
+    Add unsettled stripe totals to an in-memory CreditBalance for display or
+    a credit check, so that its credits are the available credits.
+    The instance must not be saved afterwards.
+    """
+    if striped():
+        reserved, spent = unsettled(credit_balance.user_id)
+        credit_balance.credits += reserved
+        credit_balance.total_spent += spent
+    return credit_balance
+
+
+def _reserve(user_id, stripe, amount):
+    """
+    Move `amount` credits from the balance into a stripe. Raises
+    CreditStripe.DoesNotExist, rolling the balance update back, when the
+    stripe row is missing so the credits are never taken off without landing
+    anywhere.
+    """
+    with transaction.atomic():
+        moved = CreditBalance.objects.filter(user_id=user_id, credits__gte=amount).update(
+            credits=F('credits') - amount
+        )
+        if not moved:
+            return False
+        reserved = CreditStripe.objects.filter(user_id=user_id, stripe=stripe).update(
+            reserved=F('reserved') + amount
+        )
+        if not reserved:
+            raise CreditStripe.DoesNotExist(f"User {user_id} has no credit stripe {stripe}")
+    return True
+
+
+def _ensure_stripes(user_id):
+    """Create any of the user's CREDIT_STRIPES rows that do not exist yet"""
+    existing = set(CreditStripe.objects.filter(user_id=user_id).values_list('stripe', flat=True))
+    missing = [i for i in range(settings.CREDIT_STRIPES) if i not in existing]
+    if missing:
+        # CREDIT_STRIPES may have been raised since the first rows were made
+        CreditStripe.objects.bulk_create(
+            [CreditStripe(user_id=user_id, stripe=i) for i in missing],
+            ignore_conflicts=True,
+        )
+
+
+def _spend_from_stripe(user_id, stripe, cost):
+    return CreditStripe.objects.filter(user_id=user_id, stripe=stripe, reserved__gte=cost).update(
+        reserved=F('reserved') - cost, spent=F('spent') + cost
+    ) > 0
+
+
+def spend_striped(user_id, cost, stripe_key=None):
+    """
+    Spend `cost` credits through the stripes. Returns False when the user's
+    balance and every stripe together cannot cover it.
+    """
+    stripe = pick_stripe(stripe_key)
+    if _spend_from_stripe(user_id, stripe, cost):
+        return True
+
+    # Make sure the stripe rows exist before reserving into them
+    _ensure_stripes(user_id)
+
+    chunk = max(cost, settings.CREDIT_STRIPE_RESERVE)
+    if _reserve(user_id, stripe, chunk) or _reserve(user_id, stripe, cost):
+        if _spend_from_stripe(user_id, stripe, cost):
+            return True
+
+    # The balance is exhausted, but other stripes may still hold reservations,
+    # including stripes beyond a since-lowered CREDIT_STRIPES
+    others = CreditStripe.objects.filter(user_id=user_id, reserved__gte=cost).exclude(stripe=stripe)
+    for other in others.values_list('stripe', flat=True):
+        if _spend_from_stripe(user_id, other, cost):
+            return True
+    return False
+
+
+def charge_credits(credit_balance, cost, description, stripe_key=None):
+    """
+    Deduct credits for an API call and record the transaction.
+    Updates credit_balance.credits to the remaining available credits, also
+    when the charge fails. Charges nothing while `prepaid` is set.
+    """
+    if prepaid.get():
+        credit_balance.refresh_from_db(fields=['credits'])
+        credit_balance.credits = available_credits(credit_balance)
+        return True
+    if not striped():
+        with transaction.atomic():
+            if credit_balance.deduct_credits(cost):
+                CreditTransaction.objects.create(
+                    user_id=credit_balance.user_id,
+                    transaction_type='API_CALL',
+                    amount=-cost,
+                    balance_after=credit_balance.credits,
+                    description=description
+                )
+                return True
+        return False
+
+    # The stripe spend and its ledger row commit or roll back together
+    with transaction.atomic():
+        spent = spend_striped(credit_balance.user_id, cost, stripe_key)
+        credit_balance.refresh_from_db(fields=['credits'])
+        credit_balance.credits = available_credits(credit_balance)
+        if spent:
+            CreditTransaction.objects.create(
+                user_id=credit_balance.user_id,
+                transaction_type='API_CALL',
+                amount=-cost,
+                balance_after=credit_balance.credits,
+                description=description
+            )
+    return spent
+
+
+def compact_credit_stripes(user_id=None):
+    """
+    Fold stripe reservations back into CreditBalance.credits and stripe spend
+    into total_spent. Returns the number of users compacted.
+    """
+    from .dashboard import invalidate_dashboard
+
+    users = CreditStripe.objects.filter(Q(reserved__gt=0) | Q(spent__gt=0))
+    if user_id is not None:
+        users = users.filter(user_id=user_id)
+    compacted = 0
+    for uid in users.order_by().values_list('user_id', flat=True).distinct():
+        with transaction.atomic():
+            # Take the write lock before reading the stripes. select_for_update()
+            # is a no-op on SQLite, whose deferred transactions only lock on the
+            # first write; this no-op UPDATE locks the rows (and on SQLite the
+            # database) so no spend can land between the read and the fold.
+            CreditStripe.objects.filter(user_id=uid).update(reserved=F('reserved'))
+            stripes = list(CreditStripe.objects.filter(user_id=uid))
+            reserved = sum(s.reserved for s in stripes)
+            spent = sum(s.spent for s in stripes)
+            # Relative updates keep any spend that lands while compacting
+            for s in stripes:
+                CreditStripe.objects.filter(pk=s.pk).update(
+                    reserved=F('reserved') - s.reserved, spent=F('spent') - s.spent
+                )
+            CreditBalance.objects.filter(user_id=uid).update(
+                credits=F('credits') + reserved, total_spent=F('total_spent') + spent
+            )
+        invalidate_dashboard(uid)
+        compacted += 1
+    return compacted
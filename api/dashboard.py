@@ -0,0 +1,57 @@
+"""
+Cached per-user dashboard aggregates.
+
+The dashboard is refreshed often by users watching their credits, so the
+balance (including unsettled stripe totals) and the recent transactions are
+cached per user for DASHBOARD_CACHE_TTL seconds. Entries are dropped
+whenever credits change: on every CreditBalance or CreditTransaction save
+(see api.signals) and when striped counters are compacted. The entry is
+dropped when the surrounding transaction commits, so a dashboard rendered
+in between cannot cache the old balance again.
+
+The cache is Django's default cache; with several worker processes it
+must be shared between them (CACHE_BACKEND=file) for invalidation to reach
+every worker.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .credits import apply_unsettled
+from .models import CreditBalance, CreditTransaction
+
+RECENT_TRANSACTIONS = 20
+
+
+def dashboard_cache_key(user_id):
+    return f'dashboard:{user_id}'
+
+
+def invalidate_dashboard(user_id):
+    key = dashboard_cache_key(user_id)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def get_dashboard_summary(user):
+    """
+    Return {'credit_balance', 'transactions'} for the user, from the cache
+    when possible
+    """
+    key = dashboard_cache_key(user.pk)
+    summary = cache.get(key)
+    if summary is not None:
+        return summary
+
+    try:
+        credit_balance = CreditBalance.objects.get(user=user)
+    except CreditBalance.DoesNotExist:
+        # Balances are created with the user; only show an empty one here
+        credit_balance = CreditBalance(user=user)
+    apply_unsettled(credit_balance)
+
+    summary = {
+        'credit_balance': credit_balance,
+        'transactions': list(CreditTransaction.objects.filter(user=user)[:RECENT_TRANSACTIONS]),
+    }
+    cache.set(key, summary, settings.DASHBOARD_CACHE_TTL)
+    return summary
@@ -0,0 +1,201 @@
+"""
+Versioned export files of the active locations.
+
+Each dataset version is written once to EXPORT_DIR as JSON, CSV and NDJSON,
+each with gzip and (when the optional `brotli` package is installed) brotli
+variants:
+
+    locations-v12.json  locations-v12.json.gz  locations-v12.json.br
+    locations-v12.csv   ...
+    locations-v12.ndjson ...
+
+Files are never modified once written, so /api/locations/export can hand
+them to the server as they are (sendfile, or nginx X-Accel-Redirect) and
+any cache in front can keep them. The loader and admin edits write the new
+version's files right after publishing it; a version published any other
+way is exported on its first download.
+"""
+import csv
+import gzip
+import io
+import os
+import re
+import tempfile
+import threading
+
+from django.conf import settings
+
+from .compression import accepted_encodings, brotli
+from .serializers import dumps
+from .snapshot import LOCATION_FIELDS, LocationSnapshot
+
+FILE_PATTERN = re.compile(r'^locations-v(\d+)\.')
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+CHUNK_SIZE = 64 * 1024
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+def render_json(snapshot):
+    return dumps({'count': len(snapshot), 'version': snapshot.version, 'locations': list(snapshot.rows)})
+
+
+def render_csv(snapshot):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(LOCATION_FIELDS)
+    for row in snapshot.rows:
+        writer.writerow(['' if row[field] is None else row[field] for field in LOCATION_FIELDS])
+    return output.getvalue().encode()
+
+
+def render_ndjson(snapshot):
+    return b''.join(dumps(row) + b'\n' for row in snapshot.rows)
+
+
+# format -> (content type, renderer)
+FORMATS = {
+    'json': ('application/json', render_json),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'ndjson': ('application/x-ndjson', render_ndjson),
+}
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+
+def export_name(version, fmt, encoding='identity'):
+    return f'locations-v{version}.{fmt}' + ENCODINGS.get(encoding, '')
+
+
+def export_path(version, fmt, encoding='identity'):
+    return settings.EXPORT_DIR / export_name(version, fmt, encoding)
+
+
+def _write_atomic(path, data):
+    """Write a file under a temporary name and rename it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+_lock = threading.Lock()
+
+
+def write_exports(snapshot):
+    """
+    Write every format and encoding of the snapshot's version that does not
+    exist yet, then remove versions older than the last EXPORT_KEEP_VERSIONS
+    """
+    settings.EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        for fmt, (_, renderer) in FORMATS.items():
+            path = export_path(snapshot.version, fmt)
+            if path.exists():
+                continue
+            body = renderer(snapshot)
+            # The uncompressed file goes last: once it exists, so do the variants
+            _write_atomic(
+                export_path(snapshot.version, fmt, 'gzip'),
+                gzip.compress(body, settings.LOCATION_GZIP_LEVEL, mtime=0)
+            )
+            if brotli is not None:
+                _write_atomic(
+                    export_path(snapshot.version, fmt, 'br'),
+                    brotli.compress(body, quality=settings.EXPORT_BROTLI_QUALITY)
+                )
+            _write_atomic(path, body)
+        prune_exports(keep_version=snapshot.version)
+
+
+def export_current_version():
+    """Write the export files of the current dataset version"""
+    write_exports(LocationSnapshot.build())
+
+
+def prune_exports(keep_version=None):
+    """Delete export files of all but the newest EXPORT_KEEP_VERSIONS versions"""
+    files = {}
+    for entry in os.scandir(settings.EXPORT_DIR):
+        match = FILE_PATTERN.match(entry.name)
+        if match:
+            files.setdefault(int(match.group(1)), []).append(entry.path)
+    keep = set(sorted(files, reverse=True)[:settings.EXPORT_KEEP_VERSIONS])
+    keep.add(keep_version)
+    for version, paths in files.items():
+        if version not in keep:
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+
+def requested_range(request, size, etag):
+    """
+    The (start, end) bytes, end inclusive, of a Range request for one part
+    of an export file of `size` bytes, or None to send the whole file: when
+    there is no Range header, it asks for several ranges or is malformed, or
+    If-Range names another file. Raises UnsatisfiableRange for a range that
+    starts past the end.
+    """
+    match = RANGE_PATTERN.fullmatch(request.headers.get('Range', '').replace(' ', ''))
+    if match is None or match.groups() == ('', ''):
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and if_range != etag:
+        return None
+
+    first, last = match.groups()
+    if first == '':
+        # The last `last` bytes
+        if int(last) == 0 or size == 0:
+            raise UnsatisfiableRange
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last != '' and int(last) < start:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange
+    return start, size - 1 if last == '' else min(int(last), size - 1)
+
+
+def read_range(path, start, end):
+    """Yield bytes start to end (inclusive) of a file in chunks"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def get_export(snapshot, fmt, request):
+    """
+    Return (path, encoding) of the export file to send for the snapshot's
+    version, writing the files first when they are missing
+    """
+    if not export_path(snapshot.version, fmt).exists():
+        write_exports(snapshot)
+
+    accepted = accepted_encodings(request)
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            path = export_path(snapshot.version, fmt, encoding)
+            if path.exists():
+                return path, encoding
+    return export_path(snapshot.version, fmt), 'identity'
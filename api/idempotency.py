@@ -0,0 +1,235 @@
+"""
+Idempotency-Key support for charged API calls.
+
+A client that sends `Idempotency-Key: <unique string>` with a request can
+retry it safely: the first successful response is stored per API key and
+idempotency key for IDEMPOTENCY_TTL seconds, and retries get that response
+back (with `Idempotent-Replayed: true`) without querying or charging again.
+
+* A retry while the first request is still running gets 409.
+* Reusing a key for a different method, URL or request body gets 422.
+* Error responses are not stored, so the call can be retried once the
+  problem (e.g. missing credits) is fixed.
+* Each API key keeps at most IDEMPOTENCY_MAX_RECORDS records; its expired
+  and excess records are deleted whenever it stores a new response.
+
+A retry whose Accept-Encoding rules out the stored body's Content-Encoding
+gets the body decoded. Streamed responses (export files) and bodies over
+IDEMPOTENCY_MAX_BODY_BYTES are not stored; the record only remembers that
+the call was charged. The first retry of such a call runs the view again
+with api.credits.prepaid set, so it gets a fresh response without being
+charged again; later retries get 410 and need a new key.
+"""
+import functools
+import hashlib
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .async_db import run_in_db_pool
+from .compression import accepted_encodings, decode
+from .credits import prepaid
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def request_hash(request):
+    # An empty body (GET) adds nothing: the hash covers the method and URL only
+    return hashlib.sha256(f'{request.method} {request.get_full_path()}'.encode() + request.body).hexdigest()
+
+
+def error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def begin(request, key):
+    """
+    Claim the idempotency key for this request. Returns (record, None) when
+    the view should run, or (None, response) to answer without running it.
+    A completed record, returned as (record, None), means the view must run
+    again without charging (see rerun()); that happens once per record.
+    """
+    fingerprint = request_hash(request)
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.create(
+                    api_key=request.api_key,
+                    key=key,
+                    request_hash=fingerprint,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_TTL),
+                )
+            return record, None
+        except IntegrityError:
+            pass
+
+        existing = IdempotencyRecord.objects.filter(api_key=request.api_key, key=key).first()
+        if existing is None:
+            continue
+        abandoned = (
+            existing.status_code is None
+            and existing.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        )
+        if existing.expires_at <= now or abandoned:
+            # Expired, or left pending by a worker that died: start over
+            existing.delete()
+            continue
+        if existing.request_hash != fingerprint:
+            return None, error(f'{HEADER} was already used for a different request', 422)
+        if existing.status_code is None:
+            return None, error(f'A request with this {HEADER} is still being processed', 409)
+        if existing.has_body:
+            return None, replay(existing, request)
+        if IdempotencyRecord.objects.filter(pk=existing.pk, rerun=False).update(rerun=True):
+            return existing, None
+        return None, error(
+            f'The response for this {HEADER} was not kept and has already been re-sent once; '
+            f'use a new {HEADER}', 410
+        )
+
+    return None, error(f'Could not claim {HEADER}, please retry', 409)
+
+
+def replay(record, request):
+    """
+    The stored response, decoded when the retry does not accept its
+    Content-Encoding
+    """
+    body = bytes(record.body)
+    headers = dict(record.headers)
+    encoding = next((name for name in headers if name.lower() == 'content-encoding'), None)
+    if encoding is not None and headers[encoding].lower() not in accepted_encodings(request):
+        decoded = decode(body, headers[encoding])
+        if decoded is not None:
+            body = decoded
+            headers = {
+                name: value for name, value in headers.items()
+                if name.lower() not in ('content-encoding', 'content-length')
+            }
+    response = HttpResponse(body, status=record.status_code)
+    for name, value in headers.items():
+        response[name] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def finish(record, response):
+    """
+    Store a successful response for replay, or release the key. Streamed and
+    large responses only mark the call as charged.
+    """
+    if not 200 <= response.status_code < 300:
+        record.delete()
+        return
+    record.status_code = response.status_code
+    if response.streaming or len(response.content) > settings.IDEMPOTENCY_MAX_BODY_BYTES:
+        record.has_body = False
+    else:
+        record.headers = {name: value for name, value in response.items() if name.lower() != 'set-cookie'}
+        record.body = response.content
+    record.save(update_fields=['status_code', 'headers', 'body', 'has_body'])
+    prune(record.api_key_id)
+
+
+def rerun(view, request, *args, **kwargs):
+    """Run the view for a retry of an already charged call, without charging"""
+    token = prepaid.set(True)
+    try:
+        response = view(request, *args, **kwargs)
+    finally:
+        prepaid.reset(token)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+async def arerun(view, request, *args, **kwargs):
+    token = prepaid.set(True)
+    try:
+        response = await view(request, *args, **kwargs)
+    finally:
+        prepaid.reset(token)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def abort(record):
+    record.delete()
+
+
+def prune(api_key_id):
+    """Delete this API key's expired records, and its oldest beyond IDEMPOTENCY_MAX_RECORDS"""
+    records = IdempotencyRecord.objects.filter(api_key_id=api_key_id)
+    records.filter(expires_at__lte=timezone.now()).delete()
+    excess = list(
+        records
+        .order_by('-created_at')
+        .values_list('id', flat=True)[settings.IDEMPOTENCY_MAX_RECORDS:settings.IDEMPOTENCY_MAX_RECORDS + 500]
+    )
+    if excess:
+        IdempotencyRecord.objects.filter(id__in=excess).delete()
+
+
+def idempotency_key(request):
+    """The request's Idempotency-Key, '' when absent, or None when invalid"""
+    key = request.headers.get(HEADER, '')
+    if len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        return None
+    return key.strip()
+
+
+def idempotent(view):
+    """
+    Make a charged API view replay stored responses for repeated
+    Idempotency-Key values. Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            key = idempotency_key(request)
+            if key is None:
+                return error(f'{HEADER} must be at most {MAX_KEY_LENGTH} printable characters', 400)
+            if not key or not settings.IDEMPOTENCY_ENABLED:
+                return await view(request, *args, **kwargs)
+
+            record, response = await run_in_db_pool(begin, request, key)
+            if response is not None:
+                return response
+            if record.status_code is not None:
+                return await arerun(view, request, *args, **kwargs)
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await run_in_db_pool(abort, record)
+                raise
+            await run_in_db_pool(finish, record, response)
+            return response
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = idempotency_key(request)
+        if key is None:
+            return error(f'{HEADER} must be at most {MAX_KEY_LENGTH} printable characters', 400)
+        if not key or not settings.IDEMPOTENCY_ENABLED:
+            return view(request, *args, **kwargs)
+
+        record, response = begin(request, key)
+        if response is not None:
+            return response
+        if record.status_code is not None:
+            return rerun(view, request, *args, **kwargs)
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            abort(record)
+            raise
+        finish(record, response)
+        return response
+    return wrapper
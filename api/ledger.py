@@ -0,0 +1,151 @@
+"""
+Streaming exports of a user's credit ledger (CreditTransaction rows) for
+/api/credits/ledger and the dashboard.
+
+Rows are read oldest first in keyset batches of LEDGER_EXPORT_BATCH_SIZE:
+each batch is one short query on the (user, created_at, id) index that
+starts after the last row sent, so a ledger of any length is exported with
+one batch in memory and no read transaction or cursor is held open while a
+slow client downloads. The end of the range is fixed when the export starts,
+so transactions made during a long download do not leak into it.
+
+Django buffers a streaming response whose iterator does not match the
+server (a sync generator under ASGI, an async one under WSGI), so
+ledger_stream() returns an async generator, fetching batches on the database
+thread pool, when the app is served with async views.
+"""
+import csv
+import io
+from datetime import datetime, time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .async_db import run_in_db_pool
+from .models import CreditTransaction
+from .serializers import dumps
+
+LEDGER_FIELDS = ['id', 'created_at', 'transaction_type', 'amount', 'balance_after', 'description']
+
+
+class InvalidLedgerRange(ValueError):
+    pass
+
+
+def parse_bound(value, name):
+    """
+    An aware datetime from an ISO date (midnight) or datetime query value;
+    naive values are in TIME_ZONE. None when the value is empty.
+    """
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise InvalidLedgerRange(f'{name} must be an ISO date or datetime')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_ledger_range(params):
+    """(since, until) of the export: since is inclusive, until exclusive and defaults to now"""
+    since = parse_bound(params.get('since'), 'since')
+    until = parse_bound(params.get('until'), 'until') or timezone.now()
+    if since is not None and since >= until:
+        raise InvalidLedgerRange('since must be earlier than until')
+    return since, until
+
+
+def fetch_batch(user_id, since, until, after=None, size=None):
+    """
+    Up to `size` ledger rows of a user in [since, until), oldest first,
+    starting after the (created_at, id) key of the last row already sent
+    """
+    queryset = CreditTransaction.objects.filter(user_id=user_id, created_at__lt=until)
+    if after is not None:
+        # Range on created_at for the index; rows sharing the last timestamp
+        # are told apart by id
+        queryset = queryset.filter(created_at__gte=after[0]).exclude(created_at=after[0], id__lte=after[1])
+    elif since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    return list(
+        queryset.order_by('created_at', 'id')
+        .values_list(*LEDGER_FIELDS)[:size or settings.LEDGER_EXPORT_BATCH_SIZE]
+    )
+
+
+def _last_key(batch):
+    return batch[-1][1], batch[-1][0]
+
+
+def ledger_batches(user_id, since, until):
+    after = None
+    while True:
+        batch = fetch_batch(user_id, since, until, after)
+        if not batch:
+            return
+        yield batch
+        after = _last_key(batch)
+
+
+async def aledger_batches(user_id, since, until):
+    after = None
+    while True:
+        batch = await run_in_db_pool(fetch_batch, user_id, since, until, after)
+        if not batch:
+            return
+        yield batch
+        after = _last_key(batch)
+
+
+def render_csv(batch, header=False):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if header:
+        writer.writerow(LEDGER_FIELDS)
+    for row in batch:
+        writer.writerow([row[0], row[1].isoformat(), *row[2:]])
+    return output.getvalue().encode()
+
+
+def render_ndjson(batch, header=False):
+    return b''.join(
+        dumps(dict(zip(LEDGER_FIELDS, (row[0], row[1].isoformat(), *row[2:])))) + b'\n' for row in batch
+    )
+
+
+# format -> (content type, renderer of one batch)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'ndjson': ('application/x-ndjson', render_ndjson),
+}
+
+
+def _sync_stream(user_id, fmt, since, until):
+    render = FORMATS[fmt][1]
+    if fmt == 'csv':
+        yield render([], header=True)
+    for batch in ledger_batches(user_id, since, until):
+        yield render(batch)
+
+
+async def _async_stream(user_id, fmt, since, until):
+    render = FORMATS[fmt][1]
+    if fmt == 'csv':
+        yield render([], header=True)
+    async for batch in aledger_batches(user_id, since, until):
+        yield render(batch)
+
+
+def ledger_stream(user_id, fmt, since, until):
+    """Encoded chunks of the export, one per batch, from a generator matching the server"""
+    if settings.API_ASYNC_VIEWS:
+        return _async_stream(user_id, fmt, since, until)
+    return _sync_stream(user_id, fmt, since, until)
@@ -0,0 +1,144 @@
+"""
+Read-only copy of the location tables in a separate SQLite file.
+
+Locations are read far more often than they change, while the account
+tables in the default database take a write for every charged call. With
+LOCATION_DB_ENABLED, every new dataset version is copied from the default
+database (which stays the one that is written) into LOCATION_DB_PATH:
+
+* the copy is built under a temporary name, with the tables' indexes and
+  ANALYZE statistics, and renamed over the previous file, so readers see
+  either the old or the new version and never a partial one;
+* the file's `PRAGMA user_version` is its dataset version;
+* api.routers.LocationRouter sends Location and LocationSummary reads to it,
+  opened with `mode=ro&immutable=1` (no locks, no journal checks) and a large
+  mmap_size, so they are served straight from the page cache.
+
+Because a replaced file keeps its old inode, connections opened before a
+swap keep reading the old version; read_alias() closes them once the path
+points at a new file. Reads inside a transaction on the default database,
+and reads while the file is missing or behind the requested version, use the
+default database.
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+LOCATION_DB_ALIAS = 'locations'
+
+# Models whose tables are copied, by label
+LOCATION_MODELS = ('api.Location', 'api.LocationSummary')
+
+
+def location_db_uri(path):
+    return path.resolve().as_uri() + '?mode=ro&immutable=1'
+
+
+def file_version(path):
+    """Dataset version of a location database file, or 0 when unreadable"""
+    try:
+        db = sqlite3.connect(location_db_uri(path), uri=True)
+    except sqlite3.Error:
+        return 0
+    try:
+        return db.execute('PRAGMA user_version').fetchone()[0]
+    except sqlite3.Error:
+        return 0
+    finally:
+        db.close()
+
+
+_lock = threading.Lock()
+
+
+def build_location_db(version, force=False):
+    """
+    Copy the location tables of the default database into a new file for
+    dataset version `version` and swap it in. Does nothing when
+    LOCATION_DB_ENABLED is off or, unless forced, the file already has this
+    version or a newer one.
+    """
+    if not settings.LOCATION_DB_ENABLED:
+        return
+    from django.apps import apps
+
+    path = settings.LOCATION_DB_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tables = [apps.get_model(label)._meta.db_table for label in LOCATION_MODELS]
+    source = str(connections[DEFAULT_DB_ALIAS].settings_dict['NAME'])
+    tmp_path = path.with_name(f'.{path.stem}-v{version}.tmp')
+
+    with _lock:
+        if not force and path.exists() and file_version(path) >= version:
+            return
+        if tmp_path.exists():
+            tmp_path.unlink()
+        db = sqlite3.connect(tmp_path, isolation_level=None)
+        try:
+            # The file is renamed into place only once complete, so it needs no journal
+            db.execute('PRAGMA journal_mode = OFF')
+            db.execute('PRAGMA synchronous = OFF')
+            db.execute('ATTACH DATABASE ? AS source', (source,))
+            # One read transaction, so all tables come from the same commit
+            db.execute('BEGIN')
+            for table in tables:
+                schema = db.execute(
+                    "SELECT type, sql FROM source.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL",
+                    (table,)
+                ).fetchall()
+                for kind, sql in schema:
+                    if kind == 'table':
+                        db.execute(sql)
+                db.execute(f'INSERT INTO main."{table}" SELECT * FROM source."{table}"')
+                # Indexes are faster to build after the rows are in
+                for kind, sql in schema:
+                    if kind == 'index':
+                        db.execute(sql)
+            db.execute('COMMIT')
+            db.execute('DETACH DATABASE source')
+            db.execute('ANALYZE')
+            db.execute(f'PRAGMA user_version = {int(version)}')
+        except BaseException:
+            db.close()
+            tmp_path.unlink()
+            raise
+        db.close()
+
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    logger.info('Location database is now at dataset version %s', version)
+
+
+def read_alias(version=None):
+    """
+    Database alias to read location tables from in this thread: the
+    location database, unless it is disabled, missing, older than `version`
+    (when given) or the default database is in a transaction
+    """
+    if not settings.LOCATION_DB_ENABLED or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    try:
+        inode = os.stat(settings.LOCATION_DB_PATH).st_ino
+    except FileNotFoundError:
+        return DEFAULT_DB_ALIAS
+
+    connection = connections[LOCATION_DB_ALIAS]
+    if connection.connection is not None and getattr(connection, 'location_db_inode', None) != inode:
+        # The file was swapped since this connection opened it
+        connection.close()
+    if connection.connection is None:
+        connection.location_db_inode = inode
+
+    if version is not None:
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] < version:
+                return DEFAULT_DB_ALIAS
+    return LOCATION_DB_ALIAS
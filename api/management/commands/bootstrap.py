@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from api.exports import write_exports
+from api.location_db import build_location_db
+from api.models import DatasetVersion, Location
+from api.snapshot import LocationSnapshot
+import io
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Prepare a container in one process: migrate, set up the admin user, load the location '
+        'data on first run and warm the caches, reporting the time of each phase'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--load', choices=['auto', 'always', 'never'], default='auto',
+            help='Load the SF Express data: on first run (auto, the default), always or never'
+        )
+        parser.add_argument(
+            '--no-warm', action='store_true',
+            help='Skip building the location snapshot, location database and export files'
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        # Marker shared with earlier entrypoints: the data was loaded once
+        self.marker = settings.DATA_DIR / '.initialized'
+        self.timings = []
+        start = time.perf_counter()
+
+        self.phase('migrate', self.migrate)
+        self.phase('admin', self.setup_admin)
+        if self.should_load(options['load']):
+            self.phase('load', self.load)
+        else:
+            self.stdout.write('Location data already loaded, skipping')
+        if not options['no_warm']:
+            self.phase('warm', self.warm)
+
+        total = time.perf_counter() - start
+        summary = ', '.join(f'{name} {elapsed:.2f}s' for name, elapsed in self.timings)
+        self.stdout.write(self.style.SUCCESS(f'Bootstrap finished in {total:.2f}s ({summary})'))
+
+    def phase(self, name, func):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        self.timings.append((name, elapsed))
+        self.stdout.write(f'{name}: {elapsed:.2f}s')
+
+    def command_output(self):
+        """Where sub-command output goes: shown with -v 2 and above"""
+        return self.stdout if self.verbosity > 1 else io.StringIO()
+
+    def migrate(self):
+        call_command('migrate', interactive=False, verbosity=self.verbosity, stdout=self.command_output())
+
+    def setup_admin(self):
+        call_command('setup_admin', stdout=self.stdout)
+
+    def should_load(self, mode):
+        if mode != 'auto':
+            return mode == 'always'
+        return not self.marker.exists() or not Location.objects.exists()
+
+    def load(self):
+        call_command('load_sfexpress_data', stdout=self.command_output())
+        self.marker.touch()
+        self.stdout.write(f'Loaded dataset version {DatasetVersion.current()}')
+
+    def warm(self):
+        """
+        Bring everything the workers read at startup up to date: the location
+        database file, the location rows in the shared cache (so workers load
+        them instead of querying) and the export files. Each step only does
+        work that is missing for the current dataset version.
+        """
+        build_location_db(DatasetVersion.current())
+        snapshot = LocationSnapshot.build()
+        write_exports(snapshot)
+        with connection.cursor() as cursor:
+            # Refresh query planner statistics where SQLite thinks they are stale
+            cursor.execute('PRAGMA optimize')
+        self.stdout.write(f'Warmed dataset version {snapshot.version} ({len(snapshot)} locations)')
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.location_db import LOCATION_DB_ALIAS, build_location_db, file_version
+from api.models import DatasetVersion
+
+
+class Command(BaseCommand):
+    help = 'Write the read-only location database for the current dataset version (LOCATION_DB_ENABLED)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild even if the file is up to date')
+
+    def handle(self, *args, **options):
+        if not settings.LOCATION_DB_ENABLED:
+            raise CommandError('LOCATION_DB_ENABLED is off; the location database is not used')
+        version = DatasetVersion.current()
+        build_location_db(version, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{LOCATION_DB_ALIAS} database {settings.LOCATION_DB_PATH} is at dataset version '
+            f'{file_version(settings.LOCATION_DB_PATH)}'
+        ))
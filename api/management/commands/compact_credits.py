@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from api.credits import compact_credit_stripes
+import time
+
+
+class Command(BaseCommand):
+    help = 'Fold striped credit counters back into CreditBalance (run periodically when CREDIT_STRIPES > 0)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='Only compact this user')
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running and compact every INTERVAL seconds'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = compact_credit_stripes(options['user_id'])
+            self.stdout.write(self.style.SUCCESS(f'Compacted credit stripes for {count} users'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,309 @@
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from api.location_db import build_location_db
+from api.models import APIKey, CreditBalance, CreditTransaction, DatasetVersion, Location, User
+from datetime import timedelta
+from itertools import islice
+import base64
+import random
+import time
+
+USERNAME_PREFIX = 'synthetic_'
+
+# district, area, relative weight, latitude, longitude
+# Weights follow the district mix of the docs/ dataset
+DISTRICTS = [
+    ('Central', 'Hong Kong Island', 4, 22.2819, 114.1582),
+    ('Sheung Wan', 'Hong Kong Island', 6, 22.2866, 114.1508),
+    ('Sai Ying Pun', 'Hong Kong Island', 5, 22.2855, 114.1426),
+    ('Kennedy Town', 'Hong Kong Island', 7, 22.2813, 114.1289),
+    ('Mid-Levels', 'Hong Kong Island', 4, 22.2793, 114.1515),
+    ('Wan Chai', 'Hong Kong Island', 10, 22.2776, 114.1731),
+    ('Causeway Bay', 'Hong Kong Island', 6, 22.2803, 114.1838),
+    ('North Point', 'Hong Kong Island', 15, 22.2913, 114.2006),
+    ('Quarry Bay', 'Hong Kong Island', 11, 22.2880, 114.2135),
+    ('Chai Wan', 'Hong Kong Island', 13, 22.2646, 114.2371),
+    ('Siu Sai Wan', 'Hong Kong Island', 12, 22.2622, 114.2496),
+    ('Heng Fa Chuen', 'Hong Kong Island', 13, 22.2767, 114.2399),
+    ('Aberdeen', 'Hong Kong Island', 6, 22.2480, 114.1540),
+    ('Ap Lei Chau', 'Hong Kong Island', 8, 22.2421, 114.1540),
+    ('Wong Chuk Hang', 'Hong Kong Island', 5, 22.2480, 114.1680),
+    ('Stanley', 'Hong Kong Island', 2, 22.2189, 114.2101),
+    ('Tsim Sha Tsui', 'Kowloon', 27, 22.2976, 114.1722),
+    ('Jordan', 'Kowloon', 11, 22.3049, 114.1717),
+    ('Yau Ma Tei', 'Kowloon', 6, 22.3126, 114.1706),
+    ('Mong Kok', 'Kowloon', 13, 22.3193, 114.1694),
+    ('Prince Edward', 'Kowloon', 23, 22.3245, 114.1683),
+    ('Sham Shui Po', 'Kowloon', 10, 22.3307, 114.1622),
+    ('Cheung Sha Wan', 'Kowloon', 8, 22.3355, 114.1559),
+    ('Lai Chi Kok', 'Kowloon', 19, 22.3372, 114.1480),
+    ('Hung Hom', 'Kowloon', 18, 22.3036, 114.1818),
+    ('To Kwa Wan', 'Kowloon', 17, 22.3165, 114.1877),
+    ('Kai Tak', 'Kowloon', 18, 22.3282, 114.1986),
+    ('Kowloon City', 'Kowloon', 4, 22.3282, 114.1916),
+    ('Wong Tai Sin', 'Kowloon', 14, 22.3419, 114.1953),
+    ('Tsz Wan Shan', 'Kowloon', 16, 22.3515, 114.1985),
+    ('Diamond Hill', 'Kowloon', 3, 22.3400, 114.2016),
+    ('Kowloon Bay', 'Kowloon', 13, 22.3234, 114.2141),
+    ('Ngau Tau Kok', 'Kowloon', 9, 22.3156, 114.2190),
+    ('Kwun Tong', 'Kowloon', 27, 22.3123, 114.2258),
+    ('Lam Tin', 'Kowloon', 14, 22.3067, 114.2332),
+    ('Yau Tong', 'Kowloon', 11, 22.2978, 114.2375),
+    ('Sau Mau Ping', 'Kowloon', 14, 22.3170, 114.2320),
+    ('Sha Tin', 'New Territories', 35, 22.3817, 114.1877),
+    ('Tai Wai', 'New Territories', 31, 22.3728, 114.1785),
+    ('Fo Tan', 'New Territories', 16, 22.3958, 114.1983),
+    ('Ma On Shan', 'New Territories', 57, 22.4246, 114.2317),
+    ('Tai Po', 'New Territories', 64, 22.4501, 114.1688),
+    ('Fanling', 'New Territories', 20, 22.4920, 114.1387),
+    ('Sheung Shui', 'New Territories', 114, 22.5016, 114.1281),
+    ('Yuen Long', 'New Territories', 76, 22.4445, 114.0222),
+    ('Tin Shui Wai', 'New Territories', 35, 22.4586, 114.0046),
+    ('Tuen Mun', 'New Territories', 6, 22.3908, 113.9725),
+    ('Sham Tseng', 'New Territories', 51, 22.3677, 114.0573),
+    ('Tsuen Wan', 'New Territories', 3, 22.3707, 114.1140),
+    ('Kwai Chung', 'New Territories', 40, 22.3630, 114.1310),
+    ('Tsing Yi', 'New Territories', 24, 22.3486, 114.1026),
+    ('Tseung Kwan O', 'New Territories', 53, 22.3075, 114.2600),
+    ('Sai Kung', 'New Territories', 4, 22.3814, 114.2705),
+    ('Tung Chung', 'Lantau Island', 11, 22.2890, 113.9410),
+    ('Discovery Bay', 'Lantau Island', 3, 22.2950, 114.0160),
+    ('Macau Peninsula', 'Macau', 3, 22.1937, 113.5449),
+    ('Areia Preta', 'Macau', 1, 22.2105, 113.5535),
+    ('Taipa', 'Macau', 1, 22.1560, 113.5560),
+    ('Cotai', 'Macau', 1, 22.1447, 113.5641),
+]
+
+LOCKER_HOURS = [('24/7', 80), ('07:00-23:00', 5), ('06:00-23:59', 3), ('08:00-22:00', 2), ('10:00-22:00', 3)]
+SHOP_HOURS = [
+    ('09:00-20:00', 4),
+    ('Mon-Sat: 09:00-20:00, Sun/Holidays: 09:00-18:00', 3),
+    ('Mon-Fri: 9:00-19:00, Sat: 9:00-17:00', 2),
+    ('10:00-22:00', 1),
+]
+STREETS = ['Main Street', 'Road', 'Avenue', 'Path', 'Lane', 'Terrace']
+BUILDINGS = ['Plaza', 'Centre', 'Mansion', 'Court', 'Garden', 'Building', 'Estate', 'Tower']
+LOCATION_PHONE = '+852-2730-0273'
+TRANSACTION_MIX = [('API_CALL', 90), ('PURCHASE', 8), ('REFUND', 1), ('ADMIN_ADJUSTMENT', 1)]
+
+# Columns written by the raw inserts, in the order of the generated tuples
+LOCATION_FIELDS = [
+    'location_type', 'name', 'address', 'district', 'latitude', 'longitude', 'phone', 'opening_hours',
+    'is_active', 'created_at', 'updated_at',
+]
+TRANSACTION_FIELDS = ['user', 'transaction_type', 'amount', 'balance_after', 'description', 'created_at']
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+class Command(BaseCommand):
+    help = 'Generate a reproducible synthetic dataset of locations, users, API keys and ledger rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--locations', type=int, default=100000, help='Locations to create (default: 100000)')
+        parser.add_argument('--users', type=int, default=1000, help='Users to create (default: 1000)')
+        parser.add_argument('--keys-per-user', type=int, default=2, help='API keys per user (default: 2)')
+        parser.add_argument(
+            '--transactions', type=int, default=100000,
+            help='Historical credit transactions spread over the users (default: 100000)'
+        )
+        parser.add_argument('--days', type=int, default=365, help='Ledger history length in days (default: 365)')
+        parser.add_argument('--locker-ratio', type=float, default=0.9, help='Share of lockers (default: 0.9)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--batch-size', type=int, default=50000, help='Rows per INSERT batch (default: 50000)')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete all locations and previously generated users first'
+        )
+
+    def handle(self, *args, **options):
+        if options['transactions'] and not options['users']:
+            raise CommandError('--transactions requires at least one user')
+
+        self.seed = options['seed']
+        self.rng = random.Random(self.seed)
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        # One transaction: a failure leaves no partial dataset or version bump behind
+        with transaction.atomic():
+            if options['clear']:
+                Location.objects.all().delete()
+                User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+                self.stdout.write('Cleared existing locations and synthetic users')
+
+            if options['locations']:
+                self.timed('locations', self.generate_locations, options['locations'], options['locker_ratio'])
+                version = DatasetVersion.bump('synthetic')
+                transaction.on_commit(lambda: build_location_db(version.id))
+                self.stdout.write(f'Dataset version: {version.id}')
+            if options['users']:
+                user_ids = self.timed('users', self.generate_users, options['users'])
+                self.timed('API keys', self.generate_api_keys, user_ids, options['keys_per_user'])
+                self.timed('credit balances', self.generate_balances, user_ids)
+                if options['transactions']:
+                    self.timed(
+                        'transactions', self.generate_transactions,
+                        user_ids, options['transactions'], options['days']
+                    )
+
+    def timed(self, label, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        count = len(result) if isinstance(result, list) else result
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {count} {label} in {elapsed:.2f}s ({count / elapsed if elapsed else 0:,.0f} rows/s)'
+        ))
+        return result
+
+    def insert(self, model, rows):
+        """bulk_create an iterable of unsaved instances in batches; returns the row count"""
+        count = 0
+        batch = []
+        with transaction.atomic():
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    model.objects.bulk_create(batch, batch_size=self.batch_size)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+                count += len(batch)
+        return count
+
+    def insert_rows(self, model, fields, rows):
+        """
+        INSERT an iterable of value tuples for `fields` with executemany, in
+        batches on one connection and in one transaction; returns the row
+        count. Skips model instances and per-value field preparation, which
+        took most of the time with bulk_create, so values must already be
+        in database form.
+        """
+        meta = model._meta
+        columns = ', '.join(connection.ops.quote_name(meta.get_field(name).column) for name in fields)
+        sql = (
+            f'INSERT INTO {connection.ops.quote_name(meta.db_table)} ({columns}) '
+            f'VALUES ({", ".join(["%s"] * len(fields))})'
+        )
+        rows = iter(rows)
+        count = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            while batch := list(islice(rows, self.batch_size)):
+                cursor.executemany(sql, batch)
+                count += len(batch)
+        return count
+
+    def generate_locations(self, count, locker_ratio):
+        rng = self.rng
+        districts = [d[:2] + d[3:] for d in DISTRICTS]
+        weights = [d[2] for d in DISTRICTS]
+        picks = rng.choices(districts, weights=weights, k=count)
+
+        def rows():
+            for index, (district, area, lat, lon) in enumerate(picks, start=1):
+                is_locker = rng.random() < locker_ratio
+                region = 'Macau' if area == 'Macau' else 'Hong Kong'
+                building = f'{rng.choice(["Fortune", "Golden", "Harbour", "Peak", "Ocean", "Grand"])} {rng.choice(BUILDINGS)}'
+                address = (
+                    f'Shop {rng.randint(1, 400)}, {rng.choice(["G/F", "1/F", "2/F", "3/F"])}, {building}, '
+                    f'{rng.randint(1, 300)} {district} {rng.choice(STREETS)}, {district}, {area}, {region}'
+                )
+                if is_locker:
+                    name = f'SF Locker H852{index:07d}P - {district}'
+                    hours = weighted(rng, LOCKER_HOURS)
+                else:
+                    name = f'SF Store {index:07d} - {district}'
+                    hours = weighted(rng, SHOP_HOURS)
+                yield (
+                    'LOCKER' if is_locker else 'SHOP',
+                    name,
+                    address,
+                    district,
+                    round(lat + rng.gauss(0, 0.006), 6),
+                    round(lon + rng.gauss(0, 0.006), 6),
+                    LOCATION_PHONE,
+                    hours,
+                    rng.random() > 0.02,
+                    now,
+                    now,
+                )
+
+        now = connection.ops.adapt_datetimefield_value(self.now)
+        return self.insert_rows(Location, LOCATION_FIELDS, rows())
+
+    def generate_users(self, count):
+        start = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        self.first_user = start + 1
+        # Hashing a password per user would dominate the run time
+        password = make_password(None)
+        usernames = [f'{USERNAME_PREFIX}{start + i:07d}' for i in range(1, count + 1)]
+        self.insert(User, (
+            User(username=username, email=f'{username}@example.com', password=password)
+            for username in usernames
+        ))
+        return list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+
+    def generate_api_keys(self, user_ids, keys_per_user):
+        rng = self.rng
+        # Seeded with the run's first username number as well, so that a run
+        # adding users to an earlier one does not repeat its keys
+        key_rng = random.Random(f'{self.seed}:{self.first_user}')
+        return self.insert(APIKey, (
+            APIKey(
+                user_id=user_id,
+                # Same length and alphabet as APIKey.generate_key(), but seeded
+                key=base64.urlsafe_b64encode(key_rng.randbytes(48)).decode(),
+                name=f'Key {n + 1}',
+                rate_limit_tier=weighted(rng, [('FREE', 6), ('STANDARD', 3), ('PREMIUM', 1)]),
+            )
+            for user_id in user_ids
+            for n in range(keys_per_user)
+        ))
+
+    def generate_balances(self, user_ids):
+        rng = self.rng
+
+        def rows():
+            for user_id in user_ids:
+                earned = rng.choice([100, 500, 1000, 5000, 10000])
+                spent = rng.randrange(0, earned + 1, 5)
+                yield CreditBalance(user_id=user_id, credits=earned - spent, total_earned=earned, total_spent=spent)
+
+        return self.insert(CreditBalance, rows())
+
+    def generate_transactions(self, user_ids, count, days):
+        rng = self.rng
+        span = days * 86400
+        # Skew activity towards a minority of heavy users
+        weights = [rng.paretovariate(1.5) for _ in user_ids]
+        owners = rng.choices(user_ids, weights=weights, k=count)
+
+        def rows():
+            for user_id in owners:
+                kind = weighted(rng, TRANSACTION_MIX)
+                if kind == 'API_CALL':
+                    amount, description = -5, f'Location query: {rng.randint(0, 1200)} results'
+                elif kind == 'PURCHASE':
+                    amount, description = rng.choice([100, 500, 1000]), 'Credit purchase'
+                elif kind == 'REFUND':
+                    amount, description = 5, 'Refund'
+                else:
+                    amount, description = rng.choice([-100, 100]), 'Admin adjustment'
+                yield (
+                    user_id,
+                    kind,
+                    amount,
+                    rng.randint(0, 10000),
+                    description,
+                    adapt_datetime(self.now - timedelta(seconds=rng.randrange(span))),
+                )
+
+        adapt_datetime = connection.ops.adapt_datetimefield_value
+        return self.insert_rows(CreditTransaction, TRANSACTION_FIELDS, rows())
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from api.models import Location
+from api.location_db import build_location_db
+from api.models import DatasetVersion, Location
 
 
 class Command(BaseCommand):
@@ -140,6 +141,10 @@ class Command(BaseCommand):
                     self.style.WARNING(f'Already exists: {location.name}')
                 )
 
+        if created_count:
+            version = DatasetVersion.bump('sample_data')
+            build_location_db(version.id)
+
         self.stdout.write(
             self.style.SUCCESS(f'\nSuccessfully loaded {created_count} new locations!')
         )
@@ -1,8 +1,18 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from api.models import Location
+from django.db import transaction
+from django.utils import timezone
+from api.exports import export_current_version
+from api.location_db import build_location_db
+from api.models import DatasetVersion, Location
+from collections import defaultdict
+from contextlib import nullcontext
 from html.parser import HTMLParser
+import cProfile
 import re
 import os
+import time
+import tracemalloc
 
 
 class TableExtractor(HTMLParser):
@@ -42,10 +52,160 @@ class TableExtractor(HTMLParser):
             self.cell_data += data
 
 
+class StageProfiler:
+    """
+    Exclusive wall time, row counts and (optionally) peak traced memory per
+    (source file, stage). Time spent in a nested stage is not counted in
+    its parent.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.file = '-'
+        # (file, stage) -> {'seconds', 'rows', 'peak'}
+        self.stats = {}
+        self.stack = []
+
+    def entry(self, stage):
+        return self.stats.setdefault((self.file, stage), {'seconds': 0.0, 'rows': 0, 'peak': 0})
+
+    def stage(self, stage):
+        return _Stage(self, stage)
+
+    def count(self, stage, rows=1):
+        self.entry(stage)['rows'] += rows
+
+    def report(self):
+        """Rows of (file, stage, seconds, rows, rows/s, peak MB), with per-file totals"""
+        rows = []
+        files = dict.fromkeys(file for file, _ in self.stats)
+        for file in files:
+            total_seconds = 0.0
+            total_peak = 0
+            for (entry_file, stage), entry in self.stats.items():
+                if entry_file != file:
+                    continue
+                total_seconds += entry['seconds']
+                total_peak = max(total_peak, entry['peak'])
+                rate = entry['rows'] / entry['seconds'] if entry['seconds'] and entry['rows'] else None
+                rows.append((file, stage, entry['seconds'], entry['rows'], rate, entry['peak']))
+            rows.append((file, 'total', total_seconds, None, None, total_peak))
+        return rows
+
+
+class _Stage:
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.trace_memory:
+            if profiler.stack:
+                # Bank the parent's peak before resetting it for this stage
+                parent = profiler.stack[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.peak = 0
+        self.children = 0.0
+        profiler.stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        profiler = self.profiler
+        profiler.stack.pop()
+        entry = profiler.entry(self.stage)
+        entry['seconds'] += elapsed - self.children
+        if profiler.trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            entry['peak'] = max(entry['peak'], self.peak)
+        if profiler.stack:
+            parent = profiler.stack[-1]
+            parent.children += elapsed
+            parent.peak = max(parent.peak, self.peak)
+        return False
+
+
 class Command(BaseCommand):
     help = 'Load SF Express locations from HTML files in docs/ directory'
+    profiler = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='Report wall time and rows/s per stage and source file'
+        )
+        parser.add_argument(
+            '--profile-output', metavar='FILE',
+            help='Also run under cProfile and write the stats to FILE (implies --profile)'
+        )
+        parser.add_argument(
+            '--trace-memory', action='store_true',
+            help='Report peak traced memory per stage (implies --profile, slows the load down)'
+        )
+        parser.add_argument(
+            '--trace-memory-output', metavar='FILE',
+            help='Write a tracemalloc snapshot taken at the end of the load to FILE (implies --trace-memory)'
+        )
 
     def handle(self, *args, **options):
+        trace_memory = options['trace_memory'] or bool(options['trace_memory_output'])
+        profiling = options['profile'] or bool(options['profile_output']) or trace_memory
+        self.profiler = StageProfiler(trace_memory) if profiling else None
+
+        cprofile = cProfile.Profile() if options['profile_output'] else None
+        if trace_memory:
+            tracemalloc.start()
+        if cprofile:
+            cprofile.enable()
+        try:
+            self.load()
+        finally:
+            if cprofile:
+                cprofile.disable()
+                cprofile.dump_stats(options['profile_output'])
+                self.stdout.write(f'cProfile stats written to {options["profile_output"]}')
+            if trace_memory:
+                if options['trace_memory_output']:
+                    tracemalloc.take_snapshot().dump(options['trace_memory_output'])
+                    self.stdout.write(f'tracemalloc snapshot written to {options["trace_memory_output"]}')
+                tracemalloc.stop()
+
+        if self.profiler:
+            self.print_profile()
+
+    def stage(self, name):
+        """Time a stage of the load when profiling, otherwise do nothing"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name)
+
+    def count(self, name, rows=1):
+        if self.profiler is not None:
+            self.profiler.count(name, rows)
+
+    def set_source(self, file_path):
+        if self.profiler is not None:
+            self.profiler.file = os.path.basename(file_path) if file_path else '-'
+
+    def print_profile(self):
+        self.stdout.write('\nLoad profile:')
+        header = f'{"file":<26} {"stage":<10} {"seconds":>9} {"rows":>7} {"rows/s":>10}'
+        if self.profiler.trace_memory:
+            header += f' {"peak MB":>9}'
+        self.stdout.write(header)
+        for file, stage, seconds, rows, rate, peak in self.profiler.report():
+            line = (
+                f'{file:<26} {stage:<10} {seconds:>9.3f} {"" if rows is None else rows:>7} '
+                f'{"" if rate is None else f"{rate:,.0f}":>10}'
+            )
+            if self.profiler.trace_memory:
+                line += f' {peak / 1024 / 1024:>9.2f}'
+            self.stdout.write(line)
+
+    def load(self):
         self.stdout.write('Loading SF Express location data from HTML files...\n')
 
         docs_dir = 'docs'
@@ -53,33 +213,54 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f'Error: {docs_dir}/ directory not found'))
             return
 
-        # Clear existing locations
-        Location.objects.all().delete()
-        self.stdout.write('Cleared existing location data')
-
+        # Parsed locations, synced against the database once all files are read
+        self.parsed = []
         total_created = 0
 
         # Load lockers
         locker_file = os.path.join(docs_dir, 'SF Locker.html')
         if os.path.exists(locker_file):
-            count = self.load_lockers(locker_file)
+            with self.stage('classify'):
+                count = self.load_lockers(locker_file)
             total_created += count
             self.stdout.write(self.style.SUCCESS(f'Loaded {count} locker locations'))
 
         # Load stores
         store_file = os.path.join(docs_dir, 'SF Store.html')
         if os.path.exists(store_file):
-            count = self.load_stores(store_file)
+            with self.stage('classify'):
+                count = self.load_stores(store_file)
             total_created += count
             self.stdout.write(self.style.SUCCESS(f'Loaded {count} store locations'))
 
         # Load business stations
         business_file = os.path.join(docs_dir, 'SF Business Station.html')
         if os.path.exists(business_file):
-            count = self.load_business_stations(business_file)
+            with self.stage('classify'):
+                count = self.load_business_stations(business_file)
             total_created += count
             self.stdout.write(self.style.SUCCESS(f'Loaded {count} business station locations'))
 
+        self.set_source(None)
+        with self.stage('sync'):
+            upserted, deleted = self.sync_locations(self.parsed)
+        self.count('sync', len(self.parsed))
+        self.stdout.write(f'Synced locations: {len(upserted)} created or updated, {len(deleted)} deleted')
+
+        if upserted or deleted:
+            with self.stage('publish'):
+                version = DatasetVersion.publish('loader', upserted=upserted, deleted=deleted)
+            self.stdout.write(f'Published dataset version {version.id}')
+            if settings.LOCATION_DB_ENABLED:
+                with self.stage('location_db'):
+                    build_location_db(version.id)
+                self.stdout.write(f'Wrote location database {settings.LOCATION_DB_PATH}')
+            with self.stage('export'):
+                export_current_version()
+            self.stdout.write('Wrote export files')
+        else:
+            self.stdout.write('No changes; dataset version unchanged')
+
         self.stdout.write(self.style.SUCCESS(f'\n✓ Successfully loaded {total_created} total locations!'))
 
     def extract_code_from_text(self, text):
@@ -103,8 +284,81 @@ class Command(BaseCommand):
             return 'Closed'
         return hours_text
 
+    def parse_file(self, file_path):
+        """Read an HTML export and extract its table rows"""
+        self.set_source(file_path)
+        with self.stage('read'):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                html = f.read()
+        with self.stage('parse'):
+            parser = TableExtractor()
+            parser.feed(html)
+        self.count('parse', len(parser.rows))
+        self.count('classify', len(parser.rows))
+        return parser
+
+    def create_location(self, **fields):
+        """
+        Queue a parsed location for sync_locations(). Raises ValidationError
+        for a row the database would reject, so that the caller skips it
+        instead of it failing the batched insert of every row.
+        """
+        Location(**fields).full_clean(validate_unique=False, validate_constraints=False)
+        self.parsed.append(fields)
+
+    # Fields the loader sets on a location besides its natural key
+    SYNCED_FIELDS = ('district', 'phone', 'opening_hours', 'is_active')
+
+    def sync_locations(self, parsed):
+        """
+        Bring the Location table in line with the parsed rows and return the
+        ids of created or updated and of deleted locations.
+
+        Rows are matched on (location_type, name, address), so unchanged
+        locations keep their ids and only real differences reach the change
+        log used by /api/locations/changes. Locations the files no longer
+        list (including ones added in the admin) are deleted, as before.
+        """
+        existing = defaultdict(list)
+        for location in Location.objects.order_by('id'):
+            existing[(location.location_type, location.name, location.address)].append(location)
+
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        for fields in parsed:
+            matches = existing.get((fields['location_type'], fields['name'], fields['address']))
+            if not matches:
+                to_create.append(Location(**fields))
+                continue
+            location = matches.pop(0)
+            changed = [name for name in self.SYNCED_FIELDS if getattr(location, name) != fields[name]]
+            if changed:
+                for name in changed:
+                    setattr(location, name, fields[name])
+                location.updated_at = now
+                to_update.append(location)
+
+        deleted = [location.pk for matches in existing.values() for location in matches]
+
+        with transaction.atomic():
+            for start in range(0, len(deleted), 500):
+                Location.objects.filter(pk__in=deleted[start:start + 500]).delete()
+            if to_update:
+                Location.objects.bulk_update(to_update, self.SYNCED_FIELDS + ('updated_at',), batch_size=500)
+            # SQLite returns the new primary keys from bulk_create
+            created = Location.objects.bulk_create(to_create, batch_size=500)
+
+        upserted = [location.pk for location in created] + [location.pk for location in to_update]
+        return upserted, deleted
+
     def extract_district_from_address(self, address):
         """Extract district name from address string"""
+        self.count('district')
+        with self.stage('district'):
+            return self._extract_district_from_address(address)
+
+    def _extract_district_from_address(self, address):
         # Common Hong Kong districts and areas
         districts = [
             # New Territories
@@ -138,9 +392,7 @@ class Command(BaseCommand):
 
     def load_lockers(self, file_path):
         """Load SF Locker locations"""
-        parser = TableExtractor()
-        with open(file_path, 'r', encoding='utf-8') as f:
-            parser.feed(f.read())
+        parser = self.parse_file(file_path)
 
         created_count = 0
         header_indices = []
@@ -227,7 +479,7 @@ class Command(BaseCommand):
                     location_name = f"SF Locker - {district}{name_suffix}"
 
                 try:
-                    Location.objects.create(
+                    self.create_location(
                         location_type='LOCKER',
                         name=location_name,
                         address=address,
@@ -244,9 +496,7 @@ class Command(BaseCommand):
 
     def load_stores(self, file_path):
         """Load SF Store locations"""
-        parser = TableExtractor()
-        with open(file_path, 'r', encoding='utf-8') as f:
-            parser.feed(f.read())
+        parser = self.parse_file(file_path)
 
         created_count = 0
 
@@ -296,7 +546,7 @@ class Command(BaseCommand):
                 is_macau = 'Macau' in address or district == 'Macau'
                 phone = '+853-2873-7373' if is_macau else '+852-2730-0273'
 
-                Location.objects.create(
+                self.create_location(
                     location_type='SHOP',
                     name=f"SF Store - {district}",
                     address=address,
@@ -313,9 +563,7 @@ class Command(BaseCommand):
 
     def load_business_stations(self, file_path):
         """Load SF Business Station locations"""
-        parser = TableExtractor()
-        with open(file_path, 'r', encoding='utf-8') as f:
-            parser.feed(f.read())
+        parser = self.parse_file(file_path)
 
         created_count = 0
 
@@ -357,7 +605,7 @@ class Command(BaseCommand):
             phone = '+853-2873-7373' if is_macau else '+852-2730-0273'
 
             try:
-                Location.objects.create(
+                self.create_location(
                     location_type='SHOP',
                     name=f"SF Business Station - {district}",
                     address=address,
@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.nearest import CHUNK_SIZE, numpy_available
+from api.snapshot import LocationSnapshot
+from itertools import islice
+import csv
+import sys
+import time
+
+MATCH_FIELDS = ['rank', 'location_id', 'location_name', 'location_district', 'distance_km']
+
+
+class Command(BaseCommand):
+    help = (
+        'Find the nearest locations of every origin in a CSV file with latitude and longitude '
+        'columns, writing one row per origin and rank (the offline counterpart of '
+        '/api/locations/nearest-bulk)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="CSV file of origins, or '-' for standard input")
+        parser.add_argument('-o', '--output', default='-', help="CSV file to write (default: standard output)")
+        parser.add_argument('-k', type=int, default=1, help='Locations per origin (default: 1)')
+        parser.add_argument('--type', choices=['LOCKER', 'SHOP'], help='Only match this location type')
+
+    def handle(self, *args, **options):
+        if not numpy_available():
+            raise CommandError('nearest_locations needs the numpy package (uv sync --extra numpy)')
+        if options['k'] < 1:
+            raise CommandError('-k must be at least 1')
+
+        start = time.perf_counter()
+        snapshot = LocationSnapshot.build()
+        index = snapshot.nearest_index(options['type'])
+
+        source = sys.stdin if options['input'] == '-' else open(options['input'], newline='', encoding='utf-8-sig')
+        target = sys.stdout if options['output'] == '-' else open(options['output'], 'w', newline='', encoding='utf-8')
+        try:
+            origins, skipped = self.match(snapshot, index, source, target, options['k'])
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if target is not sys.stdout:
+                target.close()
+
+        # Keep standard output clean when the results go there
+        out = self.stderr if options['output'] == '-' else self.stdout
+        out.write(self.style.SUCCESS(
+            f'Matched {origins - skipped} origins against {len(index)} locations in '
+            f'{time.perf_counter() - start:.2f}s ({skipped} without valid coordinates)'
+        ))
+
+    def match(self, snapshot, index, source, target, k):
+        """Stream origins through the index CHUNK_SIZE rows at a time; returns (origins, skipped)"""
+        reader = csv.DictReader(source)
+        if not {'latitude', 'longitude'} <= set(reader.fieldnames or ()):
+            raise CommandError('The input needs a header row with latitude and longitude columns')
+        writer = csv.DictWriter(target, fieldnames=reader.fieldnames + MATCH_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+
+        origins = skipped = 0
+        while True:
+            rows = list(islice(reader, CHUNK_SIZE))
+            if not rows:
+                return origins, skipped
+            coordinates = [self.coordinates(row) for row in rows]
+            valid = [pair for pair in coordinates if pair is not None]
+            matches = []
+            for ids, distances in index.query(
+                [pair[0] for pair in valid], [pair[1] for pair in valid], k
+            ):
+                matches.extend(zip(ids.tolist(), distances.round(3).tolist()))
+
+            matches = iter(matches)
+            for row, pair in zip(rows, coordinates):
+                origins += 1
+                found = next(matches) if pair is not None else ([], [])
+                if pair is None:
+                    skipped += 1
+                if not found[0]:
+                    writer.writerow(row)
+                for rank, (location_id, distance) in enumerate(zip(*found), start=1):
+                    location = snapshot.rows[snapshot.positions[location_id]]
+                    writer.writerow({
+                        **row,
+                        'rank': rank,
+                        'location_id': location_id,
+                        'location_name': location['name'],
+                        'location_district': location['district'],
+                        'distance_km': distance,
+                    })
+
+    @staticmethod
+    def coordinates(row):
+        """(latitude, longitude) of a row, or None when missing or out of range"""
+        try:
+            latitude, longitude = float(row['latitude']), float(row['longitude'])
+        except (TypeError, ValueError):
+            return None
+        if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+            return latitude, longitude
+        return None
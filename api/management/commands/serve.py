@@ -0,0 +1,348 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from api.models import DatasetVersion
+from api.snapshot import LocationSnapshot, set_location_snapshot
+from api.views import precompress_payloads
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import gc
+import json
+import mmap
+import os
+import signal
+import socket
+import struct
+import time
+import traceback
+
+# Per-worker status slot shared between the master and its workers:
+# pid, dataset version, started (epoch), last heartbeat (epoch), requests served
+SLOT = struct.Struct('qqddq')
+
+
+class WorkerSlots:
+    """
+    Anonymous shared memory holding one status slot per worker
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.buffer = mmap.mmap(-1, SLOT.size * count)
+
+    def read(self, index):
+        pid, version, started, heartbeat, requests = SLOT.unpack_from(self.buffer, index * SLOT.size)
+        return {
+            'pid': pid,
+            'dataset_version': version,
+            'started': started,
+            'heartbeat': heartbeat,
+            'requests': requests,
+        }
+
+    def write(self, index, pid, dataset_version, started, heartbeat, requests):
+        SLOT.pack_into(self.buffer, index * SLOT.size, pid, dataset_version, started, heartbeat, requests)
+
+    def heartbeat(self, index):
+        slot = self.read(index)
+        slot['heartbeat'] = time.time()
+        self.write(index, **slot)
+
+    def count_request(self, index):
+        slot = self.read(index)
+        slot['requests'] += 1
+        self.write(index, **slot)
+
+
+def counting_application(application, slots, index):
+    """Wrap an ASGI application to count HTTP requests in the worker's slot"""
+    async def app(scope, receive, send):
+        if scope['type'] == 'http':
+            slots.count_request(index)
+        await application(scope, receive, send)
+    return app
+
+
+class Command(BaseCommand):
+    help = 'Serve the API from preforked ASGI workers sharing a preloaded location snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind', default='0.0.0.0:8000',
+            help='Address to listen on (default: 0.0.0.0:8000)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', '2')),
+            help='Number of worker processes (default: WEB_CONCURRENCY or 2)'
+        )
+        parser.add_argument(
+            '--reload-interval', type=float, default=5.0,
+            help='Seconds between dataset version checks (default: 5)'
+        )
+        parser.add_argument(
+            '--worker-timeout', type=float, default=30.0,
+            help='Kill and replace workers whose heartbeat is older than this (default: 30)'
+        )
+        parser.add_argument(
+            '--graceful-timeout', type=int, default=30,
+            help='Seconds a retiring worker may spend finishing requests (default: 30)'
+        )
+        parser.add_argument(
+            '--health-bind', default=None,
+            help='Address for the worker health endpoint, e.g. 127.0.0.1:8001 (default: off)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise CommandError('The serve command requires uvicorn')
+
+        self.options = options
+        self.slots = WorkerSlots(options['workers'])
+        self.workers = {}  # pid -> slot index
+        self.retiring = set()
+        self.outdated = set()  # workers still serving an older snapshot
+        self.stopping = False
+        self.force_reload = False
+
+        started = time.monotonic()
+        self.application = self.preload()
+        self.snapshot = self.build_snapshot()
+        self.stdout.write(
+            f'Preloaded application and {len(self.snapshot)} locations '
+            f'(dataset version {self.snapshot.version}) in {time.monotonic() - started:.2f}s'
+        )
+
+        self.listener = self.bind(options['bind'])
+        self.health_server = self.start_health_server(options['health_bind'])
+
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+
+        for index in range(options['workers']):
+            self.spawn(index)
+        self.stdout.write(self.style.SUCCESS(
+            f'Listening on {options["bind"]} with {options["workers"]} workers'
+        ))
+
+        try:
+            self.run_master()
+        finally:
+            self.shutdown()
+
+    # Master
+
+    def preload(self):
+        """Import the whole application once, before forking"""
+        from django.core.asgi import get_asgi_application
+        from django.urls import get_resolver
+
+        # Workers are ASGI servers, so route the API to its async views.
+        # This must happen before the URLconf is imported.
+        settings.API_ASYNC_VIEWS = True
+        application = get_asgi_application()
+        get_resolver().url_patterns
+        return application
+
+    def build_snapshot(self):
+        snapshot = LocationSnapshot.build()
+        # Compress the most requested payloads and cluster the map tiles once,
+        # before the workers share them
+        precompress_payloads(snapshot)
+        snapshot.tile_pyramid()
+        set_location_snapshot(snapshot, pinned=True)
+        # Children must never share the master's SQLite connection
+        connections.close_all()
+        # Keep the preloaded objects out of future collections, so that the
+        # collector does not touch (and un-share) their pages in the workers
+        gc.collect()
+        gc.freeze()
+        return snapshot
+
+    def bind(self, address):
+        host, _, port = address.rpartition(':')
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host or '0.0.0.0', int(port)))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def run_master(self):
+        next_check = time.monotonic() + self.options['reload_interval']
+        while not self.stopping:
+            self.reap_workers()
+            self.check_heartbeats()
+
+            if self.force_reload or time.monotonic() >= next_check:
+                self.check_dataset_version()
+                next_check = time.monotonic() + self.options['reload_interval']
+
+            self.retire_stale_worker()
+
+            if self.health_server:
+                self.health_server.handle_request()
+            else:
+                time.sleep(0.5)
+
+    def check_dataset_version(self):
+        version = DatasetVersion.current()
+        connections.close_all()
+        if version != self.snapshot.version or self.force_reload:
+            self.force_reload = False
+            gc.unfreeze()
+            self.snapshot = self.build_snapshot()
+            self.outdated = set(self.workers)
+            self.stdout.write(
+                f'Dataset version {self.snapshot.version} loaded '
+                f'({len(self.snapshot)} locations), replacing workers'
+            )
+
+    def retire_stale_worker(self):
+        """Gracefully replace one out-of-date worker at a time"""
+        if self.retiring:
+            return
+        self.outdated &= set(self.workers)
+        if self.outdated:
+            pid = self.outdated.pop()
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+
+    def reap_workers(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self.workers.pop(pid, None)
+            if index is None:
+                continue
+            if pid not in self.retiring and not self.stopping:
+                self.stderr.write(f'Worker {pid} exited unexpectedly (status {status})')
+                # Avoid a tight respawn loop when workers crash on startup
+                if time.time() - self.slots.read(index)['started'] < 1:
+                    time.sleep(1)
+            self.retiring.discard(pid)
+            if not self.stopping:
+                self.spawn(index)
+
+    def check_heartbeats(self):
+        now = time.time()
+        for pid, index in list(self.workers.items()):
+            slot = self.slots.read(index)
+            if slot['pid'] == pid and now - slot['heartbeat'] > self.options['worker_timeout']:
+                self.stderr.write(f'Worker {pid} missed its heartbeat, killing it')
+                os.kill(pid, signal.SIGKILL)
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        self.force_reload = True
+
+    def shutdown(self):
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.options['graceful_timeout']
+        while self.workers and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+        for pid in self.workers:
+            os.kill(pid, signal.SIGKILL)
+        self.listener.close()
+        if self.health_server:
+            self.health_server.server_close()
+
+    # Health endpoint
+
+    def worker_health(self):
+        now = time.time()
+        workers = []
+        for pid, index in sorted(self.workers.items(), key=lambda item: item[1]):
+            slot = self.slots.read(index)
+            workers.append({
+                'index': index,
+                'pid': pid,
+                'dataset_version': slot['dataset_version'],
+                'requests': slot['requests'],
+                'uptime_s': round(now - slot['started'], 1),
+                'heartbeat_age_s': round(now - slot['heartbeat'], 1),
+                'healthy': now - slot['heartbeat'] <= self.options['worker_timeout'],
+                'retiring': pid in self.retiring,
+            })
+        healthy = len(workers) == self.options['workers'] and all(w['healthy'] for w in workers)
+        return {
+            'status': 'ok' if healthy else 'degraded',
+            'dataset_version': self.snapshot.version,
+            'workers': workers,
+        }
+
+    def start_health_server(self, address):
+        if not address:
+            return None
+        command = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                health = command.worker_health()
+                body = json.dumps(health).encode()
+                self.send_response(200 if health['status'] == 'ok' else 503)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        host, _, port = address.rpartition(':')
+        server = HTTPServer((host or '127.0.0.1', int(port)), HealthHandler)
+        server.timeout = 0.5
+        return server
+
+    # Workers
+
+    def spawn(self, index):
+        now = time.time()
+        self.slots.write(index, 0, self.snapshot.version, now, now, 0)
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = index
+            return
+
+        # Child process: never return into the master's code
+        exit_code = 0
+        try:
+            self.run_worker(index)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def run_worker(self, index):
+        import uvicorn
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        if self.health_server:
+            self.health_server.socket.close()
+
+        slots = self.slots
+        self.slots.write(index, os.getpid(), self.snapshot.version, time.time(), time.time(), 0)
+
+        async def heartbeat():
+            slots.heartbeat(index)
+
+        config = uvicorn.Config(
+            counting_application(self.application, slots, index),
+            lifespan='off',
+            access_log=False,
+            timeout_notify=1,
+            callback_notify=heartbeat,
+            timeout_graceful_shutdown=self.options['graceful_timeout'],
+        )
+        uvicorn.Server(config).run(sockets=[self.listener])
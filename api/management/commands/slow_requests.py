@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from pathlib import Path
+import json
+import re
+
+# Placeholder lists of IN clauses differ only in length
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+WHITESPACE = re.compile(r'\s+')
+# Plan steps that walk a whole table rather than searching an index
+FULL_SCAN = re.compile(r'^SCAN (?!.*\bUSING\b)')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def statement_shape(sql):
+    return IN_LIST.sub('IN (...)', WHITESPACE.sub(' ', sql).strip())
+
+
+def shorten(text, width):
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+
+class Command(BaseCommand):
+    help = (
+        'Summarize the slow-request log (SLOW_REQUEST_LOG_PATH and its rotated files): '
+        'endpoints, the slowest requests and the SQL statements that cost the most time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Log file to read (default: SLOW_REQUEST_LOG_PATH)')
+        parser.add_argument('--top', type=int, default=10, help='Requests and statements to list (default: 10)')
+        parser.add_argument('--endpoint', help='Only requests to this endpoint (URL name)')
+        parser.add_argument('--since', help='Only requests logged at or after this ISO datetime')
+        parser.add_argument(
+            '--include-sampled', action='store_true', help='Also count sampled requests below the threshold'
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'] or settings.SLOW_REQUEST_LOG_PATH)
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('--since must be an ISO datetime, e.g. 2026-10-19T08:00:00+00:00')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        records, skipped = self.read(path)
+        records = [
+            record for record in records
+            if (options['include_sampled'] or record['reason'] == 'slow')
+            and (not options['endpoint'] or record['endpoint'] == options['endpoint'])
+            and (since is None or parse_datetime(record['time']) >= since)
+        ]
+        if not records:
+            self.stdout.write(
+                f'No matching requests in {path}' + (f' ({skipped} unreadable lines)' if skipped else '')
+            )
+            return
+
+        self.stdout.write(
+            f'{len(records)} requests from {records[0]["time"]} to {records[-1]["time"]}'
+            + (f' ({skipped} unreadable lines skipped)' if skipped else '')
+        )
+        self.endpoints(records)
+        self.slowest(records, options['top'])
+        self.statements(records, options['top'])
+
+    def read(self, path):
+        """Records of the log and its backups, oldest first, and the number of unreadable lines"""
+        files = sorted(
+            (backup for backup in path.parent.glob(path.name + '.*') if backup.suffix[1:].isdigit()),
+            key=lambda backup: -int(backup.suffix[1:]),
+        )
+        if path.exists():
+            files.append(path)
+        if not files:
+            raise CommandError(f'{path} does not exist; is SLOW_REQUEST_LOG_ENABLED set?')
+
+        records, skipped = [], 0
+        for log_file in files:
+            with open(log_file, encoding='utf-8') as lines:
+                for line in lines:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        skipped += 1
+        records.sort(key=lambda record: record['time'])
+        return records, skipped
+
+    def endpoints(self, records):
+        by_endpoint = {}
+        for record in records:
+            by_endpoint.setdefault(record['endpoint'], []).append(record)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nEndpoints'))
+        self.stdout.write(
+            f'{"endpoint":<32}{"requests":>9}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}{"db %":>7}{"queries":>9}'
+        )
+        by_total = sorted(by_endpoint.items(), key=lambda item: -sum(record['duration_ms'] for record in item[1]))
+        for endpoint, group in by_total:
+            durations = [record['duration_ms'] for record in group]
+            db_share = sum(record['db_ms'] for record in group) / max(sum(durations), 1e-9) * 100
+            queries = sum(record['db_queries'] for record in group) / len(group)
+            self.stdout.write(
+                f'{shorten(endpoint, 31):<32}{len(group):>9}{percentile(durations, 50):>10.1f}'
+                f'{percentile(durations, 95):>10.1f}{max(durations):>10.1f}{db_share:>6.0f}%{queries:>9.1f}'
+            )
+
+    def slowest(self, records, top):
+        self.stdout.write(self.style.MIGRATE_HEADING('\nSlowest requests'))
+        for record in sorted(records, key=lambda record: -record['duration_ms'])[:top]:
+            query = '&'.join(
+                f'{key}={value}' for key, values in record['params'].items()
+                for value in (values if isinstance(values, list) else [values])
+            )
+            stages = ', '.join(f'{stage} {ms:.1f}' for stage, ms in record['timings'].items())
+            self.stdout.write(
+                f'{record["duration_ms"]:>9.1f} ms  {record["status"]}  {record["method"]} '
+                f'{record["path"]}{"?" + query if query else ""}'
+            )
+            self.stdout.write(
+                f'{"":>15}{record["time"]}  db {record["db_ms"]:.1f} ms in {record["db_queries"]} queries'
+                + (f'  ({stages})' if stages else '')
+            )
+
+    def statements(self, records, top):
+        """Statements grouped by shape, costliest total time first, with their plan"""
+        shapes = {}
+        for record in records:
+            for query in record.get('queries', []):
+                shape = shapes.setdefault(statement_shape(query['sql']), {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'requests': set(), 'plan': query['plan'],
+                })
+                shape['count'] += 1
+                shape['total'] += query['ms']
+                shape['max'] = max(shape['max'], query['ms'])
+                shape['requests'].add(id(record))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nCostliest statements'))
+        self.stdout.write(f'{"total ms":>10}{"count":>8}{"max ms":>10}{"requests":>10}  statement')
+        for sql, shape in sorted(shapes.items(), key=lambda item: -item[1]['total'])[:top]:
+            self.stdout.write(
+                f'{shape["total"]:>10.1f}{shape["count"]:>8}{shape["max"]:>10.1f}{len(shape["requests"]):>10}  '
+                f'{shorten(sql, 160)}'
+            )
+            for step in shape['plan'] or []:
+                line = f'{"":>40}plan: {step}'
+                self.stdout.write(self.style.WARNING(line + '  <- table scan') if FULL_SCAN.match(step) else line)
@@ -0,0 +1,328 @@
+"""
+In-process request metrics rendered in the Prometheus text format.
+
+MetricsMiddleware records one RequestMetrics per request in a context
+variable. Database queries are counted by a wrapper installed on every new
+connection (see api.signals), which also keeps the statements themselves
+for the slow-request log (api.slowlog), and views time their own stages
+with `timed()`. Because the context variable follows the request into
+sync_to_async threads, async views are measured the same way.
+
+Metrics are kept per process; with several workers each one reports its
+own counters.
+"""
+from contextlib import contextmanager
+import contextvars
+import hmac
+import ipaddress
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Timings collected while handling a single request
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        # stage name -> seconds, in the order stages were first recorded
+        self.timings = {}
+        # (alias, sql, params, many, seconds) of each statement while the
+        # slow-request log (api.slowlog) captures them, otherwise None
+        self.queries = None
+        self.dropped_queries = 0
+
+    def add(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def capture(self, alias, sql, params, many, seconds):
+        if len(self.queries) < settings.SLOW_REQUEST_MAX_QUERIES:
+            self.queries.append((alias, sql, params, many, seconds))
+        else:
+            self.dropped_queries += 1
+
+
+def current_request_metrics():
+    return _current.get()
+
+
+@contextmanager
+def timed(stage):
+    """Attribute the time spent in the block to `stage` of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.add(stage, time.perf_counter() - start)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Connection execute wrapper that counts queries for the current request"""
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        request_metrics.db_queries += 1
+        request_metrics.db_time += seconds
+        if request_metrics.queries is not None:
+            request_metrics.capture(context['connection'].alias, sql, params, many, seconds)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # label key -> [bucket counts..., sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, state):
+                    labels = _format_labels(self.labelnames, key, [('le', repr(float(bound)))])
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+                lines.append(f'{self.name}_bucket{labels} {state[-1]}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {state[-2]}')
+                lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self):
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} gauge',
+            f'{self.name} {self.callback()}',
+        ]
+
+
+def _snapshot_attribute(attribute):
+    def read():
+        from .snapshot import current_location_snapshot
+        snapshot = current_location_snapshot()
+        if snapshot is None:
+            return 0
+        return attribute(snapshot)
+    return read
+
+
+REQUEST_LATENCY = Histogram(
+    'sfexpress_http_request_duration_seconds', 'Request latency by endpoint.',
+    LATENCY_BUCKETS, ['endpoint', 'method', 'status'],
+)
+RESPONSE_BYTES = Histogram(
+    'sfexpress_http_response_bytes', 'Response body size by endpoint.',
+    BYTES_BUCKETS, ['endpoint'],
+)
+DB_QUERIES = Histogram(
+    'sfexpress_db_queries_per_request', 'Database queries per request by endpoint.',
+    COUNT_BUCKETS, ['endpoint'],
+)
+DB_TIME = Histogram(
+    'sfexpress_db_query_duration_seconds', 'Total database time per request by endpoint.',
+    LATENCY_BUCKETS, ['endpoint'],
+)
+STAGE_TIME = Histogram(
+    'sfexpress_request_stage_duration_seconds', 'Time per request stage (auth, serialize, ...).',
+    LATENCY_BUCKETS, ['endpoint', 'stage'],
+)
+CREDIT_DEDUCTIONS = Counter(
+    'sfexpress_credit_deductions_total', 'Credit deduction attempts by outcome.',
+    ['outcome'],
+)
+SNAPSHOT_REBUILDS = Counter(
+    'sfexpress_location_snapshot_rebuilds_total', 'Location snapshot rebuilds in this process.',
+)
+CACHE_REQUESTS = Counter(
+    'sfexpress_cache_requests_total',
+    'Tiered cache lookups by cache and result (local_hit, shared_hit, stale, coalesced, miss).',
+    ['cache', 'result'],
+)
+SNAPSHOT_VERSION = Gauge(
+    'sfexpress_location_snapshot_version', 'Dataset version of the loaded location snapshot.',
+    _snapshot_attribute(lambda snapshot: snapshot.version),
+)
+SNAPSHOT_ROWS = Gauge(
+    'sfexpress_location_snapshot_rows', 'Locations held in the loaded location snapshot.',
+    _snapshot_attribute(len),
+)
+
+REGISTRY = [
+    REQUEST_LATENCY, RESPONSE_BYTES, DB_QUERIES, DB_TIME, STAGE_TIME,
+    CREDIT_DEDUCTIONS, SNAPSHOT_REBUILDS, CACHE_REQUESTS, SNAPSHOT_VERSION, SNAPSHOT_ROWS,
+]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def scrape_allowed(request):
+    """
+    Whether a request may read /metrics: it must come from an address in
+    METRICS_ALLOWED_IPS and carry METRICS_BEARER_TOKEN, where these are set
+    """
+    if settings.METRICS_ALLOWED_IPS:
+        try:
+            address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+        except ValueError:
+            return False
+        if not any(address in network for network in settings.METRICS_ALLOWED_IPS):
+            return False
+    if settings.METRICS_BEARER_TOKEN:
+        expected = f'Bearer {settings.METRICS_BEARER_TOKEN}'
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode(), expected.encode()):
+            return False
+    return True
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or 'unmatched'
+
+
+def _server_timing(request_metrics, total):
+    entries = [f'total;dur={total * 1000:.1f}']
+    if request_metrics.db_queries:
+        entries.append(
+            f'db;dur={request_metrics.db_time * 1000:.1f};desc="{request_metrics.db_queries} queries"'
+        )
+    for stage, seconds in request_metrics.timings.items():
+        entries.append(f'{stage};dur={seconds * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, query counts, stage timings and response size per
+    endpoint, and optionally add a Server-Timing header.
+    Should be the first entry in MIDDLEWARE so it measures the whole request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    def finish(self, request, response, request_metrics):
+        total = time.perf_counter() - request_metrics.started
+        endpoint = endpoint_name(request)
+
+        REQUEST_LATENCY.observe(total, endpoint=endpoint, method=request.method, status=response.status_code)
+        DB_QUERIES.observe(request_metrics.db_queries, endpoint=endpoint)
+        DB_TIME.observe(request_metrics.db_time, endpoint=endpoint)
+        for stage, seconds in request_metrics.timings.items():
+            STAGE_TIME.observe(seconds, endpoint=endpoint, stage=stage)
+        if not response.streaming:
+            RESPONSE_BYTES.observe(len(response.content), endpoint=endpoint)
+
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = _server_timing(request_metrics, total)
+        return response
@@ -1,7 +1,13 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
+from .async_db import run_in_db_pool
+from .metrics import timed
 from .models import APIKey
+from .ratelimit import check_rate_limit
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -10,27 +16,96 @@ class APIKeyAuthenticationMiddleware:
     """
     Middleware to authenticate API requests using API key in the Authorization header.
     Expected header format: Authorization: Bearer <api_key>
+
+    Works in both sync (WSGI) and async (ASGI) middleware chains.
     """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
         # Only these paths require API key authentication
         self.api_paths = [
             '/api/locations',
+            '/api/credits',
         ]
+        # api key -> (user_id, rate_limit_tier, expires_at), so that known keys
+        # can be rate limited before touching the database
+        self.known_keys = {}
 
     def __call__(self, request):
-        # Only check API key for specific API endpoints
-        requires_api_key = any(request.path.startswith(path) for path in self.api_paths)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
 
-        if not requires_api_key:
+        # Only check API key for specific API endpoints
+        if not self.requires_api_key(request):
             return self.get_response(request)
 
-        # Get the authorization header
+        api_key, error_response = self.parse_api_key(request)
+        if error_response:
+            return error_response
+
+        error_response = self.check_rate_limit(api_key)
+        if error_response:
+            return error_response
+
+        # Validate the API key
+        try:
+            with timed('auth'):
+                api_key_obj = APIKey.objects.select_related('user').get(key=api_key, is_active=True)
+
+                # Update last used timestamp
+                api_key_obj.last_used = timezone.now()
+                api_key_obj.save(update_fields=['last_used'])
+
+        except APIKey.DoesNotExist:
+            return self.invalid_api_key()
+
+        self.authenticate(request, api_key_obj)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not self.requires_api_key(request):
+            return await self.get_response(request)
+
+        api_key, error_response = self.parse_api_key(request)
+        if error_response:
+            return error_response
+
+        if settings.API_RATE_LIMIT_STORE == 'sqlite':
+            error_response = await run_in_db_pool(self.check_rate_limit, api_key)
+        else:
+            error_response = self.check_rate_limit(api_key)
+        if error_response:
+            return error_response
+
+        try:
+            with timed('auth'):
+                api_key_obj = await APIKey.objects.select_related('user').aget(key=api_key, is_active=True)
+
+                api_key_obj.last_used = timezone.now()
+                await api_key_obj.asave(update_fields=['last_used'])
+
+        except APIKey.DoesNotExist:
+            return self.invalid_api_key()
+
+        self.authenticate(request, api_key_obj)
+        return await self.get_response(request)
+
+    def requires_api_key(self, request):
+        return any(request.path.startswith(path) for path in self.api_paths)
+
+    def parse_api_key(self, request):
+        """
+        Extract the API key from the Authorization header.
+        Returns (api_key, None) or (None, error_response).
+        """
         auth_header = request.headers.get('Authorization', '')
 
         if not auth_header:
-            return JsonResponse({
+            return None, JsonResponse({
                 'error': 'Authentication required',
                 'message': 'Missing Authorization header'
             }, status=401)
@@ -38,29 +113,53 @@ class APIKeyAuthenticationMiddleware:
         # Parse the authorization header
         parts = auth_header.split()
         if len(parts) != 2 or parts[0].lower() != 'bearer':
-            return JsonResponse({
+            return None, JsonResponse({
                 'error': 'Invalid authentication',
                 'message': 'Authorization header must be in format: Bearer <api_key>'
             }, status=401)
 
-        api_key = parts[1]
+        return parts[1], None
 
-        # Validate the API key
-        try:
-            api_key_obj = APIKey.objects.select_related('user').get(key=api_key, is_active=True)
+    def check_rate_limit(self, api_key):
+        """
+        Rate limit before any database access. Keys not seen recently are
+        limited with the default tier until their owner is known.
+        """
+        known = self.known_keys.get(api_key)
+        if known and known[2] < time.monotonic():
+            known = None
+        if known:
+            retry_after = check_rate_limit(api_key, known[1], user_id=known[0])
+        else:
+            retry_after = check_rate_limit(api_key, settings.API_RATE_LIMIT_DEFAULT_TIER)
+        if retry_after is not None:
+            return self.rate_limited(retry_after)
+        return None
 
-            # Update last used timestamp
-            api_key_obj.last_used = timezone.now()
-            api_key_obj.save(update_fields=['last_used'])
+    def authenticate(self, request, api_key_obj):
+        """Attach the key's user to the request and remember its tier"""
+        request.user = api_key_obj.user
+        request.api_key = api_key_obj
 
-            # Attach user to request
-            request.user = api_key_obj.user
-            request.api_key = api_key_obj
+        if len(self.known_keys) >= 10000:
+            self.known_keys.clear()
+        self.known_keys[api_key_obj.key] = (
+            api_key_obj.user_id,
+            api_key_obj.rate_limit_tier,
+            time.monotonic() + settings.API_KEY_CACHE_TTL,
+        )
 
-        except APIKey.DoesNotExist:
-            return JsonResponse({
-                'error': 'Invalid API key',
-                'message': 'The provided API key is invalid or inactive'
-            }, status=401)
+    def invalid_api_key(self):
+        return JsonResponse({
+            'error': 'Invalid API key',
+            'message': 'The provided API key is invalid or inactive'
+        }, status=401)
 
-        return self.get_response(request)
+    def rate_limited(self, retry_after):
+        response = JsonResponse({
+            'error': 'Rate limit exceeded',
+            'message': f'Too many requests, retry after {retry_after} seconds',
+            'retry_after': retry_after
+        }, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
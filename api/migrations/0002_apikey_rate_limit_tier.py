@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='rate_limit_tier',
+            field=models.CharField(choices=[('FREE', 'Free'), ('STANDARD', 'Standard'), ('PREMIUM', 'Premium')], default='STANDARD', help_text='Request rate tier, see API_RATE_LIMIT_TIERS in settings', max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_datasetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe', models.PositiveSmallIntegerField()),
+                ('reserved', models.IntegerField(default=0, help_text='Credits moved out of the balance and not yet spent')),
+                ('spent', models.IntegerField(default=0, help_text='Credits spent since the last compaction')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credit_stripes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user', 'stripe'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='creditstripe',
+            constraint=models.UniqueConstraint(fields=('user', 'stripe'), name='unique_credit_stripe'),
+        ),
+    ]
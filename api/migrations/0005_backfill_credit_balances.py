@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_missing_balances(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    CreditBalance = apps.get_model('api', 'CreditBalance')
+    CreditBalance.objects.bulk_create(
+        [CreditBalance(user_id=user_id) for user_id in
+         User.objects.filter(credit_balance__isnull=True).values_list('id', flat=True)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_creditstripe'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_backfill_credit_balances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetversion',
+            name='has_change_log',
+            field=models.BooleanField(default=False, help_text='LocationChange rows list every location changed in this version'),
+        ),
+        migrations.CreateModel(
+            name='LocationChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location_id', models.BigIntegerField()),
+                ('operation', models.CharField(choices=[('UPSERT', 'Created or updated'), ('DELETE', 'Deleted')], max_length=10)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='api.datasetversion')),
+            ],
+            options={
+                'ordering': ['version', 'id'],
+            },
+        ),
+    ]
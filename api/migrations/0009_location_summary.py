@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from api.regions import region_for
+
+
+def summarize_current_version(apps, schema_editor):
+    DatasetVersion = apps.get_model('api', 'DatasetVersion')
+    Location = apps.get_model('api', 'Location')
+    LocationSummary = apps.get_model('api', 'LocationSummary')
+    version = DatasetVersion.objects.order_by('-id').first()
+    if version is None:
+        return
+    groups = (
+        Location.objects.filter(is_active=True)
+        .values('district', 'location_type')
+        .annotate(
+            count=models.Count('id'),
+            min_latitude=models.Min('latitude'),
+            max_latitude=models.Max('latitude'),
+            min_longitude=models.Min('longitude'),
+            max_longitude=models.Max('longitude'),
+        )
+        .order_by()
+    )
+    LocationSummary.objects.bulk_create(
+        [LocationSummary(version=version, region=region_for(group['district']), **group) for group in groups],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_idempotency_records'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('district', models.CharField(max_length=100)),
+                ('region', models.CharField(max_length=50)),
+                ('location_type', models.CharField(choices=[('LOCKER', 'Locker'), ('SHOP', 'Shop')], max_length=10)),
+                ('count', models.IntegerField()),
+                ('min_latitude', models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ('max_latitude', models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ('min_longitude', models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ('max_longitude', models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='api.datasetversion')),
+            ],
+            options={
+                'verbose_name_plural': 'location summaries',
+                'ordering': ['district', 'location_type'],
+                'unique_together': {('district', 'location_type')},
+            },
+        ),
+        migrations.RunPython(summarize_current_version, migrations.RunPython.noop),
+    ]
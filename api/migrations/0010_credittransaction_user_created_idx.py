@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_location_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='credittransaction',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='credittx_user_created_idx'),
+        ),
+    ]
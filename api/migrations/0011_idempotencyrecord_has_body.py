@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_credittransaction_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='has_body',
+            field=models.BooleanField(default=True, help_text='False when the response was streamed or too large to keep: retries re-run the call uncharged'),
+        ),
+    ]
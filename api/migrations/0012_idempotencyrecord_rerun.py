@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_idempotencyrecord_has_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='rerun',
+            field=models.BooleanField(default=False, help_text='Set once the uncharged re-run of a response that was not kept has been used'),
+        ),
+        migrations.AlterField(
+            model_name='idempotencyrecord',
+            name='has_body',
+            field=models.BooleanField(default=True, help_text='False when the response was streamed or too large to keep: the first retry re-runs the call uncharged'),
+        ),
+    ]
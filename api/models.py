@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 import secrets
 
+from .regions import region_for
+
 
 class User(AbstractUser):
     """
@@ -19,15 +22,30 @@ class APIKey(models.Model):
     """
     API Key model for API authentication
     """
+    RATE_LIMIT_TIERS = (
+        ('FREE', 'Free'),
+        ('STANDARD', 'Standard'),
+        ('PREMIUM', 'Premium'),
+    )
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_keys')
     key = models.CharField(max_length=64, unique=True, editable=False)
     name = models.CharField(max_length=100, help_text="A descriptive name for this API key")
     is_active = models.BooleanField(default=True)
+    rate_limit_tier = models.CharField(
+        max_length=20,
+        choices=RATE_LIMIT_TIERS,
+        default='STANDARD',
+        help_text="Request rate tier, see API_RATE_LIMIT_TIERS in settings"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     last_used = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='apikey_created_at_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.key:
@@ -43,6 +61,44 @@ class APIKey(models.Model):
         return f"{self.name} - {self.key[:8]}..."
 
 
+class IdempotencyRecord(models.Model):
+    """
+    Stored response of a charged API call made with an Idempotency-Key
+    header, replayed to retries of the same call (see api.idempotency)
+    """
+    api_key = models.ForeignKey(APIKey, on_delete=models.CASCADE, related_name='idempotency_records')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64, help_text="SHA-256 of the method and full path")
+    # Null while the first request is still being processed
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    body = models.BinaryField(blank=True, default=b'')
+    has_body = models.BooleanField(
+        default=True,
+        help_text=(
+            "False when the response was streamed or too large to keep: the first retry re-runs the call uncharged"
+        )
+    )
+    rerun = models.BooleanField(
+        default=False,
+        help_text="Set once the uncharged re-run of a response that was not kept has been used"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['api_key', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['api_key', 'created_at'], name='idempotency_key_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.api_key_id}:{self.key}"
+
+
 class CreditBalance(models.Model):
     """
     Credit system for tracking user API usage
@@ -61,18 +117,44 @@ class CreditBalance(models.Model):
         self.save()
 
     def deduct_credits(self, amount):
-        """Deduct credits from the user's balance"""
-        if self.credits >= amount:
-            self.credits -= amount
-            self.total_spent += amount
-            self.save()
-            return True
-        return False
+        """
+        Deduct credits from the user's balance. A single conditional UPDATE,
+        so concurrent deductions can neither be lost nor overdraw the balance.
+        """
+        deducted = CreditBalance.objects.filter(pk=self.pk, credits__gte=amount).update(
+            credits=models.F('credits') - amount,
+            total_spent=models.F('total_spent') + amount,
+            updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['credits', 'total_spent', 'updated_at'])
+        return bool(deducted)
 
     def __str__(self):
         return f"{self.user.username} - {self.credits} credits"
 
 
+class CreditStripe(models.Model):
+    """
+    One of CREDIT_STRIPES counter rows per user used by striped credit mode.
+    Credits are reserved from CreditBalance.credits into a stripe in chunks and
+    spent from there, so parallel API calls update different rows.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='credit_stripes')
+    stripe = models.PositiveSmallIntegerField()
+    reserved = models.IntegerField(default=0, help_text="Credits moved out of the balance and not yet spent")
+    spent = models.IntegerField(default=0, help_text="Credits spent since the last compaction")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['user', 'stripe']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'stripe'], name='unique_credit_stripe'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - stripe {self.stripe}"
+
+
 class CreditTransaction(models.Model):
     """
     Track credit transactions for auditing
@@ -93,6 +175,12 @@ class CreditTransaction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Admin changelist ordering and date hierarchy
+            models.Index(fields=['created_at'], name='credittx_created_at_idx'),
+            # Per-user history: dashboard recent rows and keyset ledger exports
+            models.Index(fields=['user', 'created_at', 'id'], name='credittx_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.transaction_type} - {self.amount}"
@@ -121,6 +209,135 @@ class Location(models.Model):
 
     class Meta:
         ordering = ['district', 'name']
+        indexes = [
+            models.Index(fields=['district', 'name'], name='location_district_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_location_type_display()} - {self.name}"
+
+
+class DatasetVersion(models.Model):
+    """
+    Monotonically increasing version of the location dataset.
+    A new row is added whenever the loader or an admin edit changes Location.
+    """
+    source = models.CharField(max_length=50)
+    location_count = models.IntegerField(default=0)
+    has_change_log = models.BooleanField(
+        default=False,
+        help_text="LocationChange rows list every location changed in this version"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    @classmethod
+    def current(cls):
+        """Return the current dataset version number (0 before the first load)"""
+        return cls.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, source):
+        """
+        Record a change to the location dataset and return the new version.
+        Without a change log, delta sync clients must re-download everything.
+        """
+        with transaction.atomic():
+            version = cls.objects.create(
+                source=source,
+                location_count=Location.objects.filter(is_active=True).count()
+            )
+            LocationSummary.refresh(version)
+        return version
+
+    @classmethod
+    def publish(cls, source, upserted=(), deleted=()):
+        """
+        Record a change to the location dataset together with the ids of the
+        locations created or updated and deleted, and return the new version
+        """
+        with transaction.atomic():
+            version = cls.objects.create(
+                source=source,
+                location_count=Location.objects.filter(is_active=True).count(),
+                has_change_log=True
+            )
+            LocationChange.objects.bulk_create(
+                [LocationChange(version=version, location_id=pk, operation='UPSERT') for pk in upserted] +
+                [LocationChange(version=version, location_id=pk, operation='DELETE') for pk in deleted],
+                batch_size=1000
+            )
+            LocationSummary.refresh(version)
+        return version
+
+    def __str__(self):
+        return f"v{self.id} ({self.source})"
+
+
+class LocationChange(models.Model):
+    """
+    Change log entry: a location created, updated or deleted in a dataset version
+    """
+    OPERATIONS = (
+        ('UPSERT', 'Created or updated'),
+        ('DELETE', 'Deleted'),
+    )
+
+    version = models.ForeignKey(DatasetVersion, on_delete=models.CASCADE, related_name='changes')
+    # Not a foreign key: deleted locations keep their entries as tombstones
+    location_id = models.BigIntegerField()
+    operation = models.CharField(max_length=10, choices=OPERATIONS)
+
+    class Meta:
+        ordering = ['version', 'id']
+
+    def __str__(self):
+        return f"v{self.version_id} {self.operation} {self.location_id}"
+
+
+class LocationSummary(models.Model):
+    """
+    Active location count and coordinate bounds per district and location
+    type, rebuilt whenever a dataset version is recorded
+    """
+    version = models.ForeignKey(DatasetVersion, on_delete=models.CASCADE, related_name='summaries')
+    district = models.CharField(max_length=100)
+    region = models.CharField(max_length=50)
+    location_type = models.CharField(max_length=10, choices=Location.LOCATION_TYPES)
+    count = models.IntegerField()
+    min_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    max_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    min_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    max_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+
+    class Meta:
+        ordering = ['district', 'location_type']
+        unique_together = [['district', 'location_type']]
+        verbose_name_plural = 'location summaries'
+
+    @classmethod
+    def refresh(cls, version):
+        """Replace every row with the aggregates of the active locations"""
+        groups = (
+            Location.objects.filter(is_active=True)
+            .values('district', 'location_type')
+            .annotate(
+                count=models.Count('id'),
+                min_latitude=models.Min('latitude'),
+                max_latitude=models.Max('latitude'),
+                min_longitude=models.Min('longitude'),
+                max_longitude=models.Max('longitude'),
+            )
+            .order_by()
+        )
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                [cls(version=version, region=region_for(group['district']), **group) for group in groups],
+                batch_size=1000
+            )
+
+    def __str__(self):
+        return f"{self.district} {self.location_type}: {self.count}"
@@ -0,0 +1,234 @@
+"""
+Bulk nearest-location matching for /api/locations/nearest-bulk and the
+`nearest_locations` command.
+
+Locations with coordinates are kept as 3D unit vectors and sorted into a
+grid of cubes of LOCATION_NEAREST_CELL_KM, plus grids of twice, four times,
+... that size built when first needed. Each origin is compared with the
+locations in the 27 cells around it, all origins of a chunk at once; when
+the k-th match is farther than one cell, anything outside those cells could
+be closer and the origin is retried on the next, coarser grid. Results are
+therefore exact, and origins near locations are resolved on the fine grids
+with few comparisons.
+
+Candidates are ranked by the chord between unit vectors (no trigonometry
+per pair) and converted to great-circle distances at the end. Work is done
+in chunks of CHUNK_SIZE origins and batches of MAX_PAIRS comparisons, which
+bounds memory whatever the number of origins.
+
+Needs the optional `numpy` package.
+"""
+import csv
+import io
+import threading
+
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+# Origins matched per chunk
+CHUNK_SIZE = 20000
+# Origin/location pairs compared at once (~50 MB of temporaries)
+MAX_PAIRS = 1 << 20
+# Cell coordinates are packed into one int64 with 21 bits per axis, which
+# needs cells of at least ~6 m
+CELL_OFFSET = 1 << 20
+MIN_CELL_KM = 0.01
+
+
+class InvalidOrigins(ValueError):
+    pass
+
+
+def numpy_available():
+    return np is not None
+
+
+def _unit_vectors(latitudes, longitudes):
+    cos_lat = np.cos(latitudes)
+    return np.column_stack((cos_lat * np.cos(longitudes), cos_lat * np.sin(longitudes), np.sin(latitudes)))
+
+
+def _pack(cells):
+    cells = cells.astype(np.int64) + CELL_OFFSET
+    return (cells[..., 0] << 42) | (cells[..., 1] << 21) | cells[..., 2]
+
+
+def chord_km(chords):
+    """
+    Great-circle distances of chord lengths between unit vectors. The
+    haversine of the angle is (chord / 2) ** 2, so this is the haversine
+    formula with the squared sines computed from the unit vectors.
+    """
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chords / 2, 1.0))
+
+
+def origins_array(pairs):
+    """(latitudes, longitudes) float arrays in degrees from (latitude, longitude) pairs"""
+    try:
+        origins = np.array(pairs, dtype=np.float64).reshape(len(pairs), -1 if len(pairs) else 2)
+    except (TypeError, ValueError):
+        raise InvalidOrigins('origins must be (latitude, longitude) number pairs')
+    if origins.shape[1] != 2:
+        raise InvalidOrigins('origins must be (latitude, longitude) number pairs')
+    latitudes, longitudes = origins[:, 0], origins[:, 1]
+    invalid = ~((np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180))
+    if invalid.any():
+        position = int(np.flatnonzero(invalid)[0])
+        raise InvalidOrigins(f'origin {position} is not a valid coordinate: {origins[position].tolist()}')
+    return latitudes, longitudes
+
+
+def parse_json_origins(origins):
+    """Origins of a JSON request: [latitude, longitude] pairs or {"latitude", "longitude"} objects"""
+    if not isinstance(origins, list):
+        raise InvalidOrigins('origins must be a list')
+    if origins and isinstance(origins[0], dict):
+        try:
+            origins = [(origin['latitude'], origin['longitude']) for origin in origins]
+        except (KeyError, TypeError):
+            raise InvalidOrigins('origin objects need latitude and longitude')
+    return origins_array(origins)
+
+
+def parse_csv_origins(text):
+    """Origins of a CSV body with a header row naming latitude and longitude columns"""
+    try:
+        pairs = [(float(row['latitude']), float(row['longitude'])) for row in csv.DictReader(io.StringIO(text))]
+    except (KeyError, TypeError, ValueError):
+        raise InvalidOrigins('CSV origins need numeric latitude and longitude columns')
+    return origins_array(pairs)
+
+
+class _Grid:
+    """Locations sorted by grid cell at one cell size; each occupied cell is a slice of `order`"""
+
+    def __init__(self, unit_vectors, cell):
+        self.cell = cell
+        keys = _pack(np.floor(unit_vectors / cell))
+        self.order = np.argsort(keys, kind='stable')
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+
+
+def _ranges(starts, counts):
+    """Concatenated ranges starts[i]..starts[i] + counts[i] without a Python loop"""
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+def _batches(totals, limit):
+    """Slices of consecutive origins whose candidate counts add up to about `limit`"""
+    ends = np.cumsum(totals)
+    start = 0
+    while start < len(totals):
+        stop = max(start + 1, int(np.searchsorted(ends, (ends[start - 1] if start else 0) + limit, side='right')))
+        yield slice(start, stop)
+        start = stop
+
+
+class NearestIndex:
+    """
+    The locations of one snapshot (optionally one type) that have
+    coordinates, with grids of cells of `cell_km`, twice that, four times
+    that, ... built on first use
+    """
+
+    def __init__(self, rows, cell_km):
+        rows = [row for row in rows if row['latitude'] is not None and row['longitude'] is not None]
+        self.ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        latitudes = np.radians(np.array([row['latitude'] for row in rows], dtype=np.float64))
+        longitudes = np.radians(np.array([row['longitude'] for row in rows], dtype=np.float64))
+        self.unit_vectors = _unit_vectors(latitudes, longitudes)
+        self.x, self.y, self.z = (np.ascontiguousarray(axis) for axis in self.unit_vectors.T)
+        # Finest cube edge in unit-sphere (chord) units
+        self.cell = max(cell_km, MIN_CELL_KM) / EARTH_RADIUS_KM
+        self.grids = []
+        self.lock = threading.Lock()
+        steps = np.arange(-1, 2)
+        self.offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def grid(self, level):
+        if level >= len(self.grids):
+            with self.lock:
+                while len(self.grids) <= level:
+                    self.grids.append(_Grid(self.unit_vectors, self.cell * 2 ** len(self.grids)))
+        return self.grids[level]
+
+    def query(self, latitudes, longitudes, k):
+        """
+        The k nearest locations of each origin (degrees), as (ids, distances
+        in km) arrays of shape (origins, k) yielded per chunk of CHUNK_SIZE
+        origins. k is capped at the number of locations.
+        """
+        k = min(k, len(self))
+        for start in range(0, len(latitudes), CHUNK_SIZE):
+            yield self._query_chunk(
+                np.radians(latitudes[start:start + CHUNK_SIZE]), np.radians(longitudes[start:start + CHUNK_SIZE]), k
+            )
+
+    def _query_chunk(self, latitudes, longitudes, k):
+        origins = _unit_vectors(latitudes, longitudes)
+        ids = np.empty((len(latitudes), k), dtype=np.int64)
+        distances = np.empty((len(latitudes), k), dtype=np.float64)
+        pending = np.arange(len(latitudes))
+        level = 0
+        while k and len(pending):
+            # Once a cell spans the sphere every origin is resolved
+            resolved = self._search(self.grid(level), origins[pending].T, k, pending, ids, distances)
+            pending = pending[~resolved]
+            level += 1
+        return ids, chord_km(distances)
+
+    def _search(self, grid, origins, k, rows, ids, distances):
+        """
+        Match origins against the locations in the 27 cells around them.
+        Fills ids and chord lengths at `rows` and returns which origins are
+        resolved: those whose k-th match is closer than any cell outside.
+        """
+        x, y, z = origins
+        keys = _pack(np.floor(np.column_stack(origins) / grid.cell)[:, None, :] + self.offsets)
+        positions = np.minimum(np.searchsorted(grid.keys, keys), len(grid.keys) - 1)
+        counts = np.where(grid.keys[positions] == keys, grid.counts[positions], 0)
+        starts = grid.starts[positions]
+        totals = counts.sum(axis=1)
+
+        resolved = np.zeros(len(rows), dtype=bool)
+        candidates = np.flatnonzero(totals >= k)
+        for batch in _batches(totals[candidates], MAX_PAIRS):
+            origin = candidates[batch]
+            points = grid.order[_ranges(starts[origin].ravel(), counts[origin].ravel())]
+            sizes = totals[origin]
+            pair = np.repeat(origin, sizes)
+            chords = (x[pair] - self.x[points]) ** 2
+            chords += (y[pair] - self.y[points]) ** 2
+            chords += (z[pair] - self.z[points]) ** 2
+            segments = np.cumsum(sizes) - sizes
+            found_ids = np.empty((len(origin), k), dtype=np.int64)
+            found_chords = np.empty((len(origin), k), dtype=np.float64)
+            for rank in range(k):
+                # Closest remaining candidate of every origin, then take it out
+                nearest = np.minimum.reduceat(chords, segments)
+                hits = np.flatnonzero(chords == np.repeat(nearest, sizes))
+                first = hits[np.unique(pair[hits], return_index=True)[1]]
+                found_ids[:, rank] = self.ids[points[first]]
+                found_chords[:, rank] = nearest
+                chords[first] = np.inf
+            found_chords = np.sqrt(found_chords)
+            done = found_chords[:, -1] <= grid.cell
+            ids[rows[origin[done]]] = found_ids[done]
+            distances[rows[origin[done]]] = found_chords[done]
+            resolved[origin[done]] = True
+        return resolved
+
+
+def build_index(rows, location_type=None):
+    """A NearestIndex over snapshot rows, optionally of one location type"""
+    if location_type:
+        rows = [row for row in rows if row['location_type'] == location_type]
+    return NearestIndex(rows, settings.LOCATION_NEAREST_CELL_KM)
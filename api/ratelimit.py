@@ -0,0 +1,192 @@
+"""
+Token-bucket rate limiting for the JSON API.
+
+Buckets live either in process memory or in a small SQLite file next to the
+main database so that several worker processes on one host share the limit.
+The bucket store never touches the Django database connection.
+
+Buckets are keyed before the API key is validated, so every made-up token
+gets one. Both stores therefore forget buckets that have not been used for
+long enough to refill completely (which changes nothing for their next
+request), checking every SWEEP_INTERVAL seconds; the memory store also keeps
+at most API_RATE_LIMIT_MAX_BUCKETS, dropping the least recently used.
+"""
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+SWEEP_INTERVAL = 60
+
+
+def idle_seconds():
+    """Seconds after which any configured bucket has refilled completely"""
+    limits = list(settings.API_RATE_LIMIT_TIERS.values())
+    if settings.API_RATE_LIMIT_USER is not None:
+        limits.append(settings.API_RATE_LIMIT_USER)
+    return max((limit['burst'] / limit['rate'] for limit in limits if limit['rate'] > 0), default=0)
+
+
+class MemoryBucketStore:
+    """
+    Per-process token buckets kept in a dict
+    """
+
+    def __init__(self):
+        # key -> (tokens, updated), least recently used first
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def consume(self, key, rate, burst, cost=1):
+        """
+        Take `cost` tokens from the bucket `key`.
+        Returns (allowed, retry_after_seconds).
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Popped and re-inserted to keep the dict in least recently used order
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed, tokens, retry_after = _take(tokens, rate, cost)
+            self._buckets[key] = (tokens, now)
+            if now >= self._next_sweep or len(self._buckets) > settings.API_RATE_LIMIT_MAX_BUCKETS:
+                self._evict(now)
+        return allowed, retry_after
+
+    def _evict(self, now):
+        """Drop refilled buckets, then the least recently used beyond the cap"""
+        cutoff = now - idle_seconds()
+        excess = len(self._buckets) - settings.API_RATE_LIMIT_MAX_BUCKETS
+        stale = []
+        for key, (_, updated) in self._buckets.items():
+            if updated >= cutoff and len(stale) >= excess:
+                break
+            stale.append(key)
+        for key in stale:
+            del self._buckets[key]
+        self._next_sweep = now + SWEEP_INTERVAL
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets shared by every process on the host through a SQLite file
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._next_sweep = time.time() + SWEEP_INTERVAL
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key, rate, burst, cost=1):
+        """
+        Take `cost` tokens from the bucket `key`.
+        Returns (allowed, retry_after_seconds).
+        """
+        # Wall clock, because monotonic clocks are not comparable across processes
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, updated FROM buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            allowed, tokens, retry_after = _take(tokens, rate, cost)
+            conn.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                (key, tokens, now),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if now >= self._next_sweep:
+            # Each process sweeps on its own schedule; the DELETE is idempotent
+            self._next_sweep = now + SWEEP_INTERVAL
+            conn.execute('DELETE FROM buckets WHERE updated < ?', (now - idle_seconds(),))
+        return allowed, retry_after
+
+    def reset(self):
+        self._connection().execute('DELETE FROM buckets')
+
+
+def _take(tokens, rate, cost):
+    """Apply a token withdrawal, returning (allowed, tokens_left, retry_after)"""
+    if tokens >= cost:
+        return True, tokens - cost, 0
+    if rate <= 0:
+        return False, tokens, 60
+    return False, tokens, math.ceil((cost - tokens) / rate)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    """Return the configured bucket store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.API_RATE_LIMIT_STORE == 'sqlite':
+                    _store = SQLiteBucketStore(settings.API_RATE_LIMIT_DB)
+                else:
+                    _store = MemoryBucketStore()
+    return _store
+
+
+def bucket_key(prefix, value):
+    """Build a bucket key without storing raw API keys in the shared store"""
+    digest = hashlib.sha256(str(value).encode()).hexdigest()[:32]
+    return f'{prefix}:{digest}'
+
+
+def check_rate_limit(api_key, tier, user_id=None):
+    """
+    Check the per-key bucket (sized by `tier`) and, when the owner is known,
+    the per-user bucket. Returns None when allowed or the Retry-After seconds.
+    """
+    if not settings.API_RATE_LIMIT_ENABLED:
+        return None
+
+    store = get_bucket_store()
+    limits = settings.API_RATE_LIMIT_TIERS.get(tier)
+    if limits is not None:
+        allowed, retry_after = store.consume(
+            bucket_key('key', api_key), limits['rate'], limits['burst']
+        )
+        if not allowed:
+            return retry_after
+
+    user_limits = settings.API_RATE_LIMIT_USER
+    if user_id is not None and user_limits is not None:
+        allowed, retry_after = store.consume(
+            bucket_key('user', user_id), user_limits['rate'], user_limits['burst']
+        )
+        if not allowed:
+            return retry_after
+
+    return None
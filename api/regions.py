@@ -0,0 +1,45 @@
+"""
+District -> region mapping used by the location summary.
+
+The source data only names districts, so regions are looked up here.
+Districts that are missing (including junk values the PDF parser sometimes
+produces) fall under OTHER.
+"""
+OTHER = 'Other'
+
+REGIONS = {
+    'Hong Kong Island': [
+        'Aberdeen', 'Admiralty', 'Ap Lei Chau', 'Causeway Bay', 'Central', 'Chai Wan',
+        'Fortress Hill', 'Heng Fa Chuen', 'Kennedy Town', 'Mid-Levels', 'North Point',
+        'Pok Fu Lam', 'Quarry Bay', 'Repulse Bay', 'Sai Wan', 'Sai Wan Ho', 'Sai Ying Pun',
+        'Shau Kei Wan', 'Shek O', 'Sheung Wan', 'Siu Sai Wan', 'Stanley', 'Tai Hang',
+        'Tai Koo', 'Tin Hau', 'Wan Chai', 'Wong Chuk Hang',
+    ],
+    'Kowloon': [
+        'Cheung Sha Wan', 'Choi Hung', 'Diamond Hill', 'Ho Man Tin', 'Hung Hom', 'Jordan',
+        'Kai Tak', 'Kowloon Bay', 'Kowloon City', 'Kowloon Tong', 'Kwun Tong', 'Lai Chi Kok',
+        'Lam Tin', 'Lok Fu', 'Mei Foo', 'Mong Kok', 'Nam Cheong', 'Ngau Chi Wan',
+        'Ngau Tau Kok', 'Prince Edward', 'San Po Kong', 'Sau Mau Ping', 'Sham Shui Po',
+        'Shek Kip Mei', 'Tai Kok Tsui', 'To Kwa Wan', 'Tsim Sha Tsui', 'Tsz Wan Shan',
+        'Whampoa', 'Wong Tai Sin', 'Yau Ma Tei', 'Yau Tong',
+    ],
+    'New Territories': [
+        'Fanling', 'Fo Tan', 'Kwai Chung', 'Kwai Fong', 'Lai King', 'Ma On Shan', 'Ma Wan',
+        'Sai Kung', 'Sha Tin', 'Sham Tseng', 'Sheung Shui', 'Tai Po', 'Tai Wai', 'Tai Wo Hau',
+        'Tin Shui Wai', 'Tiu Keng Leng', 'Tseung Kwan O', 'Tsing Lung Tau', 'Tsing Yi',
+        'Tsuen Wan', 'Tuen Mun', 'Yuen Long',
+    ],
+    'Islands': [
+        'Chek Lap Kok', 'Cheung Chau', 'Discovery Bay', 'Mui Wo', 'Pui O', 'Tung Chung',
+    ],
+    'Macau': [
+        'Areia Preta', 'Cotai', 'Macau', 'Macau Peninsula', 'Taipa',
+    ],
+}
+
+DISTRICT_REGIONS = {district: region for region, districts in REGIONS.items() for district in districts}
+
+
+def region_for(district):
+    """Return the region a district belongs to, or OTHER"""
+    return DISTRICT_REGIONS.get(district, OTHER)
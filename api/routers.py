@@ -0,0 +1,28 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from .location_db import LOCATION_DB_ALIAS, LOCATION_MODELS, read_alias
+
+
+class LocationRouter:
+    """
+    Sends reads of the location tables to the read-only location database
+    (see api.location_db) and everything else, including every write, to the
+    default database. Installed when LOCATION_DB_ENABLED is on.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label in LOCATION_MODELS:
+            return read_alias()
+        # Explicit, so related objects of rows read from the location
+        # database are not looked up there
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The location database is built by build_location_db, never migrated
+        return db != LOCATION_DB_ALIAS
@@ -0,0 +1,47 @@
+"""
+JSON serializers for API responses.
+
+API payloads are built from plain dicts, lists, strings and numbers (the
+location snapshot converts coordinates to float when it is built), so they
+need none of DjangoJSONEncoder's per-object hooks. API_JSON_SERIALIZER names
+the function used to encode them; it takes an object and returns bytes.
+"""
+import json
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def stdlib_dumps(obj):
+    """Standard library encoder on its C fast path (no default hook)"""
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+
+def orjson_dumps(obj):
+    """orjson encoder; requires the optional 'orjson' package"""
+    if orjson is None:
+        raise ImportError('api.serializers.orjson_dumps requires the orjson package')
+    return orjson.dumps(obj)
+
+
+def fast_dumps(obj):
+    """orjson when it is installed, otherwise the standard library"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return stdlib_dumps(obj)
+
+
+@lru_cache(maxsize=None)
+def _serializer(path):
+    return import_string(path)
+
+
+def dumps(obj):
+    """Encode an API payload with the configured API_JSON_SERIALIZER"""
+    return _serializer(settings.API_JSON_SERIALIZER)(obj)
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .dashboard import invalidate_dashboard
+from .location_db import LOCATION_DB_ALIAS
+from .metrics import count_queries
+from .models import CreditBalance, CreditTransaction, User
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    Apply SQLITE_PRAGMAS to new SQLite connections under the production
+    database profile
+    """
+    if connection.vendor != 'sqlite' or settings.DATABASE_PROFILE != 'production':
+        return
+    if connection.alias == LOCATION_DB_ALIAS:
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver(connection_created)
+def configure_location_db_connection(sender, connection, **kwargs):
+    """Memory-map the read-only location database"""
+    if connection.alias != LOCATION_DB_ALIAS:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA mmap_size = {int(settings.LOCATION_DB_MMAP_SIZE)}')
+        cursor.execute('PRAGMA query_only = 1')
+
+
+@receiver(connection_created)
+def install_query_metrics(sender, connection, **kwargs):
+    """Count queries and database time for the request being measured"""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+@receiver(post_save, sender=User)
+def create_credit_balance(sender, instance, created, raw=False, **kwargs):
+    """Every user gets a balance when the account is created, never on a page view"""
+    if created and not raw:
+        CreditBalance.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=CreditBalance)
+@receiver(post_save, sender=CreditTransaction)
+def invalidate_dashboard_summary(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_dashboard(instance.user_id)
@@ -0,0 +1,178 @@
+"""
+Opt-in log of slow requests (SLOW_REQUEST_LOG_ENABLED).
+
+SlowRequestMiddleware runs just inside MetricsMiddleware and has the query
+wrapper of api.metrics keep every SQL statement of the request. When a
+request takes SLOW_REQUEST_THRESHOLD_MS or longer, or is picked at random
+with SLOW_REQUEST_SAMPLE_RATE, one JSON line is appended to
+SLOW_REQUEST_LOG_PATH: endpoint, method, path, query parameters, status,
+stage timings and every statement with its duration and EXPLAIN QUERY PLAN.
+The file rotates at SLOW_REQUEST_LOG_MAX_BYTES, keeping
+SLOW_REQUEST_LOG_BACKUPS old files; `manage.py slow_requests` summarizes
+them.
+
+Statement parameters are only used to explain the statements and are never
+written: they include API keys and session keys. For the same reason only
+the query string of a request is logged, not its body or headers.
+
+Plans and the file write are done by one background thread per process, so
+a logged request is not delayed by them. Requests that are not logged only
+pay for keeping the statement list.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections
+from django.utils import timezone
+
+from .metrics import current_request_metrics, endpoint_name
+
+logger = logging.getLogger(__name__)
+# Records go only to the rotating file, never to the console handlers
+record_logger = logging.getLogger('api.slowlog.records')
+record_logger.propagate = False
+record_logger.setLevel(logging.INFO)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+
+def get_writer():
+    """Return the background writer, creating it and the log handler on first use"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            settings.SLOW_REQUEST_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+            record_logger.addHandler(RotatingFileHandler(
+                settings.SLOW_REQUEST_LOG_PATH,
+                maxBytes=settings.SLOW_REQUEST_LOG_MAX_BYTES,
+                backupCount=settings.SLOW_REQUEST_LOG_BACKUPS,
+                encoding='utf-8',
+            ))
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slowlog')
+    return _writer
+
+
+def query_plan(alias, sql, params):
+    """
+    Detail lines of EXPLAIN QUERY PLAN for a SELECT on an SQLite database,
+    or None. Uses the backend cursor directly, bypassing the execute
+    wrappers, so the plans are not counted as queries.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'sqlite' or not EXPLAINABLE.match(sql):
+        return None
+    try:
+        connection.ensure_connection()
+        cursor = connection.create_cursor()
+        try:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except DatabaseError as e:
+        return [f'(no plan: {e})']
+
+
+def write_record(record, queries):
+    """Explain the statements of a logged request and append it to the log"""
+    close_old_connections()
+    try:
+        plans = {}
+        statements = []
+        for alias, sql, params, many, seconds in queries:
+            key = (alias, sql)
+            if key not in plans:
+                plans[key] = None if many else query_plan(alias, sql, params)
+            statements.append({
+                'alias': alias,
+                'sql': sql,
+                'ms': round(seconds * 1000, 3),
+                'plan': plans[key],
+            })
+        record['queries'] = statements
+        record_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception:
+        logger.exception('Could not write a slow-request record')
+    finally:
+        close_old_connections()
+
+
+def query_params(request):
+    return {key: values[0] if len(values) == 1 else values for key, values in request.GET.lists()}
+
+
+class SlowRequestMiddleware:
+    """
+    Log requests slower than SLOW_REQUEST_THRESHOLD_MS, and a sample of the
+    others, with their SQL statements and query plans.
+    Must come right after api.metrics.MetricsMiddleware in MIDDLEWARE
+    (settings adds it there when SLOW_REQUEST_LOG_ENABLED is set).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request_metrics = self.start()
+        response = self.get_response(request)
+        self.finish(request, response, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics = self.start()
+        response = await self.get_response(request)
+        self.finish(request, response, request_metrics)
+        return response
+
+    @staticmethod
+    def start():
+        request_metrics = current_request_metrics()
+        if request_metrics is not None:
+            request_metrics.queries = []
+        return request_metrics
+
+    def finish(self, request, response, request_metrics):
+        if request_metrics is None:
+            return
+        queries, request_metrics.queries = request_metrics.queries, None
+        total = time.perf_counter() - request_metrics.started
+        if total * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            reason = 'slow'
+        elif random.random() < settings.SLOW_REQUEST_SAMPLE_RATE:
+            reason = 'sampled'
+        else:
+            return
+
+        record = {
+            'time': timezone.now().isoformat(),
+            'reason': reason,
+            'endpoint': endpoint_name(request),
+            'method': request.method,
+            'path': request.path,
+            'params': query_params(request),
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 3),
+            'db_ms': round(request_metrics.db_time * 1000, 3),
+            'db_queries': request_metrics.db_queries,
+            'dropped_queries': request_metrics.dropped_queries,
+            'timings': {stage: round(seconds * 1000, 3) for stage, seconds in request_metrics.timings.items()},
+        }
+        get_writer().submit(write_record, record, queries)
@@ -0,0 +1,248 @@
+"""
+In-memory snapshot of the active locations with lookup indexes.
+
+The snapshot is built once per dataset version and answers the
+/api/locations filters without touching the database. Processes started by
+the `serve` command inherit a snapshot built in the master and never
+re-check the version themselves; every other process refreshes it at most
+every LOCATION_SNAPSHOT_CHECK_INTERVAL seconds. With
+LOCATION_SNAPSHOT_STALE_WHILE_REVALIDATE, requests keep using the current
+snapshot while the new version is built in the background, and the rows of
+a version come from the shared cache when another worker already read them.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .location_db import read_alias
+from .metrics import SNAPSHOT_REBUILDS, timed
+from .models import DatasetVersion, Location
+from .nearest import build_index
+from .tiered_cache import TieredCache
+from .tiles import TilePyramid
+
+logger = logging.getLogger(__name__)
+
+LOCATION_FIELDS = (
+    'id', 'location_type', 'name', 'address', 'district',
+    'latitude', 'longitude', 'phone', 'opening_hours'
+)
+
+
+def _native_coordinates(row):
+    """Replace the Decimal coordinates of a row with floats, once, so responses can be encoded without hooks"""
+    for field in ('latitude', 'longitude'):
+        if row[field] is not None:
+            row[field] = float(row[field])
+    return row
+
+
+def query_rows(version):
+    """Active location rows of a dataset version, from the location database when it has it"""
+    rows = Location.objects.using(read_alias(version)).filter(is_active=True).values(*LOCATION_FIELDS)
+    return [_native_coordinates(row) for row in rows]
+
+
+# Rows per dataset version, shared through the cache so that after a reload
+# one worker queries the database and the others load its result
+rows_cache = TieredCache('location-rows', max_entries=1)
+
+
+class LocationSnapshot:
+    """
+    Immutable copy of the active locations for one dataset version
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        # Rows keep the model's default ordering (district, name)
+        self.rows = tuple(rows)
+
+        # location_type -> row positions
+        self.by_type = {}
+        # lowercased district -> row positions
+        self.by_district = {}
+        self.names_lower = tuple(row['name'].lower() for row in self.rows)
+        # location id -> row position
+        self.positions = {row['id']: position for position, row in enumerate(self.rows)}
+        # filter key -> CompressedPayload, see api.compression
+        self.payloads = {}
+        # Clustered map tiles, see tile_pyramid()
+        self._tiles = None
+        # location_type ('' for all) -> api.nearest.NearestIndex, see nearest_index()
+        self._nearest = {}
+        # Guards the structures built on first use
+        self._build_lock = threading.Lock()
+
+        for position, row in enumerate(self.rows):
+            self.by_type.setdefault(row['location_type'], []).append(position)
+            self.by_district.setdefault(row['district'].lower(), []).append(position)
+
+    @classmethod
+    def build(cls):
+        """Load the active locations for the current dataset version"""
+        with timed('snapshot'):
+            version = DatasetVersion.current()
+            rows = rows_cache.get_or_set(version, lambda: query_rows(version), settings.LOCATION_CACHE_TTL)
+            snapshot = cls(version, rows)
+        SNAPSHOT_REBUILDS.inc()
+        return snapshot
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def tiles_ready(self):
+        return self._tiles is not None
+
+    def tile_pyramid(self):
+        """The clustered map tiles of this snapshot, built on first use"""
+        if self._tiles is None:
+            with self._build_lock:
+                if self._tiles is None:
+                    with timed('tiles'):
+                        self._tiles = TilePyramid.build(self.rows, settings.LOCATION_TILE_MAX_ZOOM)
+        return self._tiles
+
+    def nearest_index(self, location_type=None):
+        """Bulk nearest-location index of this snapshot (needs numpy), built on first use per type"""
+        location_type = (location_type or '').upper()
+        index = self._nearest.get(location_type)
+        if index is None:
+            with self._build_lock:
+                index = self._nearest.get(location_type)
+                if index is None:
+                    index = self._nearest[location_type] = build_index(self.rows, location_type)
+        return index
+
+    def get_many(self, ids):
+        """Rows for the given location ids, in snapshot order; unknown ids are skipped"""
+        positions = sorted(self.positions[pk] for pk in ids if pk in self.positions)
+        return [self.rows[p] for p in positions]
+
+    def rows_at(self, positions):
+        """Rows at the given positions; None means every row"""
+        if positions is None:
+            return list(self.rows)
+        return [self.rows[p] for p in positions]
+
+    def filter(self, location_type=None, district=None, search=None):
+        """
+        Same semantics as the /api/locations query parameters: exact type,
+        case-insensitive substring match on district and name.
+        """
+        return self.rows_at(self.filter_positions(location_type, district, search))
+
+    def filter_positions(self, location_type=None, district=None, search=None):
+        """Sorted row positions matching the filters, or None for all rows"""
+        positions = None
+
+        if location_type:
+            positions = set(self.by_type.get(location_type.upper(), ()))
+
+        if district:
+            district = district.lower()
+            matched = set()
+            for name, district_positions in self.by_district.items():
+                if district in name:
+                    matched.update(district_positions)
+            positions = matched if positions is None else positions & matched
+
+        if search:
+            search = search.lower()
+            candidates = range(len(self.rows)) if positions is None else positions
+            positions = {p for p in candidates if search in self.names_lower[p]}
+
+        if positions is None:
+            return None
+        return sorted(positions)
+
+
+_snapshot = None
+_checked_at = 0.0
+_pinned = False
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def set_location_snapshot(snapshot, pinned=False):
+    """
+    Install a snapshot for this process. A pinned snapshot is never
+    refreshed; the process owner is responsible for replacing it.
+    """
+    global _snapshot, _checked_at, _pinned
+    with _lock:
+        _snapshot = snapshot
+        _checked_at = time.monotonic()
+        _pinned = pinned
+
+
+def current_location_snapshot():
+    """
+    Return the snapshot if it can be used without a database round trip,
+    or None when it is missing or due for a version check.
+    """
+    if _snapshot is None:
+        return None
+    if _pinned or time.monotonic() - _checked_at < settings.LOCATION_SNAPSHOT_CHECK_INTERVAL:
+        return _snapshot
+    return None
+
+
+def get_location_snapshot():
+    """
+    Return an up-to-date snapshot, rebuilding it when the dataset version
+    has changed since it was built
+    """
+    global _snapshot, _checked_at
+    snapshot = current_location_snapshot()
+    if snapshot is not None:
+        return snapshot
+
+    with _lock:
+        if _snapshot is not None and (
+            _pinned or time.monotonic() - _checked_at < settings.LOCATION_SNAPSHOT_CHECK_INTERVAL
+        ):
+            return _snapshot
+        if _snapshot is None:
+            _snapshot = LocationSnapshot.build()
+        elif DatasetVersion.current() != _snapshot.version:
+            if settings.LOCATION_SNAPSHOT_STALE_WHILE_REVALIDATE:
+                _rebuild_in_background()
+            else:
+                _snapshot = LocationSnapshot.build()
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def _rebuild_in_background():
+    """
+    Build the snapshot for the new dataset version in a thread while
+    requests keep using the current one. Called with _lock held.
+    """
+    global _rebuilding
+    if _rebuilding:
+        return
+    _rebuilding = True
+
+    def rebuild():
+        global _snapshot, _rebuilding
+        try:
+            snapshot = LocationSnapshot.build()
+            # Local import: api.views imports this module
+            from .views import precompress_payloads
+            precompress_payloads(snapshot)
+            snapshot.tile_pyramid()
+            with _lock:
+                if not _pinned:
+                    _snapshot = snapshot
+        except Exception:
+            logger.exception('Rebuilding the location snapshot failed')
+        finally:
+            _rebuilding = False
+            connections.close_all()
+
+    threading.Thread(target=rebuild, name='location-snapshot-rebuild', daemon=True).start()
@@ -0,0 +1,991 @@
+import asyncio
+import gzip
+import io
+import ipaddress
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import AsyncRequestFactory, LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from sfexpress_client import (
+    APIError, AsyncClient, AuthenticationError, Client, FullSyncRequired, InsufficientCredits, RateLimited
+)
+from sfexpress_client.client import Response
+
+from . import ratelimit, slowlog, tiered_cache
+from .admin import EstimatedCountPaginator
+from .credits import charge_credits, compact_credit_stripes
+from .dashboard import dashboard_cache_key
+from .location_db import LOCATION_DB_ALIAS, build_location_db, file_version, location_db_uri, read_alias
+from .management.commands.load_sfexpress_data import Command as LoadCommand
+from .management.commands.serve import WorkerSlots, counting_application
+from .models import (
+    APIKey, CreditBalance, CreditStripe, CreditTransaction, DatasetVersion, IdempotencyRecord, Location,
+    LocationSummary, User,
+)
+from .nearest import numpy_available
+from .routers import LocationRouter
+from .serializers import orjson
+from .snapshot import LocationSnapshot, rows_cache, set_location_snapshot
+from .tiered_cache import TieredCache
+from .views import alocations, filter_cache
+
+
+def create_user(username='alice', credits=100):
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='secret')
+    CreditBalance.objects.filter(user=user).update(credits=credits)
+    return user
+
+
+def load_snapshot():
+    """
+    Install a snapshot of the test's locations. Dataset version ids repeat
+    between tests, so the caches keyed by version are cleared first.
+    """
+    cache.clear()
+    rows_cache.clear_local()
+    filter_cache.clear_local()
+    snapshot = LocationSnapshot.build()
+    set_location_snapshot(snapshot)
+    return snapshot
+
+
+class CreditChargeTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.api_key = APIKey.objects.create(user=self.user, name='test')
+
+    def test_deduct_credits_uses_current_balance(self):
+        # Two copies of the same row, as two concurrent requests hold them
+        first = CreditBalance.objects.get(user=self.user)
+        second = CreditBalance.objects.get(user=self.user)
+        self.assertTrue(first.deduct_credits(60))
+        self.assertFalse(second.deduct_credits(60))
+        self.assertEqual(second.credits, 40)
+        self.assertTrue(second.deduct_credits(40))
+
+        balance = CreditBalance.objects.get(user=self.user)
+        self.assertEqual((balance.credits, balance.total_spent), (0, 100))
+
+    @override_settings(CREDIT_STRIPES=4, CREDIT_STRIPE_RESERVE=50)
+    def test_striped_charge_rolls_back_without_ledger_row(self):
+        balance = CreditBalance.objects.get(user=self.user)
+        with mock.patch.object(CreditTransaction.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                charge_credits(balance, 5, 'Locations query')
+
+        balance.refresh_from_db()
+        self.assertEqual(balance.credits, 100)
+        self.assertFalse(CreditStripe.objects.filter(user=self.user, reserved__gt=0).exists())
+        self.assertFalse(CreditStripe.objects.filter(user=self.user, spent__gt=0).exists())
+
+    @override_settings(CREDIT_STRIPES=4, CREDIT_STRIPE_RESERVE=50)
+    def test_insufficient_credits_reports_available_credits(self):
+        # The balance is used up but a stripe still holds 3 reserved credits
+        CreditBalance.objects.filter(user=self.user).update(credits=0)
+        CreditStripe.objects.bulk_create(
+            CreditStripe(user=self.user, stripe=stripe, reserved=3 if stripe == 0 else 0) for stripe in range(4)
+        )
+
+        response = self.client.get('/api/locations', HTTP_AUTHORIZATION=f'Bearer {self.api_key.key}')
+        self.assertEqual(response.status_code, 402)
+        self.assertEqual(response.json()['available'], 3)
+
+    @override_settings(CREDIT_STRIPE_RESERVE=50)
+    def test_raising_stripe_count_keeps_every_credit(self):
+        CreditBalance.objects.filter(user=self.user).update(credits=1000)
+        balance = CreditBalance.objects.get(user=self.user)
+        with self.settings(CREDIT_STRIPES=2):
+            self.assertTrue(charge_credits(balance, 5, 'Locations query', 'a'))
+        with self.settings(CREDIT_STRIPES=8):
+            for i in range(20):
+                self.assertTrue(charge_credits(balance, 5, 'Locations query', f'key-{i}'))
+
+        self.assertEqual(balance.credits, 895)
+        self.assertEqual(CreditStripe.objects.filter(user=self.user).count(), 8)
+        self.assertEqual(compact_credit_stripes(self.user.id), 1)
+        balance.refresh_from_db()
+        self.assertEqual((balance.credits, balance.total_spent), (895, 105))
+
+
+class DashboardSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(credits=100)
+        self.client.force_login(self.user)
+
+    def test_charge_invalidates_summary_on_commit(self):
+        response = self.client.get('/dashboard')
+        self.assertEqual(response.context['credit_balance'].credits, 100)
+        self.assertIsNotNone(cache.get(dashboard_cache_key(self.user.pk)))
+
+        # Served from the cache: no balance or transaction queries
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/dashboard')
+        self.assertFalse(any('api_creditbalance' in query['sql'] for query in queries.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            charge_credits(CreditBalance.objects.get(user=self.user), 5, 'Locations query')
+            # Still cached until the charge commits
+            self.assertIsNotNone(cache.get(dashboard_cache_key(self.user.pk)))
+        self.assertIsNone(cache.get(dashboard_cache_key(self.user.pk)))
+
+        response = self.client.get('/dashboard')
+        self.assertEqual(response.context['credit_balance'].credits, 95)
+        self.assertEqual(response.context['transactions'][0].amount, -5)
+
+
+class MetricsAccessTests(TestCase):
+    def test_disabled_by_default(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_BEARER_TOKEN='scrape-token')
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'sfexpress_http_request_duration_seconds', response.content)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_ALLOWED_IPS=[ipaddress.ip_network('10.0.0.0/8')])
+    def test_allowed_ips(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+
+
+@override_settings(
+    API_RATE_LIMIT_STORE='memory',
+    API_RATE_LIMIT_TIERS={tier: {'rate': 1, 'burst': 2} for tier in ('FREE', 'STANDARD', 'PREMIUM')},
+    API_RATE_LIMIT_USER={'rate': 1, 'burst': 3},
+)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit.get_bucket_store().reset()
+        self.user = create_user()
+        self.keys = [APIKey.objects.create(user=self.user, name=name).key for name in ('first', 'second')]
+
+    def get(self, key):
+        return self.client.get('/api/credits/ledger', HTTP_AUTHORIZATION=f'Bearer {key}')
+
+    def test_key_bucket_returns_retry_after(self):
+        self.assertEqual([self.get(self.keys[0]).status_code for _ in range(2)], [200, 200])
+        response = self.get(self.keys[0])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.json()['retry_after'], 1)
+
+    def test_user_bucket_is_shared_by_keys(self):
+        statuses = [self.get(key).status_code for key in (self.keys[0], self.keys[1], self.keys[1])]
+        self.assertEqual(statuses, [200, 200, 200])
+        # The second key still has tokens, but the user's bucket is empty
+        self.assertEqual(self.get(self.keys[1]).status_code, 429)
+
+    @override_settings(API_RATE_LIMIT_MAX_BUCKETS=2)
+    def test_memory_store_drops_refilled_and_least_recent_buckets(self):
+        store = ratelimit.MemoryBucketStore()
+        with mock.patch.object(ratelimit.time, 'monotonic', return_value=1000.0):
+            for key in ('a', 'b', 'c'):
+                store.consume(key, 1, 2)
+            self.assertEqual(list(store._buckets), ['b', 'c'])
+        # Refilled after burst / rate = 2 seconds; swept SWEEP_INTERVAL later
+        with mock.patch.object(ratelimit.time, 'monotonic', return_value=1000.0 + ratelimit.SWEEP_INTERVAL):
+            store.consume('d', 1, 2)
+        self.assertEqual(list(store._buckets), ['d'])
+
+    def test_sqlite_store_deletes_refilled_buckets(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'ratelimit.sqlite3'
+        store = ratelimit.SQLiteBucketStore(path)
+        now = time.time()
+        with mock.patch.object(ratelimit.time, 'time', return_value=now):
+            store.consume('a', 1, 2)
+        with mock.patch.object(ratelimit.time, 'time', return_value=now + ratelimit.SWEEP_INTERVAL):
+            store.consume('b', 1, 2)
+        keys = [row[0] for row in store._connection().execute('SELECT key FROM buckets')]
+        self.assertEqual(keys, ['b'])
+
+
+class CompressedPayloadTests(TestCase):
+    def setUp(self):
+        user = create_user(credits=1000)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {APIKey.objects.create(user=user, name="test").key}'}
+        for district in ('Wan Chai', 'Sha Tin'):
+            Location.objects.create(location_type='LOCKER', name=f'SF Locker {district}', address='1 Road',
+                                    district=district)
+        DatasetVersion.bump('test')
+        self.snapshot = load_snapshot()
+
+    def test_only_known_filters_are_precompressed(self):
+        for district in ('wan chai', 'wan', 'no such place'):
+            response = self.client.get('/api/locations', {'district': district}, HTTP_ACCEPT_ENCODING='gzip',
+                                       **self.headers)
+            self.assertEqual(response.status_code, 200)
+        self.client.get('/api/locations', {'type': 'kiosk'}, **self.headers)
+        self.assertEqual(set(self.snapshot.payloads), {('', 'wan chai')})
+
+    def test_compressed_response_matches_uncompressed(self):
+        compressed = self.client.get('/api/locations', {'district': 'Sha Tin'}, HTTP_ACCEPT_ENCODING='gzip',
+                                     **self.headers)
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        body = json.loads(gzip.decompress(compressed.content))
+        self.assertEqual([row['name'] for row in body['locations']], ['SF Locker Sha Tin'])
+        self.assertEqual(body['credits_remaining'], 995)
+
+
+class AsyncLocationsTests(TransactionTestCase):
+    """alocations must keep the event loop free while the filter cache blocks"""
+
+    def test_filter_cache_wait_does_not_block_event_loop(self):
+        user = create_user()
+        Location.objects.create(location_type='LOCKER', name='SF Locker Sha Tin', address='1 Road',
+                                district='Sha Tin')
+        DatasetVersion.bump('test')
+        load_snapshot()
+        request = AsyncRequestFactory().get('/api/locations', {'district': 'Sha Tin'})
+        request.user = user
+
+        def slow_get_or_set(key, compute, *args):
+            # As when waiting for another worker to fill the entry
+            time.sleep(0.3)
+            return compute()
+
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            response = await alocations(request)
+            task.cancel()
+            return response, ticks
+
+        with mock.patch.object(filter_cache, 'get_or_set', slow_get_or_set):
+            response, ticks = async_to_sync(run)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['count'], 1)
+        self.assertGreater(ticks, 10)
+
+
+@skipUnless(tiered_cache.fcntl is not None, 'needs fcntl')
+class TieredCacheLockTests(TestCase):
+    def test_file_cache_lock_excludes_other_processes(self):
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                              'LOCATION': directory / 'cache'}}
+        with self.settings(CACHES=caches, CACHE_LOCK_PATH=directory / 'cache.lock'):
+            shared = TieredCache('test', max_entries=1)
+            self.assertTrue(shared._lock('key:lock'))
+            # A lock on the file, not an entry in the cache
+            self.assertIsNone(shared.shared.get('test:key:lock'))
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            child = context.Process(target=lambda: results.put(shared._lock('key:lock')))
+            child.start()
+            self.assertFalse(results.get(timeout=10))
+            child.join()
+
+            shared._unlock('key:lock')
+            child = context.Process(target=lambda: results.put(shared._lock('key:lock')))
+            child.start()
+            self.assertTrue(results.get(timeout=10))
+            child.join()
+
+
+class LocationAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(self.admin)
+
+    def test_exports_are_written_after_commit(self):
+        with mock.patch('api.admin.export_current_version') as export, \
+                mock.patch('api.admin.build_location_db') as build:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post('/admin/api/location/add/', {
+                    'location_type': 'LOCKER', 'name': 'SF Locker Tai Po', 'address': '1 Road',
+                    'district': 'Tai Po', 'is_active': 'on',
+                })
+                self.assertEqual(response.status_code, 302)
+                export.assert_not_called()
+                build.assert_not_called()
+            for callback in callbacks:
+                callback()
+        export.assert_called_once_with()
+        build.assert_called_once_with(DatasetVersion.current())
+
+
+class LoaderSyncTests(TestCase):
+    def test_invalid_row_is_rejected_before_the_batch_insert(self):
+        command = LoadCommand(stdout=io.StringIO())
+        command.parsed = []
+        row = {'location_type': 'LOCKER', 'name': 'SF Locker H852A - Sha Tin', 'address': '1 Road',
+               'district': 'Sha Tin', 'phone': '+852-2730-0273', 'opening_hours': '24/7', 'is_active': True}
+        command.create_location(**row)
+        with self.assertRaises(ValidationError):
+            command.create_location(**{**row, 'name': 'SF Locker H852B', 'district': None})
+
+        upserted, deleted = command.sync_locations(command.parsed)
+        self.assertEqual((len(upserted), deleted), (1, []))
+        self.assertEqual(list(Location.objects.values_list('name', flat=True)), [row['name']])
+
+
+@override_settings(ADMIN_EXACT_COUNT_LIMIT=3)
+class EstimatedCountPaginatorTests(TestCase):
+    def test_filtered_pages_stay_reachable(self):
+        user = create_user()
+        CreditTransaction.objects.bulk_create(
+            CreditTransaction(user=user, transaction_type='API_CALL', amount=-5, balance_after=0) for _ in range(60)
+        )
+        queryset = CreditTransaction.objects.filter(transaction_type='API_CALL').order_by('id')
+
+        # Counted ten pages ahead: one row more than that, so the links end there
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 23)
+        paginator = EstimatedCountPaginator(queryset, 2, page_number=12)
+        self.assertEqual(paginator.num_pages, 23)
+        self.assertEqual(len(paginator.page(12).object_list), 2)
+        # Near the end the count is exact
+        paginator = EstimatedCountPaginator(queryset, 2, page_number=30)
+        self.assertEqual(paginator.count, 60)
+        self.assertEqual(paginator.page(30).object_list[1], queryset.last())
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Changelists must run a fixed number of queries, however many rows they list"""
+    # As benchmarks/bench_admin.py measures with 200k ledger rows
+    MAX_QUERIES = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        for number in range(5):
+            user = create_user(f'customer{number}')
+            APIKey.objects.create(user=user, name='first')
+            APIKey.objects.create(user=user, name='second')
+            CreditTransaction.objects.bulk_create(
+                CreditTransaction(user=user, transaction_type=kind, amount=amount, balance_after=100)
+                for kind, amount in [('PURCHASE', 100), ('API_CALL', -5), ('API_CALL', -1)] * 4
+            )
+        Location.objects.bulk_create(
+            Location(location_type=kind, name=f'SF {kind} {district}', address='1 Road', district=district)
+            for kind in ('LOCKER', 'SHOP') for district in ('Sha Tin', 'Tai Po', 'Wan Chai')
+        )
+        DatasetVersion.bump('test')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists(self):
+        year = CreditTransaction.objects.values_list('created_at', flat=True).first().year
+        pages = [
+            '/admin/api/user/',
+            '/admin/api/user/?q=customer1',
+            '/admin/api/user/?is_staff__exact=0',
+            '/admin/api/apikey/',
+            '/admin/api/apikey/?q=customer1',
+            '/admin/api/apikey/?rate_limit_tier__exact=STANDARD',
+            f'/admin/api/apikey/?created_at__year={year}',
+            '/admin/api/credittransaction/',
+            '/admin/api/credittransaction/?q=customer1',
+            '/admin/api/credittransaction/?transaction_type__exact=API_CALL',
+            f'/admin/api/credittransaction/?created_at__year={year}',
+            '/admin/api/credittransaction/?transaction_type__exact=API_CALL&p=1',
+            '/admin/api/location/',
+            '/admin/api/location/?q=Tai',
+            '/admin/api/location/?district=Sha+Tin',
+            '/admin/api/location/?location_type__exact=SHOP&is_active__exact=1',
+        ]
+        for url in pages:
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(queries), self.MAX_QUERIES, '\n'.join(q['sql'] for q in queries))
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = create_user(credits=100)
+        key = APIKey.objects.create(user=self.user, name='test').key
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {key}', 'HTTP_IDEMPOTENCY_KEY': 'retry-1'}
+        Location.objects.create(location_type='LOCKER', name='SF Locker Sha Tin', address='1 Road',
+                                district='Sha Tin')
+        DatasetVersion.bump('test')
+        load_snapshot()
+
+    def credits(self):
+        return CreditBalance.objects.get(user=self.user).credits
+
+    def test_replay_is_not_charged(self):
+        first = self.client.get('/api/locations', {'search': 'locker'}, **self.headers)
+        retry = self.client.get('/api/locations', {'search': 'locker'}, **self.headers)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(self.credits(), 95)
+
+    def test_export_retry_is_not_charged(self):
+        with self.settings(EXPORT_DIR=Path(self.enterContext(tempfile.TemporaryDirectory()))):
+            first = self.client.get('/api/locations/export', {'format': 'csv'}, **self.headers)
+            retry = self.client.get('/api/locations/export', {'format': 'csv'}, **self.headers)
+            self.assertEqual(retry.status_code, 200)
+            self.assertEqual(retry['Idempotent-Replayed'], 'true')
+            self.assertEqual(b''.join(retry.streaming_content), b''.join(first.streaming_content))
+            # Only one free re-run per key
+            again = self.client.get('/api/locations/export', {'format': 'csv'}, **self.headers)
+            self.assertEqual(again.status_code, 410)
+        self.assertEqual(self.credits(), 95)
+        self.assertEqual(CreditTransaction.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(IDEMPOTENCY_MAX_BODY_BYTES=10)
+    def test_large_bodies_are_not_stored(self):
+        self.client.get('/api/locations', {'search': 'locker'}, **self.headers)
+        record = IdempotencyRecord.objects.get(key='retry-1')
+        self.assertEqual((record.has_body, bytes(record.body)), (False, b''))
+
+        retry = self.client.get('/api/locations', {'search': 'locker'}, **self.headers)
+        self.assertEqual(retry.json()['count'], 1)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        again = self.client.get('/api/locations', {'search': 'locker'}, **self.headers)
+        self.assertEqual(again.status_code, 410)
+        self.assertEqual(self.credits(), 95)
+
+    def test_replay_honours_accept_encoding(self):
+        first = self.client.get('/api/locations', HTTP_ACCEPT_ENCODING='gzip', **self.headers)
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+
+        retry = self.client.get('/api/locations', HTTP_ACCEPT_ENCODING='gzip', **self.headers)
+        self.assertEqual((retry['Content-Encoding'], retry.content), ('gzip', first.content))
+        # Decoded from the stored body, every time, without running the view
+        for _ in range(2):
+            retry = self.client.get('/api/locations', **self.headers)
+            self.assertFalse(retry.has_header('Content-Encoding'))
+            self.assertEqual(retry['Idempotent-Replayed'], 'true')
+            self.assertEqual(retry.content, gzip.decompress(first.content))
+        self.assertEqual(self.credits(), 95)
+
+    def test_prune_keeps_other_keys_records(self):
+        other = APIKey.objects.create(user=self.user, name='other')
+        IdempotencyRecord.objects.create(api_key=other, key='old', request_hash='x', status_code=200,
+                                         expires_at=timezone.now())
+        self.client.get('/api/locations', **self.headers)
+        self.assertTrue(IdempotencyRecord.objects.filter(api_key=other, key='old').exists())
+
+
+class LocationJSONTests(TestCase):
+    def setUp(self):
+        user = create_user(credits=100)
+        self.key = APIKey.objects.create(user=user, name='test').key
+        Location.objects.create(location_type='LOCKER', name='SF Locker Sha Tin', address='1 Road',
+                                district='Sha Tin', latitude='22.381700', longitude='114.187700')
+        DatasetVersion.bump('test')
+        load_snapshot()
+
+    def test_coordinates_are_json_numbers_with_every_serializer(self):
+        serializers = ['api.serializers.stdlib_dumps', 'api.serializers.fast_dumps']
+        if orjson is not None:
+            serializers.append('api.serializers.orjson_dumps')
+        bodies = []
+        for serializer in serializers:
+            with self.settings(API_JSON_SERIALIZER=serializer):
+                # A search is serialized per request, not from the precompressed payloads
+                response = self.client.get('/api/locations', {'search': 'locker'},
+                                           HTTP_AUTHORIZATION=f'Bearer {self.key}')
+            location = response.json()['locations'][0]
+            self.assertEqual((location['latitude'], location['longitude']), (22.3817, 114.1877))
+            body = response.json()
+            del body['credits_remaining']
+            bodies.append(body)
+        self.assertTrue(all(body == bodies[0] for body in bodies))
+
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        self.user = create_user(credits=100)
+        key = APIKey.objects.create(user=self.user, name='test').key
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+
+    def changes(self, since):
+        return self.client.get('/api/locations/changes', {'since': since}, **self.headers)
+
+    def test_upserts_and_tombstones(self):
+        kept, removed = [
+            Location.objects.create(location_type='LOCKER', name=f'SF Locker {district}', address='1 Road',
+                                    district=district)
+            for district in ('Sha Tin', 'Tai Po')
+        ]
+        first = DatasetVersion.publish('test', upserted=[kept.pk, removed.pk])
+
+        Location.objects.filter(pk=kept.pk).update(opening_hours='24/7')
+        Location.objects.filter(pk=removed.pk).delete()
+        added = Location.objects.create(location_type='SHOP', name='SF Store Wan Chai', address='2 Road',
+                                        district='Wan Chai')
+        second = DatasetVersion.publish('test', upserted=[kept.pk, added.pk], deleted=[removed.pk])
+        load_snapshot()
+
+        data = self.changes(first.id).json()
+        self.assertEqual((data['since'], data['version']), (first.id, second.id))
+        self.assertEqual(sorted(row['id'] for row in data['upserts']), [kept.pk, added.pk])
+        self.assertEqual(data['deleted'], [removed.pk])
+        self.assertEqual(data['credits_remaining'], 99)
+
+        # Up to date: nothing changed, still charged
+        data = self.changes(second.id).json()
+        self.assertEqual((data['upserts'], data['deleted']), ([], []))
+        self.assertEqual(CreditBalance.objects.get(user=self.user).credits, 98)
+
+    def test_version_without_change_log_requires_full_sync(self):
+        first = DatasetVersion.publish('test')
+        Location.objects.create(location_type='LOCKER', name='SF Locker Sha Tin', address='1 Road',
+                                district='Sha Tin')
+        DatasetVersion.bump('test')
+        load_snapshot()
+
+        response = self.changes(first.id)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()['since'], first.id)
+        # Unknown to the database, e.g. after it was recreated
+        self.assertEqual(self.changes(first.id + 100).status_code, 410)
+        self.assertEqual(self.changes('latest').status_code, 400)
+        self.assertEqual(CreditBalance.objects.get(user=self.user).credits, 100)
+
+
+class SQLiteProfileTests(TestCase):
+    def connect(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'db.sqlite3'
+        wrapper = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': str(path)}, alias='profile-test')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def pragmas(self, wrapper):
+        with wrapper.cursor() as cursor:
+            return {
+                pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout')
+            }
+
+    @override_settings(DATABASE_PROFILE='production')
+    def test_production_profile_applies_pragmas(self):
+        # synchronous=NORMAL is 1
+        self.assertEqual(
+            self.pragmas(self.connect()), {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000}
+        )
+
+    def test_default_profile_keeps_sqlite_defaults(self):
+        self.assertEqual(self.pragmas(self.connect())['journal_mode'], 'delete')
+
+
+class ServeCommandTests(TestCase):
+    def test_worker_slots_are_shared_with_forked_workers(self):
+        slots = WorkerSlots(2)
+        slots.write(1, pid=0, dataset_version=0, started=0, heartbeat=0, requests=0)
+
+        async def application(scope, receive, send):
+            pass
+
+        pid = os.fork()
+        if pid == 0:
+            # A worker: register itself and serve two requests and a lifespan event
+            slots.write(1, pid=os.getpid(), dataset_version=7, started=time.time(), heartbeat=time.time(),
+                        requests=0)
+            app = counting_application(application, slots, 1)
+            for scope_type in ('http', 'http', 'lifespan'):
+                asyncio.run(app({'type': scope_type}, None, None))
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        slot = slots.read(1)
+        self.assertEqual((slot['pid'], slot['dataset_version'], slot['requests']), (pid, 7, 2))
+        self.assertEqual(slots.read(0)['pid'], 0)
+
+
+class LocationExportTests(TestCase):
+    def setUp(self):
+        self.enterContext(self.settings(
+            EXPORT_DIR=Path(self.enterContext(tempfile.TemporaryDirectory())), EXPORT_ACCEL_REDIRECT=''
+        ))
+        self.user = create_user(credits=100)
+        key = APIKey.objects.create(user=self.user, name='test').key
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+        Location.objects.create(location_type='LOCKER', name='SF Locker Sha Tin', address='1 Road',
+                                district='Sha Tin')
+        self.version = DatasetVersion.bump('test').id
+        load_snapshot()
+
+    def export(self, **headers):
+        return self.client.get('/api/locations/export', {'format': 'csv'}, **self.headers, **headers)
+
+    def credits(self):
+        return CreditBalance.objects.get(user=self.user).credits
+
+    def test_serves_versioned_files(self):
+        response = self.export()
+        path = settings.EXPORT_DIR / f'locations-v{self.version}.csv'
+        self.assertEqual(b''.join(response.streaming_content), path.read_bytes())
+        self.assertEqual(response['ETag'], f'"{path.name}"')
+        self.assertEqual(response['X-Dataset-Version'], str(self.version))
+        self.assertTrue((settings.EXPORT_DIR / f'{path.name}.gz').exists())
+
+        response = self.export(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), path.read_bytes())
+        self.assertEqual(response['ETag'], f'"{path.name}.gz"')
+        self.assertEqual(self.credits(), 90)
+
+        # The client already has this version's file: free
+        response = self.export(HTTP_IF_NONE_MATCH=f'"{path.name}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.credits(), 90)
+
+    def test_byte_ranges(self):
+        etag = f'"locations-v{self.version}.csv"'
+        response = self.export(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        data = (settings.EXPORT_DIR / etag.strip('"')).read_bytes()
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), data[:10])
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{len(data)}')
+
+        response = self.export(HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), data[-5:])
+
+        # If-Range of an older version sends the whole file
+        response = self.export(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"locations-v0.csv"')
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, data))
+        self.assertEqual(self.credits(), 85)
+
+        response = self.export(HTTP_RANGE=f'bytes={len(data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(data)}')
+        self.assertEqual(self.credits(), 85)
+
+
+class LocationSummaryTests(TestCase):
+    def setUp(self):
+        self.user = create_user(credits=100)
+        key = APIKey.objects.create(user=self.user, name='test').key
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+
+    def test_counts_follow_each_publish(self):
+        lockers = [
+            Location.objects.create(location_type='LOCKER', name=f'SF Locker {n}', address='1 Road',
+                                    district='Sha Tin', latitude=latitude, longitude=114.18)
+            for n, latitude in enumerate((22.38, 22.40))
+        ]
+        Location.objects.create(location_type='SHOP', name='SF Store Wan Chai', address='2 Road',
+                                district='Wan Chai', latitude=22.27, longitude=114.17)
+        Location.objects.create(location_type='LOCKER', name='SF Locker Closed', address='3 Road',
+                                district='Sha Tin', is_active=False)
+        first = DatasetVersion.publish('test', upserted=[location.pk for location in lockers])
+        load_snapshot()
+
+        data = self.client.get('/api/locations/summary', **self.headers).json()
+        self.assertEqual((data['version'], data['total']), (first.id, 3))
+        self.assertEqual(data['types'], {'LOCKER': 2, 'SHOP': 1})
+        self.assertEqual(data['bounds']['max_latitude'], 22.40)
+        self.assertEqual(data['regions']['New Territories']['total'], 2)
+        self.assertEqual(data['districts']['Wan Chai'], {
+            'region': 'Hong Kong Island', 'total': 1, 'types': {'SHOP': 1},
+            'bounds': {'min_latitude': 22.27, 'max_latitude': 22.27, 'min_longitude': 114.17,
+                       'max_longitude': 114.17},
+        })
+        self.assertEqual(data['credits_remaining'], 99)
+
+        Location.objects.filter(pk=lockers[1].pk).update(is_active=False)
+        second = DatasetVersion.publish('test', deleted=[lockers[1].pk])
+        load_snapshot()
+
+        data = self.client.get('/api/locations/summary', **self.headers).json()
+        self.assertEqual((data['version'], data['total']), (second.id, 2))
+        self.assertEqual(data['districts']['Sha Tin']['types'], {'LOCKER': 1})
+        data = self.client.get('/api/locations', {'count_only': 1, 'district': 'Sha Tin'}, **self.headers).json()
+        self.assertEqual((data['count'], data['credits_used']), (1, 1))
+        self.assertNotIn('locations', data)
+
+
+class LocationDatabaseTests(TransactionTestCase):
+    """
+    The location database copies committed rows, so this runs outside a test
+    transaction, with the alias settings.py adds when LOCATION_DB_ENABLED is on
+    """
+
+    def setUp(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'locations.sqlite3'
+        self.enterContext(self.settings(
+            LOCATION_DB_ENABLED=True, LOCATION_DB_PATH=path, DATABASE_ROUTERS=['api.routers.LocationRouter']
+        ))
+        connections.settings[LOCATION_DB_ALIAS] = {**connections.settings['default'], 'NAME': location_db_uri(path)}
+        self.addCleanup(connections.settings.pop, LOCATION_DB_ALIAS)
+        self.addCleanup(connections[LOCATION_DB_ALIAS].close)
+
+    def publish(self, name):
+        location = Location.objects.create(location_type='LOCKER', name=name, address='1 Road',
+                                           district='Sha Tin')
+        version = DatasetVersion.publish('test', upserted=[location.pk])
+        build_location_db(version.id)
+        return version
+
+    def test_reads_follow_each_swap(self):
+        first = self.publish('SF Locker 1')
+        self.assertEqual(file_version(settings.LOCATION_DB_PATH), first.id)
+        self.assertEqual(Location.objects.all().db, LOCATION_DB_ALIAS)
+        self.assertEqual(Location.objects.count(), 1)
+        self.assertEqual(LocationSummary.objects.get().count, 1)
+        # Account tables and every write stay on the default database
+        self.assertEqual(User.objects.all().db, 'default')
+        self.assertEqual(LocationRouter().db_for_write(Location), 'default')
+        with transaction.atomic():
+            self.assertEqual(Location.objects.all().db, 'default')
+        self.assertEqual(read_alias(version=first.id + 1), 'default')
+
+        # The connection opened on the first file is replaced after the swap
+        second = self.publish('SF Locker 2')
+        self.assertEqual(file_version(settings.LOCATION_DB_PATH), second.id)
+        self.assertEqual(read_alias(version=second.id), LOCATION_DB_ALIAS)
+        self.assertEqual(Location.objects.count(), 2)
+        with self.assertRaises(DatabaseError):
+            Location.objects.using(LOCATION_DB_ALIAS).update(name='x')
+
+
+class BootstrapCommandTests(TestCase):
+    def setUp(self):
+        data_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(DATA_DIR=data_dir, EXPORT_DIR=data_dir / 'exports'))
+
+    def bootstrap(self, *args):
+        out = io.StringIO()
+        call_command('bootstrap', *args, stdout=out)
+        return out.getvalue()
+
+    def test_auto_load_runs_once(self):
+        output = self.bootstrap()
+        self.assertIn('load:', output)
+        self.assertTrue((settings.DATA_DIR / '.initialized').exists())
+        version, count = DatasetVersion.current(), Location.objects.count()
+        self.assertGreater(count, 0)
+        self.assertTrue((settings.EXPORT_DIR / f'locations-v{version}.json').exists())
+
+        output = self.bootstrap('--load', 'auto')
+        self.assertIn('Location data already loaded, skipping', output)
+        self.assertNotIn('load:', output)
+        self.assertEqual((DatasetVersion.current(), Location.objects.count()), (version, count))
+
+        # Reloading unchanged files publishes no new version either
+        self.bootstrap('--load', 'always', '--no-warm')
+        self.assertEqual((DatasetVersion.current(), Location.objects.count()), (version, count))
+
+
+@override_settings(LEDGER_EXPORT_BATCH_SIZE=2)
+class LedgerExportTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        key = APIKey.objects.create(user=self.user, name='test').key
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+
+    def add(self, user, count, created_at):
+        rows = CreditTransaction.objects.bulk_create([
+            CreditTransaction(user=user, transaction_type='API_CALL', amount=-1, balance_after=0)
+            for _ in range(count)
+        ])
+        CreditTransaction.objects.filter(pk__in=[row.pk for row in rows]).update(created_at=created_at)
+        return [row.pk for row in rows]
+
+    def test_stream_crosses_batches_in_key_order(self):
+        start = timezone.now() - timedelta(days=1)
+        # Three rows sharing one timestamp straddle the first batch boundary
+        expected = self.add(self.user, 3, start) + self.add(self.user, 2, start + timedelta(hours=1))
+        self.add(create_user('bob'), 2, start)
+        self.add(self.user, 1, timezone.now() + timedelta(hours=1))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/credits/ledger', {'format': 'ndjson'}, **self.headers)
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], expected)
+        # Three full or partial batches and the empty one that ends the stream
+        ledger_queries = [query for query in queries if 'api_credittransaction' in query['sql']]
+        self.assertEqual(len(ledger_queries), 4)
+
+        since = (start + timedelta(minutes=1)).isoformat()
+        response = self.client.get('/api/credits/ledger', {'since': since}, **self.headers)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0].split(','), ['id', 'created_at', 'transaction_type', 'amount', 'balance_after',
+                                              'description'])
+        self.assertEqual([int(row.split(',')[0]) for row in rows[1:]], expected[3:])
+
+
+class SlowRequestLogTests(TestCase):
+    def setUp(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'slow-requests.jsonl'
+        middleware = list(settings.MIDDLEWARE)
+        middleware.insert(middleware.index('api.metrics.MetricsMiddleware') + 1, 'api.slowlog.SlowRequestMiddleware')
+        self.enterContext(self.settings(
+            MIDDLEWARE=middleware, SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_LOG_PATH=path
+        ))
+        # A writer and file handler of their own, opened on first use
+        self.enterContext(mock.patch.object(slowlog, '_writer', None))
+        handlers = list(slowlog.record_logger.handlers)
+        self.addCleanup(self.restore_handlers, handlers)
+        self.user = create_user()
+        self.key = APIKey.objects.create(user=self.user, name='test').key
+
+    @staticmethod
+    def restore_handlers(handlers):
+        slowlog._writer.shutdown()
+        for handler in slowlog.record_logger.handlers:
+            if handler not in handlers:
+                slowlog.record_logger.removeHandler(handler)
+                handler.close()
+
+    def test_record_has_statements_without_parameters(self):
+        Location.objects.create(location_type='LOCKER', name='SF Locker Sha Tin', address='1 Road',
+                                district='Sha Tin')
+        DatasetVersion.bump('test')
+        load_snapshot()
+        response = self.client.get('/api/locations', {'district': 'Sha Tin'}, HTTP_AUTHORIZATION=f'Bearer {self.key}')
+        self.assertEqual(response.status_code, 200)
+        # The writer thread runs one task at a time, so the record is written by now
+        slowlog.get_writer().submit(lambda: None).result()
+
+        text = settings.SLOW_REQUEST_LOG_PATH.read_text()
+        record = json.loads(text)
+        self.assertEqual((record['reason'], record['endpoint'], record['status']), ('slow', 'locations', 200))
+        self.assertEqual(record['params'], {'district': 'Sha Tin'})
+        statements = [query['sql'] for query in record['queries']]
+        self.assertTrue(any('api_apikey' in sql and '%s' in sql for sql in statements))
+        self.assertNotIn(self.key, text)
+
+
+class ClientTests(LiveServerTestCase):
+    """sfexpress_client against a running server"""
+
+    def setUp(self):
+        self.user = create_user(credits=100)
+        self.api_key = APIKey.objects.create(user=self.user, name='test').key
+        self.lockers = [
+            Location.objects.create(location_type='LOCKER', name=f'SF Locker {district}', address='1 Road',
+                                    district=district, latitude=latitude, longitude=longitude)
+            for district, latitude, longitude in [
+                ('Sha Tin', 22.3817, 114.1877), ('Tai Po', 22.4501, 114.1688), ('Wan Chai', 22.2776, 114.1731),
+            ]
+        ]
+        DatasetVersion.publish('test', upserted=[location.pk for location in self.lockers])
+        load_snapshot()
+        self.api = Client(self.api_key, self.live_server_url, backoff=0)
+        self.addCleanup(self.api.close)
+
+    def credits(self):
+        return CreditBalance.objects.get(user=self.user).credits
+
+    def test_revalidated_response_is_not_charged(self):
+        cache_dir = self.enterContext(tempfile.TemporaryDirectory())
+        with Client(self.api_key, self.live_server_url, cache_dir=cache_dir) as client:
+            first = client.locations(type='LOCKER')
+            request = client.pool.request
+            statuses = []
+
+            def record_status(*args):
+                response = request(*args)
+                statuses.append(response.status)
+                return response
+
+            with mock.patch.object(client.pool, 'request', record_status):
+                second = client.locations(type='LOCKER')
+        self.assertEqual(statuses, [304])
+        self.assertEqual(second, first)
+        self.assertEqual(self.credits(), 95)
+
+    def test_retries_reuse_idempotency_key(self):
+        request = self.api.pool.request
+        sent = []
+
+        def lose_first_response(method, url, headers, body=None):
+            sent.append(headers['Idempotency-Key'])
+            response = request(method, url, headers, body)
+            if len(sent) == 1:
+                # Processed and charged by the server, but the answer never arrives
+                raise ConnectionResetError
+            return response
+
+        with mock.patch.object(self.api.pool, 'request', lose_first_response):
+            data = self.api.locations()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(sent[0], sent[1])
+        self.assertEqual(self.credits(), 95)
+
+    def test_error_responses(self):
+        with self.assertRaises(AuthenticationError) as raised, Client('wrong', self.live_server_url) as client:
+            client.locations()
+        self.assertEqual(raised.exception.status, 401)
+
+        with self.assertRaises(FullSyncRequired):
+            self.api.changes(DatasetVersion.current() + 100)
+
+        CreditBalance.objects.filter(user=self.user).update(credits=2)
+        with self.assertRaises(InsufficientCredits) as raised:
+            self.api.locations()
+        self.assertEqual(raised.exception.data['available'], 2)
+
+        with mock.patch.object(self.api.pool, 'request', return_value=Response(429, {}, b'{"error": "Slow down"}')):
+            with self.assertRaises(RateLimited):
+                self.api.summary()
+        with mock.patch.object(self.api.pool, 'request', return_value=Response(500, {}, b'<html>')):
+            with self.assertRaises(APIError) as raised:
+                self.api.summary()
+        self.assertEqual((raised.exception.status, raised.exception.data), (500, {}))
+
+    def test_index_follows_changes(self):
+        index = self.api.index()
+        self.assertEqual(index.count(), 3)
+
+        sha_tin, _, wan_chai = self.lockers
+        Location.objects.filter(pk=sha_tin.pk).update(name='SF Locker Sha Tin Plaza')
+        Location.objects.filter(pk=wan_chai.pk).delete()
+        added = Location.objects.create(location_type='SHOP', name='SF Store Fo Tan', address='2 Road',
+                                        district='Fo Tan')
+        version = DatasetVersion.publish('test', upserted=[sha_tin.pk, added.pk], deleted=[wan_chai.pk])
+        load_snapshot()
+
+        with mock.patch.object(self.api, 'locations', side_effect=AssertionError('full download')):
+            self.api.refresh_index(index)
+        self.assertEqual(index.version, version.id)
+        self.assertEqual(index.get(sha_tin.pk)['name'], 'SF Locker Sha Tin Plaza')
+        self.assertIsNone(index.get(wan_chai.pk))
+        self.assertEqual([row['id'] for row in index], [row['id'] for row in self.api.locations()['locations']])
+
+    def test_async_client(self):
+        async def run():
+            async with AsyncClient(self.api_key, self.live_server_url) as client:
+                return await client.tile(0, 0, 0)
+
+        tile = async_to_sync(run)()
+        self.assertEqual(sum(cluster['count'] for cluster in tile['clusters']), 3)
+
+    @skipUnless(numpy_available(), 'bulk nearest matching needs numpy')
+    def test_async_client_nearest_bulk(self):
+        async def run():
+            async with AsyncClient(self.api_key, self.live_server_url) as client:
+                return (
+                    await client.nearest_bulk([(22.45, 114.17), (22.28, 114.17)]),
+                    await client.request(
+                        'POST', '/api/locations/nearest-bulk', headers={'Content-Type': 'application/json'},
+                        body=b'{"origins": [[22.38, 114.19]]}',
+                    ),
+                )
+
+        results, response = async_to_sync(run)()
+        self.assertEqual([result['ids'] for result in results], [[self.lockers[1].pk], [self.lockers[2].pk]])
+        self.assertEqual(response.json()['results'][0]['ids'], [self.lockers[0].pk])
@@ -0,0 +1,256 @@
+"""
+Two-tier cache with request coalescing.
+
+Tier 1 is a small LRU dict in each process. Tier 2 is Django's default
+cache, which every worker shares when CACHE_BACKEND=file (no cache server
+needed). On top of the two tiers:
+
+* single-flight: when several threads, or several processes, miss the same
+  key at once, one of them computes the value and the others wait for it
+  instead of all doing the work;
+* TTL jitter: lifetimes are spread by +/- CACHE_TTL_JITTER so entries
+  written together do not all expire together;
+* stale-while-revalidate: an entry past its TTL but inside its stale
+  window is returned at once while one background thread recomputes it.
+
+Processes coordinate through a lock on one byte of CACHE_LOCK_PATH when
+tier 2 is the file cache (fcntl record locks, which the kernel drops when
+the holder exits), and through cache.add() of a lock entry otherwise. That
+is atomic with locmem, which only one process can see anyway, and with
+cache servers; on platforms without fcntl the file cache falls back to it,
+which is best effort only, as the file backend's add() is not atomic.
+
+Values must be picklable. Tier 1 is never invalidated across processes, so
+keys should include whatever the value depends on (such as the dataset
+version) rather than relying on delete(). With alias=None there is no
+tier 2: values that are cheap to compute but costly to (un)pickle get
+thread coalescing and stale-while-revalidate without the disk round trip.
+
+get_or_set() blocks: coalesced callers wait up to CACHE_LOCK_TIMEOUT and the
+file cache reads and writes the disk. Async views must call it on the
+database thread pool (api.async_db.run_in_db_pool), never on the event loop.
+"""
+import os
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connections
+
+from .metrics import CACHE_REQUESTS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bytes of the lock file that keys are hashed onto
+LOCK_SLOTS = 1 << 20
+
+# CACHE_LOCK_PATH -> descriptor
+_lock_fds = {}
+_lock_fds_guard = threading.Lock()
+
+
+def jittered(seconds):
+    """Spread a lifetime by +/- CACHE_TTL_JITTER"""
+    jitter = settings.CACHE_TTL_JITTER
+    return seconds * random.uniform(1 - jitter, 1 + jitter)
+
+
+def lock_file():
+    """
+    This process's descriptor of CACHE_LOCK_PATH. It is never closed:
+    closing any descriptor of a file drops all of the process's record locks
+    on it.
+    """
+    path = settings.CACHE_LOCK_PATH
+    with _lock_fds_guard:
+        if path not in _lock_fds:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _lock_fds[path] = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        return _lock_fds[path]
+
+
+class TieredCache:
+    """
+    get_or_set() through a per-process LRU and the shared Django cache
+    (none when alias is None). Entries are (value, fresh_until, stale_until)
+    in wall-clock seconds.
+    """
+
+    def __init__(self, prefix, max_entries, alias='default'):
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.alias = alias
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        # key -> Event set when the thread computing it is done
+        self.inflight = {}
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def shared_key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get_or_set(self, key, compute, ttl, stale_ttl=0):
+        """
+        Return the cached value for key, calling compute() at most once
+        across threads and processes when it is missing or expired
+        """
+        entry = self._get_local(key)
+        tier = 'local'
+        if entry is None and self.alias is not None:
+            entry = self.shared.get(self.shared_key(key))
+            tier = 'shared'
+            if entry is not None:
+                self._set_local(key, entry)
+
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            now = time.time()
+            if now < fresh_until:
+                CACHE_REQUESTS.inc(cache=self.prefix, result=f'{tier}_hit')
+                return value
+            if now < stale_until:
+                CACHE_REQUESTS.inc(cache=self.prefix, result='stale')
+                self._revalidate(key, compute, ttl, stale_ttl)
+                return value
+
+        return self._compute(key, compute, ttl, stale_ttl)
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        lifetime = jittered(ttl)
+        now = time.time()
+        entry = (value, now + lifetime, now + lifetime + stale_ttl)
+        if self.alias is not None:
+            self.shared.set(self.shared_key(key), entry, lifetime + stale_ttl)
+        self._set_local(key, entry)
+        return entry
+
+    def delete(self, key):
+        with self.lock:
+            self.local.pop(key, None)
+        if self.alias is not None:
+            self.shared.delete(self.shared_key(key))
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+
+    def _get_local(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                self.local.move_to_end(key)
+            return entry
+
+    def _set_local(self, key, entry):
+        with self.lock:
+            self.local[key] = entry
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_entries:
+                self.local.popitem(last=False)
+
+    def _claim(self, key):
+        """Return (event, True) for the thread that should compute key, (event, False) for waiters"""
+        with self.lock:
+            event = self.inflight.get(key)
+            if event is not None:
+                return event, False
+            event = self.inflight[key] = threading.Event()
+            return event, True
+
+    def _release(self, key, event):
+        with self.lock:
+            self.inflight.pop(key, None)
+        event.set()
+
+    def _compute(self, key, compute, ttl, stale_ttl):
+        event, leader = self._claim(key)
+        if not leader:
+            CACHE_REQUESTS.inc(cache=self.prefix, result='coalesced')
+            event.wait(settings.CACHE_LOCK_TIMEOUT)
+            entry = self._get_local(key)
+            if entry is not None and time.time() < entry[2]:
+                return entry[0]
+            # The computing thread failed or timed out; do the work here
+            return compute()
+
+        try:
+            return self._compute_shared(key, compute, ttl, stale_ttl)
+        finally:
+            self._release(key, event)
+
+    def _lock(self, lock_key):
+        """Try to take the cross-process lock for lock_key without waiting"""
+        if fcntl is not None and isinstance(self.shared, FileBasedCache):
+            # Record locks belong to the process, so threads computing
+            # different keys on the same slot do not block each other
+            slot = zlib.crc32(lock_key.encode()) % LOCK_SLOTS
+            try:
+                fcntl.lockf(lock_file(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+            except OSError:
+                return False
+            return True
+        return self.shared.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT)
+
+    def _unlock(self, lock_key):
+        if fcntl is not None and isinstance(self.shared, FileBasedCache):
+            fcntl.lockf(lock_file(), fcntl.LOCK_UN, 1, zlib.crc32(lock_key.encode()) % LOCK_SLOTS)
+        else:
+            self.shared.delete(lock_key)
+
+    def _compute_shared(self, key, compute, ttl, stale_ttl):
+        """Compute under the cross-process lock, or wait for the process holding it"""
+        if self.alias is None:
+            CACHE_REQUESTS.inc(cache=self.prefix, result='miss')
+            return self.set(key, compute(), ttl, stale_ttl)[0]
+
+        lock_key = self.shared_key(key) + ':lock'
+        deadline = time.monotonic() + settings.CACHE_LOCK_TIMEOUT
+        while not self._lock(lock_key):
+            entry = self.shared.get(self.shared_key(key))
+            if entry is not None and time.time() < entry[1]:
+                CACHE_REQUESTS.inc(cache=self.prefix, result='coalesced')
+                self._set_local(key, entry)
+                return entry[0]
+            if time.monotonic() >= deadline:
+                # The lock holder died or is stuck; compute without the lock
+                CACHE_REQUESTS.inc(cache=self.prefix, result='miss')
+                return self.set(key, compute(), ttl, stale_ttl)[0]
+            time.sleep(settings.CACHE_LOCK_POLL_INTERVAL)
+
+        try:
+            # Another process may have finished between our miss and the lock
+            entry = self.shared.get(self.shared_key(key))
+            if entry is not None and time.time() < entry[1]:
+                self._set_local(key, entry)
+                return entry[0]
+            CACHE_REQUESTS.inc(cache=self.prefix, result='miss')
+            return self.set(key, compute(), ttl, stale_ttl)[0]
+        finally:
+            self._unlock(lock_key)
+
+    def _revalidate(self, key, compute, ttl, stale_ttl):
+        """Recompute a stale entry in a background thread, unless one is already doing it"""
+        event, leader = self._claim(key)
+        if not leader:
+            return
+
+        def refresh():
+            try:
+                self._compute_shared(key, compute, ttl, stale_ttl)
+            finally:
+                self._release(key, event)
+                # Database connections are per thread; do not leak this one
+                connections.close_all()
+
+        threading.Thread(target=refresh, name=f'cache-refresh-{self.prefix}', daemon=True).start()
@@ -0,0 +1,135 @@
+"""
+Clustered map tiles for /api/locations/tiles/{z}/{x}/{y}.
+
+Tiles use the Web Mercator scheme of common web maps (z/x/y, y growing
+southwards). Each tile is divided into a grid of 8x8 cells and the
+locations in a cell form one cluster: count, centroid and a few
+representative ids. The cell grid is computed once from the coordinates at
+LOCATION_TILE_MAX_ZOOM; every lower zoom merges four cells into one, so the
+whole pyramid is built in a single pass over the rows plus one pass per zoom
+over the (fewer and fewer) occupied cells.
+
+A TilePyramid is built once per location snapshot, i.e. per dataset
+version, and keeps every occupied tile as encoded JSON bytes under an
+integer key; serving a tile is one dictionary lookup.
+"""
+import math
+
+from .serializers import dumps
+
+# log2 of the cells per tile side: 8x8 cells of 32 pixels on a 256 pixel tile
+CELL_BITS = 3
+# Ids listed per cluster; the largest sub-clusters contribute first
+REPRESENTATIVE_IDS = 5
+# Latitude limit of Web Mercator
+MAX_LATITUDE = 85.05112878
+EMPTY_TILE = b'[]'
+
+
+def world_position(latitude, longitude):
+    """Web Mercator position of a coordinate as fractions of the world, both in [0, 1]"""
+    latitude = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude)))
+    x = (longitude + 180.0) / 360.0
+    y = (1.0 - math.asinh(math.tan(latitude)) / math.pi) / 2.0
+    return x, y
+
+
+def tile_key(z, x, y):
+    return (z << 48) | (x << 24) | y
+
+
+def valid_tile(z, x, y, max_zoom):
+    return 0 <= z <= max_zoom and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+def _merge(cells):
+    """Cells of the next lower zoom: every 2x2 block of cells becomes one"""
+    children = {}
+    for (cx, cy), cell in cells.items():
+        children.setdefault((cx >> 1, cy >> 1), []).append(cell)
+
+    merged = {}
+    for key, group in children.items():
+        if len(group) == 1:
+            merged[key] = group[0]
+            continue
+        group.sort(key=lambda cell: -cell[0])
+        ids = []
+        for cell in group:
+            ids.extend(cell[3][:REPRESENTATIVE_IDS - len(ids)])
+        merged[key] = [
+            sum(cell[0] for cell in group),
+            sum(cell[1] for cell in group),
+            sum(cell[2] for cell in group),
+            ids,
+        ]
+    return merged
+
+
+def _encode(cells):
+    """JSON array of the clusters of one tile, largest first"""
+    cells.sort(key=lambda cell: -cell[0])
+    return dumps([
+        {
+            'count': count,
+            'latitude': round(latitude_sum / count, 6),
+            'longitude': round(longitude_sum / count, 6),
+            'ids': ids,
+        }
+        for count, latitude_sum, longitude_sum, ids in cells
+    ])
+
+
+class TilePyramid:
+    """
+    Encoded clusters of every occupied tile from zoom 0 to max_zoom
+    """
+
+    def __init__(self, max_zoom, tiles, located):
+        self.max_zoom = max_zoom
+        # tile_key(z, x, y) -> JSON array of clusters
+        self.tiles = tiles
+        # Locations with coordinates (the others appear in no tile)
+        self.located = located
+
+    @classmethod
+    def build(cls, rows, max_zoom):
+        level = max_zoom + CELL_BITS
+        scale = 1 << level
+        # (cell x, cell y) -> [count, latitude sum, longitude sum, representative ids]
+        cells = {}
+        located = 0
+        for row in rows:
+            latitude, longitude = row['latitude'], row['longitude']
+            if latitude is None or longitude is None:
+                continue
+            located += 1
+            x, y = world_position(latitude, longitude)
+            key = (min(int(x * scale), scale - 1), min(int(y * scale), scale - 1))
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [1, latitude, longitude, [row['id']]]
+            else:
+                cell[0] += 1
+                cell[1] += latitude
+                cell[2] += longitude
+                if len(cell[3]) < REPRESENTATIVE_IDS:
+                    cell[3].append(row['id'])
+
+        tiles = {}
+        for zoom in range(max_zoom, -1, -1):
+            by_tile = {}
+            for (cx, cy), cell in cells.items():
+                by_tile.setdefault((cx >> CELL_BITS, cy >> CELL_BITS), []).append(cell)
+            for (x, y), tile_cells in by_tile.items():
+                tiles[tile_key(zoom, x, y)] = _encode(tile_cells)
+            if zoom:
+                cells = _merge(cells)
+        return cls(max_zoom, tiles, located)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def get(self, z, x, y):
+        """Encoded clusters of a tile; empty tiles have none"""
+        return self.tiles.get(tile_key(z, x, y), EMPTY_TILE)
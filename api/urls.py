@@ -1,7 +1,38 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     # API endpoints (JSON - require API key authentication)
-    path('locations', views.locations, name='locations'),
+    path('locations', views.alocations if settings.API_ASYNC_VIEWS else views.locations, name='locations'),
+    path(
+        'locations/changes',
+        views.alocation_changes if settings.API_ASYNC_VIEWS else views.location_changes,
+        name='location_changes'
+    ),
+    path(
+        'locations/export',
+        views.alocation_export if settings.API_ASYNC_VIEWS else views.location_export,
+        name='location_export'
+    ),
+    path(
+        'locations/summary',
+        views.alocation_summary if settings.API_ASYNC_VIEWS else views.location_summary,
+        name='location_summary'
+    ),
+    path(
+        'locations/tiles/<int:z>/<int:x>/<int:y>',
+        views.alocation_tiles if settings.API_ASYNC_VIEWS else views.location_tiles,
+        name='location_tiles'
+    ),
+    path(
+        'locations/nearest-bulk',
+        views.alocation_nearest_bulk if settings.API_ASYNC_VIEWS else views.location_nearest_bulk,
+        name='location_nearest_bulk'
+    ),
+    path(
+        'credits/ledger',
+        views.acredit_ledger if settings.API_ASYNC_VIEWS else views.credit_ledger,
+        name='credit_ledger'
+    ),
 ]
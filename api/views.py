@@ -1,11 +1,44 @@
-from django.http import JsonResponse
+import hashlib
+import inspect
+import json
+import math
+
+from asgiref.sync import markcoroutinefunction
+
+from django.conf import settings
+from django.http import (
+    FileResponse, Http404, HttpResponse, JsonResponse, HttpResponseForbidden, HttpResponseNotAllowed,
+    HttpResponseNotModified, StreamingHttpResponse
+)
+from django.http.response import HttpResponseBase
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
-from .models import User, APIKey, CreditBalance, CreditTransaction, Location
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from .async_db import run_in_db_pool
+from .compression import get_payload, payload_key
+from .credits import can_afford, charge_credits
+from .dashboard import get_dashboard_summary
+from .exports import (
+    FORMATS as EXPORT_FORMATS, UnsatisfiableRange, export_name, get_export, read_range, requested_range,
+)
+from .idempotency import idempotent
+from .ledger import FORMATS as LEDGER_FORMATS, InvalidLedgerRange, ledger_stream, parse_ledger_range
+from .metrics import CREDIT_DEDUCTIONS, render_metrics, scrape_allowed, timed
+from .models import (
+    User, APIKey, CreditBalance, CreditTransaction, DatasetVersion, LocationChange,
+    LocationSummary
+)
+from .nearest import InvalidOrigins, numpy_available, parse_csv_origins, parse_json_origins
+from .serializers import dumps
+from .snapshot import current_location_snapshot, get_location_snapshot
+from .tiered_cache import TieredCache
+from .tiles import valid_tile
 
 
 # HTML Views for Dashboard
@@ -56,12 +89,9 @@ def register_view(request):
                     password=password
                 )
 
-                # Create initial credit balance (100 credits for new users)
-                credit_balance = CreditBalance.objects.create(
-                    user=user,
-                    credits=100,
-                    total_earned=100
-                )
+                # Credit the welcome bonus to the balance created with the user
+                credit_balance = user.credit_balance
+                credit_balance.add_credits(100)
 
                 # Create transaction record
                 CreditTransaction.objects.create(
@@ -114,28 +144,55 @@ def dashboard(request):
     """
     User dashboard - shows credits, API keys, and transactions
     """
-    # Get or create credit balance
-    credit_balance, _ = CreditBalance.objects.get_or_create(user=request.user)
+    # Balance and recent transactions, cached until the user's credits change
+    summary = get_dashboard_summary(request.user)
 
     # Get API keys
-    api_keys = request.user.api_keys.filter(is_active=True).order_by('-created_at')
-
-    # Get recent transactions
-    transactions = request.user.credit_transactions.all()[:20]
+    api_keys = list(request.user.api_keys.filter(is_active=True).order_by('-created_at'))
 
     # Get site URL from request
     site_url = f"{request.scheme}://{request.get_host()}"
 
     context = {
-        'credit_balance': credit_balance,
+        'credit_balance': summary['credit_balance'],
         'api_keys': api_keys,
-        'transactions': transactions,
+        'transactions': summary['transactions'],
         'site_url': site_url,
     }
 
     return render(request, 'api/dashboard.html', context)
 
 
+def ledger_response(request, user):
+    """
+    Stream the user's credit ledger as CSV (default) or NDJSON, limited to
+    the `since` (inclusive) / `until` (exclusive) query parameters
+    """
+    fmt = request.GET.get('format', 'csv').lower()
+    if fmt not in LEDGER_FORMATS:
+        return JsonResponse({'error': f'format must be one of: {", ".join(LEDGER_FORMATS)}'}, status=400)
+    try:
+        since, until = parse_ledger_range(request.GET)
+    except InvalidLedgerRange as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = StreamingHttpResponse(
+        ledger_stream(user.pk, fmt, since, until), content_type=LEDGER_FORMATS[fmt][0]
+    )
+    response['Content-Disposition'] = f'attachment; filename="sfexpress-ledger-{user.username}.{fmt}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+@login_required(login_url='login')
+@require_http_methods(["GET"])
+def dashboard_ledger(request):
+    """
+    Download the full credit ledger from the dashboard
+    """
+    return ledger_response(request, request.user)
+
+
 @login_required(login_url='login')
 @require_http_methods(["POST"])
 def create_api_key_dashboard(request):
@@ -186,61 +243,800 @@ def logout_view(request):
 
 # JSON API Endpoints (for API key authentication)
 
+LOCATIONS_COST = 5
+CHANGES_COST = 1
+EXPORT_COST = 5
+COUNT_COST = 1
+SUMMARY_COST = 1
+TILE_COST = 1
+# Bulk nearest matching costs NEAREST_BATCH_COST per started batch of origins
+NEAREST_BATCH_SIZE = 1000
+NEAREST_BATCH_COST = 1
+NEAREST_MAX_K = 10
+
+
+def insufficient_credits(credit_balance, cost):
+    """402 response; credit_balance.credits must be the available credits (see can_afford)"""
+    return JsonResponse({
+        'error': 'Insufficient credits',
+        'required': cost,
+        'available': credit_balance.credits
+    }, status=402)
+
+
+# Row positions of district/search results per dataset version, kept in each
+# process only: filtering the in-memory snapshot is cheaper than a file cache
+# round trip
+filter_cache = TieredCache('location-filters', max_entries=settings.LOCATION_CACHE_LRU_SIZE, alias=None)
+
+
+def filter_cache_key(version, location_type, district, search):
+    # Same normalization as the snapshot filters; hashed to keep keys short and space-free
+    params = '\x00'.join(((location_type or '').upper(), (district or '').lower(), (search or '').lower()))
+    return f'{version}:{hashlib.sha1(params.encode()).hexdigest()}'
+
+
+def filter_locations(snapshot, params):
+    """
+    Return active locations matching the request's query parameters
+    """
+    location_type = params.get('type')  # 'LOCKER' or 'SHOP'
+    district = params.get('district')
+    search = params.get('search')
+    if not (district or search):
+        # Index lookups only; nothing worth caching
+        return snapshot.filter(location_type=location_type)
+
+    positions = filter_cache.get_or_set(
+        filter_cache_key(snapshot.version, location_type, district, search),
+        lambda: snapshot.filter_positions(location_type, district, search),
+        settings.LOCATION_CACHE_TTL,
+        settings.LOCATION_CACHE_STALE_TTL,
+    )
+    return snapshot.rows_at(positions)
+
+
+def locations_prefix(snapshot, locations_list):
+    """The caller-independent start of a locations response, without the closing brace"""
+    return dumps({
+        'count': len(locations_list),
+        'version': snapshot.version,
+        'locations': locations_list
+    })[:-1]
+
+
+def precompress_payloads(snapshot):
+    """Compress the most requested payloads (the full dataset and each type) of a new snapshot"""
+    for params in ({}, {'type': 'LOCKER'}, {'type': 'SHOP'}):
+        locations_list = snapshot.filter(location_type=params.get('type'))
+        get_payload(snapshot, payload_key(snapshot, params), lambda: locations_prefix(snapshot, locations_list))
+
+
+def locations_response(request, snapshot, locations_list, cost, credits_remaining):
+    """
+    Serialize a locations response. The full dataset and filters without a
+    search term are served from payloads compressed once per snapshot.
+    """
+    key = payload_key(snapshot, request.GET)
+    payload = None
+    if key is not None:
+        payload = get_payload(snapshot, key, lambda: locations_prefix(snapshot, locations_list))
+
+    if payload is None:
+        return HttpResponse(dumps({
+            'count': len(locations_list),
+            'version': snapshot.version,
+            'locations': locations_list,
+            'credits_used': cost,
+            'credits_remaining': credits_remaining
+        }), content_type='application/json')
+
+    encoding = payload.negotiate(request)
+    suffix = f', "credits_used": {cost}, "credits_remaining": {credits_remaining}}}'.encode()
+    response = HttpResponse(payload.render(suffix, encoding), content_type='application/json')
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def count_only(params):
+    """Whether a locations request asked for the match count without the rows"""
+    return params.get('count_only', '').lower() in ('1', 'true')
+
+
+def query_description(counting, locations_list):
+    return f'Location {"count" if counting else "query"}: {len(locations_list)} results'
+
+
+def count_response(snapshot, locations_list, cost, credits_remaining):
+    return HttpResponse(dumps({
+        'count': len(locations_list),
+        'version': snapshot.version,
+        'credits_used': cost,
+        'credits_remaining': credits_remaining
+    }), content_type='application/json')
+
+
+def locations_etag(snapshot, request):
+    """
+    Weak ETag of a response built from the location snapshot: the dataset
+    version and the path with its query. The body also carries the caller's
+    credit balance, so it is not byte-for-byte stable, but the locations in
+    it are.
+    """
+    query = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:16]
+    return f'W/"v{snapshot.version}-{query}"'
+
+
+def not_modified(request, etag):
+    """Whether the request's If-None-Match already names this ETag (weak comparison)"""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    tags = parse_etags(if_none_match)
+    return '*' in tags or etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in tags}
+
+
+def not_modified_response(etag):
+    CREDIT_DEDUCTIONS.inc(outcome='not_modified')
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
+def stripe_key(request):
+    """Stripe selection for striped credit mode (None picks one at random)"""
+    if settings.CREDIT_STRIPE_SELECTION == 'api_key':
+        return request.api_key.pk
+    return None
+
+
+def charged(request, cost, compute, description, respond, etag=None):
+    """
+    The credit flow of a charged endpoint: check that the caller can afford
+    `cost`, run compute(), charge for its result and build the response with
+    respond(result, credits_remaining). A compute() that returns a response
+    instead (such as an error) is not charged. `description` is the ledger
+    text, or a function of the result returning it.
+    """
+    credit_balance, _ = CreditBalance.objects.get_or_create(user=request.user)
+    if not can_afford(credit_balance, cost):
+        CREDIT_DEDUCTIONS.inc(outcome='insufficient')
+        return insufficient_credits(credit_balance, cost)
+
+    result = compute()
+    if isinstance(result, HttpResponseBase):
+        return result
+
+    if callable(description):
+        description = description(result)
+    if not charge_credits(credit_balance, cost, description, stripe_key(request)):
+        CREDIT_DEDUCTIONS.inc(outcome='declined')
+        return insufficient_credits(credit_balance, cost)
+    CREDIT_DEDUCTIONS.inc(outcome='charged')
+
+    with timed('serialize'):
+        response = respond(result, credit_balance.credits)
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+async def acharged(request, cost, compute, description, respond, etag=None):
+    """
+    Async variant of charged(). compute() is awaited; respond() may return
+    an awaitable for serialization that must leave the event loop.
+    """
+    credit_balance, _ = await CreditBalance.objects.aget_or_create(user=request.user)
+    if not await run_in_db_pool(can_afford, credit_balance, cost):
+        CREDIT_DEDUCTIONS.inc(outcome='insufficient')
+        return insufficient_credits(credit_balance, cost)
+
+    result = await compute()
+    if isinstance(result, HttpResponseBase):
+        return result
+
+    if callable(description):
+        description = description(result)
+    if not await run_in_db_pool(charge_credits, credit_balance, cost, description, stripe_key(request)):
+        CREDIT_DEDUCTIONS.inc(outcome='declined')
+        return insufficient_credits(credit_balance, cost)
+    CREDIT_DEDUCTIONS.inc(outcome='charged')
+
+    with timed('serialize'):
+        response = respond(result, credit_balance.credits)
+        if inspect.isawaitable(response):
+            response = await response
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+def csrf_exempt_async(view):
+    """csrf_exempt() for async views, which Django < 5.0 would wrap as sync"""
+    return markcoroutinefunction(csrf_exempt(view))
+
+
+@idempotent
 @require_http_methods(["GET"])
 def locations(request):
     """
     Get SF Express locations - requires API key authentication
-    Costs 5 credits per request
+    Costs 5 credits per request, or 1 with count_only=1; free when
+    If-None-Match shows the client already has the response
     """
-    # Get credit balance
-    credit_balance, _ = CreditBalance.objects.get_or_create(user=request.user)
+    # Get locations from the in-memory snapshot
+    snapshot = get_location_snapshot()
+    etag = locations_etag(snapshot, request)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+
+    counting = count_only(request.GET)
+    cost = COUNT_COST if counting else LOCATIONS_COST
+
+    def respond(locations_list, credits_remaining):
+        if counting:
+            return count_response(snapshot, locations_list, cost, credits_remaining)
+        return locations_response(request, snapshot, locations_list, cost, credits_remaining)
+
+    return charged(
+        request, cost,
+        lambda: filter_locations(snapshot, request.GET),
+        lambda locations_list: query_description(counting, locations_list),
+        respond,
+        etag=etag,
+    )
+
+
+@idempotent
+async def alocations(request):
+    """
+    Async variant of locations() for ASGI deployments.
+    Blocking SQLite work runs on the bounded database thread pool.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    snapshot = current_location_snapshot()
+    if snapshot is None:
+        snapshot = await run_in_db_pool(get_location_snapshot)
+    etag = locations_etag(snapshot, request)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+
+    counting = count_only(request.GET)
+    cost = COUNT_COST if counting else LOCATIONS_COST
 
-    # Check if user has enough credits
-    cost = 5
-    if credit_balance.credits < cost:
-        return JsonResponse({
-            'error': 'Insufficient credits',
-            'required': cost,
-            'available': credit_balance.credits
-        }, status=402)
+    def respond(locations_list, credits_remaining):
+        if counting:
+            return count_response(snapshot, locations_list, cost, credits_remaining)
+        # Compressing a payload on first use takes long enough to stall the event loop
+        return run_in_db_pool(locations_response, request, snapshot, locations_list, cost, credits_remaining)
 
-    # Get query parameters
-    location_type = request.GET.get('type')  # 'LOCKER' or 'SHOP'
-    district = request.GET.get('district')
-    search = request.GET.get('search')
+    # The filter cache may wait for another thread's result
+    return await acharged(
+        request, cost,
+        lambda: run_in_db_pool(filter_locations, snapshot, request.GET),
+        lambda locations_list: query_description(counting, locations_list),
+        respond,
+        etag=etag,
+    )
+
+
+def parse_since(params):
+    """The `since` dataset version of a changes request, or None if missing or invalid"""
+    try:
+        since = int(params.get('since', ''))
+    except ValueError:
+        return None
+    return since if since >= 0 else None
+
+
+def invalid_since():
+    return JsonResponse({'error': 'since must be a dataset version number (0 or greater)'}, status=400)
+
+
+def collect_changes(snapshot, since):
+    """
+    Return (version, upserts, deleted) for a client at dataset version
+    `since`, or None when the client has to download the full dataset
+    again: a version in between has no change log, or `since` is unknown to
+    the database (which happens when it was recreated).
+
+    Upserts are the snapshot rows of locations changed since then; deleted
+    lists the ids of changed locations no longer active. A `since` ahead of
+    this process's snapshot but known to the database yields no changes.
+    """
+    if since >= snapshot.version:
+        if since > snapshot.version and since > DatasetVersion.current():
+            return None
+        return since, [], []
+
+    versions = DatasetVersion.objects.filter(id__gt=since, id__lte=snapshot.version)
+    if versions.filter(has_change_log=False).exists():
+        return None
+
+    changed = set(LocationChange.objects.filter(
+        version__gt=since, version__lte=snapshot.version
+    ).values_list('location_id', flat=True))
+    upserts = snapshot.get_many(changed)
+    deleted = sorted(changed - {row['id'] for row in upserts})
+    return snapshot.version, upserts, deleted
+
+
+def changes_response(since, changes, cost, credits_remaining):
+    version, upserts, deleted = changes
+    return HttpResponse(dumps({
+        'since': since,
+        'version': version,
+        'upserts': upserts,
+        'deleted': deleted,
+        'credits_used': cost,
+        'credits_remaining': credits_remaining
+    }), content_type='application/json')
+
+
+def full_sync_required(since):
+    return JsonResponse({
+        'error': 'Full sync required',
+        'since': since,
+        'detail': 'Changes since this version are not available; download /api/locations again'
+    }, status=410)
+
+
+@idempotent
+@require_http_methods(["GET"])
+def location_changes(request):
+    """
+    Locations created, updated or deleted since a dataset version - requires
+    API key authentication. Costs 1 credit per request.
+    """
+    since = parse_since(request.GET)
+    if since is None:
+        return invalid_since()
+
+    def compute():
+        return collect_changes(get_location_snapshot(), since) or full_sync_required(since)
+
+    return charged(
+        request, CHANGES_COST, compute, f'Location changes since v{since}',
+        lambda changes, credits_remaining: changes_response(since, changes, CHANGES_COST, credits_remaining),
+    )
+
+
+@idempotent
+async def alocation_changes(request):
+    """
+    Async variant of location_changes() for ASGI deployments
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
 
-    # Build query
-    queryset = Location.objects.filter(is_active=True)
+    since = parse_since(request.GET)
+    if since is None:
+        return invalid_since()
 
-    if location_type:
-        queryset = queryset.filter(location_type=location_type.upper())
+    async def compute():
+        snapshot = current_location_snapshot()
+        if snapshot is None:
+            snapshot = await run_in_db_pool(get_location_snapshot)
+        return await run_in_db_pool(collect_changes, snapshot, since) or full_sync_required(since)
 
-    if district:
-        queryset = queryset.filter(district__icontains=district)
+    return await acharged(
+        request, CHANGES_COST, compute, f'Location changes since v{since}',
+        lambda changes, credits_remaining: changes_response(since, changes, CHANGES_COST, credits_remaining),
+    )
 
-    if search:
-        queryset = queryset.filter(name__icontains=search)
 
-    # Get locations
-    locations_list = list(queryset.values(
-        'id', 'location_type', 'name', 'address', 'district',
-        'latitude', 'longitude', 'phone', 'opening_hours'
+def export_format(params):
+    fmt = params.get('format', 'json').lower()
+    return fmt if fmt in EXPORT_FORMATS else None
+
+
+def invalid_export_format():
+    return JsonResponse({'error': f'format must be one of: {", ".join(EXPORT_FORMATS)}'}, status=400)
+
+
+def find_export(request, snapshot, fmt):
+    """
+    (path, encoding, byte range) of the export file to send, or the uncharged
+    304 when the client already has that file or 416 for a range past its end
+    """
+    path, encoding = get_export(snapshot, fmt, request)
+    etag = f'"{path.name}"'
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    size = path.stat().st_size
+    try:
+        span = requested_range(request, size, etag)
+    except UnsatisfiableRange:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    return path, encoding, span
+
+
+def export_response(snapshot, fmt, path, encoding, span, credits_remaining):
+    """
+    Send an export file. With EXPORT_ACCEL_REDIRECT set the front-end server
+    sends it and answers Range requests itself; otherwise FileResponse lets
+    the WSGI server use sendfile, and a single byte range is streamed as a 206.
+    """
+    content_type = EXPORT_FORMATS[fmt][0]
+    if settings.EXPORT_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.EXPORT_ACCEL_REDIRECT + path.name
+    elif span is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = span
+        response = StreamingHttpResponse(read_range(path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{path.stat().st_size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'attachment; filename="sfexpress-{export_name(snapshot.version, fmt)}"'
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    response['ETag'] = f'"{path.name}"'
+    response['X-Dataset-Version'] = str(snapshot.version)
+    response['X-Credits-Remaining'] = str(credits_remaining)
+    return response
+
+
+@idempotent
+@require_http_methods(["GET"])
+def location_export(request):
+    """
+    Download the full dataset as a prebuilt JSON, CSV or NDJSON file -
+    requires API key authentication. Costs 5 credits per request; a 304 for
+    a matching If-None-Match or a 416 for an unsatisfiable Range is free.
+    """
+    fmt = export_format(request.GET)
+    if fmt is None:
+        return invalid_export_format()
+
+    snapshot = get_location_snapshot()
+    return charged(
+        request, EXPORT_COST,
+        lambda: find_export(request, snapshot, fmt),
+        f'Location export: {fmt}',
+        lambda export, credits_remaining: export_response(snapshot, fmt, *export, credits_remaining),
+    )
+
+
+@idempotent
+async def alocation_export(request):
+    """
+    Async variant of location_export() for ASGI deployments
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    fmt = export_format(request.GET)
+    if fmt is None:
+        return invalid_export_format()
+
+    snapshot = current_location_snapshot()
+    if snapshot is None:
+        snapshot = await run_in_db_pool(get_location_snapshot)
+    return await acharged(
+        request, EXPORT_COST,
+        lambda: run_in_db_pool(find_export, request, snapshot, fmt),
+        f'Location export: {fmt}',
+        lambda export, credits_remaining: export_response(snapshot, fmt, *export, credits_remaining),
+    )
+
+
+def coordinate_bounds(groups):
+    """Bounding box of summary rows, or None when none has coordinates"""
+    groups = [group for group in groups if group['min_latitude'] is not None]
+    if not groups:
+        return None
+    return {
+        'min_latitude': float(min(group['min_latitude'] for group in groups)),
+        'max_latitude': float(max(group['max_latitude'] for group in groups)),
+        'min_longitude': float(min(group['min_longitude'] for group in groups)),
+        'max_longitude': float(max(group['max_longitude'] for group in groups)),
+    }
+
+
+def summarize(groups):
+    return {
+        'total': sum(group['count'] for group in groups),
+        'types': {
+            location_type: sum(group['count'] for group in groups if group['location_type'] == location_type)
+            for location_type in sorted({group['location_type'] for group in groups})
+        },
+        'bounds': coordinate_bounds(groups),
+    }
+
+
+def get_location_summary():
+    """
+    Location counts per type, region and district with coordinate bounds,
+    read from the LocationSummary rows of the current dataset version
+    """
+    groups = list(LocationSummary.objects.values(
+        'version_id', 'district', 'region', 'location_type', 'count',
+        'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude'
     ))
+    regions = {}
+    districts = {}
+    for group in groups:
+        regions.setdefault(group['region'], []).append(group)
+        districts.setdefault(group['district'], []).append(group)
 
-    # Deduct credits
-    with transaction.atomic():
-        if credit_balance.deduct_credits(cost):
-            CreditTransaction.objects.create(
-                user=request.user,
-                transaction_type='API_CALL',
-                amount=-cost,
-                balance_after=credit_balance.credits,
-                description=f'Location query: {len(locations_list)} results'
-            )
+    return {
+        'version': groups[0]['version_id'] if groups else DatasetVersion.current(),
+        **summarize(groups),
+        'regions': {region: summarize(regions[region]) for region in sorted(regions)},
+        'districts': {
+            district: {'region': districts[district][0]['region'], **summarize(districts[district])}
+            for district in sorted(districts)
+        },
+    }
+
+
+def summary_response(summary, cost, credits_remaining):
+    return HttpResponse(dumps({
+        **summary,
+        'credits_used': cost,
+        'credits_remaining': credits_remaining
+    }), content_type='application/json')
 
+
+@idempotent
+@require_http_methods(["GET"])
+def location_summary(request):
+    """
+    Active location counts per type, region and district with coordinate
+    bounds - requires API key authentication. Costs 1 credit per request.
+    """
+    return charged(
+        request, SUMMARY_COST, get_location_summary, 'Location summary',
+        lambda summary, credits_remaining: summary_response(summary, SUMMARY_COST, credits_remaining),
+    )
+
+
+@idempotent
+async def alocation_summary(request):
+    """
+    Async variant of location_summary() for ASGI deployments
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    return await acharged(
+        request, SUMMARY_COST, lambda: run_in_db_pool(get_location_summary), 'Location summary',
+        lambda summary, credits_remaining: summary_response(summary, SUMMARY_COST, credits_remaining),
+    )
+
+
+def invalid_tile():
     return JsonResponse({
-        'count': len(locations_list),
-        'locations': locations_list,
+        'error': f'Tiles exist for zoom 0 to {settings.LOCATION_TILE_MAX_ZOOM} '
+                 f'with x and y from 0 to 2^zoom - 1'
+    }, status=400)
+
+
+def tile_response(snapshot, z, x, y, clusters, cost, credits_remaining):
+    """Wrap the precomputed clusters of a tile without decoding them"""
+    head = dumps({
+        'z': z,
+        'x': x,
+        'y': y,
+        'version': snapshot.version,
+        'credits_used': cost,
+        'credits_remaining': credits_remaining
+    })[:-1]
+    return HttpResponse(head + b', "clusters": ' + clusters + b'}', content_type='application/json')
+
+
+@idempotent
+@require_http_methods(["GET"])
+def location_tiles(request, z, x, y):
+    """
+    Clustered locations of one Web Mercator map tile - requires API key
+    authentication. Costs 1 credit per request; free when If-None-Match
+    shows the client already has the tile
+    """
+    if not valid_tile(z, x, y, settings.LOCATION_TILE_MAX_ZOOM):
+        return invalid_tile()
+
+    snapshot = get_location_snapshot()
+    etag = locations_etag(snapshot, request)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+
+    return charged(
+        request, TILE_COST,
+        lambda: snapshot.tile_pyramid().get(z, x, y),
+        f'Location tile {z}/{x}/{y}',
+        lambda clusters, credits_remaining: tile_response(snapshot, z, x, y, clusters, TILE_COST, credits_remaining),
+        etag=etag,
+    )
+
+
+@idempotent
+async def alocation_tiles(request, z, x, y):
+    """
+    Async variant of location_tiles() for ASGI deployments
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not valid_tile(z, x, y, settings.LOCATION_TILE_MAX_ZOOM):
+        return invalid_tile()
+
+    snapshot = current_location_snapshot()
+    if snapshot is None:
+        snapshot = await run_in_db_pool(get_location_snapshot)
+    etag = locations_etag(snapshot, request)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+
+    async def compute():
+        if snapshot.tiles_ready:
+            pyramid = snapshot.tile_pyramid()
+        else:
+            # First tile request of a snapshot the serve master did not prepare
+            pyramid = await run_in_db_pool(snapshot.tile_pyramid)
+        return pyramid.get(z, x, y)
+
+    return await acharged(
+        request, TILE_COST, compute, f'Location tile {z}/{x}/{y}',
+        lambda clusters, credits_remaining: tile_response(snapshot, z, x, y, clusters, TILE_COST, credits_remaining),
+        etag=etag,
+    )
+
+
+def nearest_unavailable():
+    return JsonResponse({'error': 'Bulk nearest matching needs the numpy package on the server'}, status=501)
+
+
+def parse_nearest_request(request):
+    """
+    Return (latitudes, longitudes, k, location_type) of a nearest-bulk
+    request, or raise InvalidOrigins. Origins come as a CSV body (Content-Type
+    text/csv) or a JSON object with an `origins` list.
+    """
+    try:
+        k = int(request.GET.get('k', '1'))
+    except ValueError:
+        k = 0
+    if not 1 <= k <= NEAREST_MAX_K:
+        raise InvalidOrigins(f'k must be a number from 1 to {NEAREST_MAX_K}')
+
+    try:
+        if request.content_type == 'text/csv':
+            latitudes, longitudes = parse_csv_origins(request.body.decode('utf-8-sig'))
+        else:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                raise InvalidOrigins('Send a JSON object with an origins list, or a CSV body as text/csv')
+            latitudes, longitudes = parse_json_origins(data.get('origins'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise InvalidOrigins('The request body is not valid JSON or UTF-8 CSV')
+
+    if len(latitudes) > settings.LOCATION_NEAREST_MAX_ORIGINS:
+        raise InvalidOrigins(f'At most {settings.LOCATION_NEAREST_MAX_ORIGINS} origins per request')
+    return latitudes, longitudes, k, request.GET.get('type')
+
+
+def nearest_cost(origins):
+    return max(1, math.ceil(origins / NEAREST_BATCH_SIZE)) * NEAREST_BATCH_COST
+
+
+def match_nearest(snapshot, latitudes, longitudes, k, location_type):
+    """Ids and distances of the k nearest locations of each origin, in origin order"""
+    index = snapshot.nearest_index(location_type)
+    results = []
+    for ids, distances in index.query(latitudes, longitudes, k):
+        results.extend(
+            {'ids': origin_ids, 'distances_km': origin_distances}
+            for origin_ids, origin_distances in zip(ids.tolist(), distances.round(3).tolist())
+        )
+    return results
+
+
+def nearest_response(snapshot, k, results, cost, credits_remaining):
+    return HttpResponse(dumps({
+        'version': snapshot.version,
+        'k': k,
+        'count': len(results),
+        'results': results,
         'credits_used': cost,
-        'credits_remaining': credit_balance.credits
-    })
+        'credits_remaining': credits_remaining
+    }), content_type='application/json')
+
+
+@csrf_exempt
+@idempotent
+@require_http_methods(["POST"])
+def location_nearest_bulk(request):
+    """
+    The k nearest locations of many origins - requires API key
+    authentication. Costs 1 credit per started batch of 1000 origins.
+    """
+    if not numpy_available():
+        return nearest_unavailable()
+    try:
+        latitudes, longitudes, k, location_type = parse_nearest_request(request)
+    except InvalidOrigins as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    cost = nearest_cost(len(latitudes))
+    snapshot = get_location_snapshot()
+
+    def compute():
+        with timed('nearest'):
+            return match_nearest(snapshot, latitudes, longitudes, k, location_type)
+
+    return charged(
+        request, cost, compute,
+        lambda results: f'Nearest locations: {len(results)} origins',
+        lambda results, credits_remaining: nearest_response(snapshot, k, results, cost, credits_remaining),
+    )
+
+
+@csrf_exempt_async
+@idempotent
+async def alocation_nearest_bulk(request):
+    """
+    Async variant of location_nearest_bulk() for ASGI deployments. The
+    matching runs on the database thread pool to keep the event loop free.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not numpy_available():
+        return nearest_unavailable()
+    try:
+        latitudes, longitudes, k, location_type = parse_nearest_request(request)
+    except InvalidOrigins as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    cost = nearest_cost(len(latitudes))
+    snapshot = current_location_snapshot()
+    if snapshot is None:
+        snapshot = await run_in_db_pool(get_location_snapshot)
+
+    async def compute():
+        with timed('nearest'):
+            return await run_in_db_pool(match_nearest, snapshot, latitudes, longitudes, k, location_type)
+
+    return await acharged(
+        request, cost, compute,
+        lambda results: f'Nearest locations: {len(results)} origins',
+        lambda results, credits_remaining: nearest_response(snapshot, k, results, cost, credits_remaining),
+    )
+
+
+@require_http_methods(["GET"])
+def credit_ledger(request):
+    """
+    Stream the API key owner's credit transactions as CSV or NDJSON -
+    requires API key authentication. Free.
+    """
+    return ledger_response(request, request.user)
+
+
+async def acredit_ledger(request):
+    """
+    Async variant of credit_ledger() for ASGI deployments
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    return ledger_response(request, request.user)
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """
+    Prometheus metrics for this process
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not scrape_allowed(request):
+        return HttpResponseForbidden('Forbidden', content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
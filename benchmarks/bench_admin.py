@@ -0,0 +1,102 @@
+"""
+Queries and time per Django admin page on a large generated dataset.
+
+Loads generated users, keys and ledger rows (generate_dataset), then renders
+each changelist, search, filter, date drill-down, autocomplete and change
+form as a superuser. Exits with status 1 when a page runs more than
+--max-queries queries, so it can guard against N+1 queries and full-table
+counts creeping back in.
+
+    python benchmarks/bench_admin.py --transactions 1000000 --output admin.json
+"""
+import argparse
+import sys
+import time
+
+from common import manage, prepare_data_dir, setup_django, write_results
+
+PAGES = [
+    ('users', '/admin/api/user/'),
+    ('users_search', '/admin/api/user/?q=synthetic_00001'),
+    ('api_keys', '/admin/api/apikey/'),
+    ('api_keys_search', '/admin/api/apikey/?q=synthetic_00001'),
+    ('credit_balances', '/admin/api/creditbalance/'),
+    ('transactions', '/admin/api/credittransaction/'),
+    ('transactions_filtered', '/admin/api/credittransaction/?transaction_type__exact=API_CALL'),
+    ('transactions_search', '/admin/api/credittransaction/?q=synthetic_00001'),
+    ('transactions_year', '/admin/api/credittransaction/?created_at__year={year}'),
+    ('transactions_page_50', '/admin/api/credittransaction/?p=50'),
+    ('transaction_change', '/admin/api/credittransaction/{transaction_id}/change/'),
+    ('locations', '/admin/api/location/'),
+    ('locations_district', '/admin/api/location/?district={district}'),
+    ('user_autocomplete', '/admin/autocomplete/?app_label=api&model_name=apikey&field_name=user&term=synthetic_0000'),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--locations', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-queries', type=int, default=10, help='fail when a page runs more queries')
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, _ = prepare_data_dir(args.data_dir)
+    manage(
+        data_dir, 'generate_dataset', '--clear', '--locations', str(args.locations),
+        '--users', str(args.users), '--transactions', str(args.transactions),
+    )
+    setup_django(data_dir)
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from api.models import CreditTransaction, Location, User
+
+    admin_user = User.objects.filter(username='bench-admin').first() or User.objects.create_superuser(
+        'bench-admin', 'bench-admin@example.com', 'bench-admin'
+    )
+    client = Client()
+    client.force_login(admin_user)
+    latest = CreditTransaction.objects.order_by('-created_at').first()
+    context = {
+        'year': latest.created_at.year,
+        'transaction_id': latest.pk,
+        'district': Location.objects.values_list('district', flat=True).first(),
+    }
+
+    pages = {}
+    failures = []
+    for name, url in PAGES:
+        url = url.format(**context)
+        timings = []
+        for _ in range(args.repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures.append(f'{name}: HTTP {response.status_code}')
+        pages[name] = {
+            'queries': len(queries),
+            'min_ms': round(min(timings) * 1000, 1),
+            'max_ms': round(max(timings) * 1000, 1),
+        }
+        if len(queries) > args.max_queries:
+            failures.append(f'{name}: {len(queries)} queries (max {args.max_queries})')
+
+    write_results(args.output, 'admin', {
+        'users': args.users,
+        'transactions': args.transactions,
+        'max_queries': args.max_queries,
+        'pages': pages,
+    })
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
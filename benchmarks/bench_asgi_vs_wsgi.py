@@ -0,0 +1,97 @@
+"""
+Concurrency scaling of the WSGI (runserver) path versus the ASGI (uvicorn +
+async views) path for /api/locations with slow clients.
+
+Each simulated client trickles its request headers over --client-delay
+seconds, like a mobile client on a poor link, then reads the response.
+
+    python benchmarks/bench_asgi_vs_wsgi.py --concurrency 1 16 64 --output asgi.json
+"""
+import argparse
+import asyncio
+import time
+
+from common import free_port, prepare_data_dir, start_server, summarize, write_results
+
+
+async def slow_request(port, path, api_key, client_delay):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    lines = [
+        f'GET {path} HTTP/1.1',
+        'Host: 127.0.0.1',
+        f'Authorization: Bearer {api_key}',
+        'Connection: close',
+    ]
+    start = time.perf_counter()
+    for line in lines:
+        writer.write(line.encode() + b'\r\n')
+        await writer.drain()
+        await asyncio.sleep(client_delay / len(lines))
+    writer.write(b'\r\n')
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b' ', 2)[1]) if response else 0
+    return time.perf_counter() - start, status
+
+
+async def run_level(port, path, api_key, concurrency, requests_per_client, client_delay):
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for _ in range(requests_per_client):
+            try:
+                elapsed, status = await slow_request(port, path, api_key, client_delay)
+            except OSError:
+                errors += 1
+                continue
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - start)
+    result['errors'] = errors
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--requests', type=int, default=5, help='requests per client')
+    parser.add_argument('--client-delay', type=float, default=0.2, help='seconds to send each request')
+    parser.add_argument('--path', default='/api/locations?type=SHOP')
+    parser.add_argument('--servers', nargs='+', default=['wsgi', 'asgi'], choices=['wsgi', 'asgi'])
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, api_key = prepare_data_dir(args.data_dir)
+    results = {}
+    for kind in args.servers:
+        port = free_port()
+        proc = start_server(kind, data_dir, port)
+        try:
+            results[kind] = {
+                str(level): asyncio.run(run_level(
+                    port, args.path, api_key, level, args.requests, args.client_delay
+                ))
+                for level in args.concurrency
+            }
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    write_results(args.output, 'asgi_vs_wsgi', {
+        'path': args.path,
+        'client_delay_s': args.client_delay,
+        'servers': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Cost of APIKeyAuthenticationMiddleware on its own, in this process.
+
+The middleware wraps a view that returns an empty response, so the numbers
+cover header parsing, rate limiting, the key lookup and the last_used
+update and nothing else.
+
+    python benchmarks/bench_auth.py --iterations 2000 --output auth.json
+"""
+import argparse
+import time
+
+from common import prepare_data_dir, setup_django, summarize, write_results
+
+
+def measure(middleware, factory, headers, iterations):
+    from django.db import close_old_connections
+
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    for _ in range(iterations):
+        request = factory.get('/api/locations', headers=headers)
+        close_old_connections()
+        started = time.perf_counter()
+        response = middleware(request)
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    result = summarize(latencies, time.perf_counter() - start)
+    result['statuses'] = {str(code): count for code, count in sorted(statuses.items())}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, api_key = prepare_data_dir(args.data_dir)
+    setup_django(data_dir)
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from api.middleware import APIKeyAuthenticationMiddleware
+
+    middleware = APIKeyAuthenticationMiddleware(lambda request: HttpResponse())
+    factory = RequestFactory()
+    cases = {
+        'valid_key': {'Authorization': f'Bearer {api_key}'},
+        'invalid_key': {'Authorization': 'Bearer sk_not_a_real_key'},
+        'missing_header': {},
+    }
+    results = {
+        name: measure(middleware, factory, headers, args.iterations)
+        for name, headers in cases.items()
+    }
+
+    write_results(args.output, 'auth', {
+        'iterations': args.iterations,
+        'cases': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
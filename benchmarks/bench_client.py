@@ -0,0 +1,132 @@
+"""
+The sfexpress_client package against a local server.
+
+Starts a server subprocess on 127.0.0.1 (no network needed) and compares
+the client with one new connection per request, as ad-hoc scripts do:
+keep-alive latency, revalidating the on-disk cache (304, no credits), index
+lookups, the async client and an index refresh through the change log.
+Exits with status 1 when the client misbehaves (wrong data, credits charged
+for a 304, stale index), so it doubles as an end-to-end check.
+
+    python benchmarks/bench_client.py --target asgi --requests 200 --output client.json
+"""
+import argparse
+import asyncio
+import http.client
+import sys
+import tempfile
+import time
+import uuid
+
+from common import ROOT, free_port, prepare_data_dir, setup_django, start_server, summarize, write_results
+
+sys.path.insert(0, str(ROOT))
+
+
+def timed_calls(func, count):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--target', default='asgi', choices=['wsgi', 'asgi'])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, api_key = prepare_data_dir(args.data_dir)
+    setup_django(data_dir)
+    from api.models import CreditBalance, DatasetVersion, Location, User
+    from sfexpress_client import AsyncClient, Client
+
+    def balance():
+        return CreditBalance.objects.get(user=User.objects.get(username='bench')).credits
+
+    port = free_port()
+    # Synchronous version checks on every request, so the refresh check sees the edit at once
+    proc = start_server(
+        args.target, data_dir, port,
+        LOCATION_SNAPSHOT_CHECK_INTERVAL=0, LOCATION_SNAPSHOT_STALE_WHILE_REVALIDATE=False,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    failures = []
+    results = {}
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    def new_connection_count():
+        # Same headers as the client sends, on a new connection each time
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        connection.request('GET', '/api/locations?count_only=1', headers={
+            'Authorization': f'Bearer {api_key}', 'Idempotency-Key': uuid.uuid4().hex,
+        })
+        connection.getresponse().read()
+        connection.close()
+
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                Client(api_key, base_url, cache_dir=cache_dir) as client:
+            results['count_new_connection'] = timed_calls(new_connection_count, args.requests)
+            results['count_keep_alive'] = timed_calls(
+                lambda: client.request('GET', '/api/locations', {'count_only': 1}), args.requests
+            )
+
+            before = balance()
+            start = time.perf_counter()
+            first = client.locations()
+            results['locations_first_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            check(first['count'] == Location.objects.filter(is_active=True).count(), 'locations() count mismatch')
+            check(balance() == before - 5, 'first locations() call was not charged 5 credits')
+
+            before = balance()
+            results['locations_revalidated'] = timed_calls(client.locations, args.requests)
+            check(balance() == before, f'304 revalidations were charged {before - balance()} credits')
+            check(client.locations() == first, 'revalidated locations() differ from the first response')
+
+            index = client.index()
+            district = index.rows[0]['district']
+            results['index_filter'] = timed_calls(lambda: index.filter(type='LOCKER', district=district), args.requests)
+            check(
+                [row['id'] for row in index.filter(district=district)] ==
+                [row['id'] for row in client.locations(district=district)['locations']],
+                'index.filter() differs from the API'
+            )
+
+            async def gather_counts():
+                async with AsyncClient(api_key, base_url) as async_client:
+                    start = time.perf_counter()
+                    counts = await asyncio.gather(*(async_client.count(type='LOCKER') for _ in range(20)))
+                    return counts, time.perf_counter() - start
+            counts, elapsed = asyncio.run(gather_counts())
+            results['async_20_counts_ms'] = round(elapsed * 1000, 2)
+            check(len(set(counts)) == 1 and counts[0] == index.count(type='LOCKER'), 'async counts differ from the index')
+
+            location = Location.objects.filter(is_active=True).first()
+            location.name = f'{location.name} (renamed)'
+            location.save()
+            DatasetVersion.publish('bench', upserted=[location.pk])
+            client.refresh_index(index)
+            check(index.version == DatasetVersion.current(), 'refresh_index() did not reach the current version')
+            check(index.get(location.pk)['name'] == location.name, 'refresh_index() missed the renamed location')
+            check(client.locations()['version'] == index.version, 'cached locations() were not refreshed after a change')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    write_results(args.output, 'client', {'target': args.target, 'requests': args.requests, **results})
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
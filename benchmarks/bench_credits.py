@@ -0,0 +1,120 @@
+"""
+Credit deduction under contention: several processes charge the same user
+at once, with the single CreditBalance row and with striped counters.
+
+After each mode the remaining balance is checked against the number of
+successful charges, so lost updates show up as 'consistent': false.
+
+    python benchmarks/bench_credits.py --processes 8 --charges 200 --output credits.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from common import bench_env, manage, prepare_data_dir, summarize, write_results
+
+COST = 5
+
+RESET_SCRIPT = """
+from api.models import CreditBalance, CreditStripe, CreditTransaction
+CreditStripe.objects.filter(user__username='bench').delete()
+CreditTransaction.objects.filter(user__username='bench').delete()
+CreditBalance.objects.filter(user__username='bench').update(credits={credits}, total_spent=0)
+"""
+
+CHECK_SCRIPT = """
+import json
+from api.credits import available_credits
+from api.models import CreditBalance, CreditTransaction
+balance = CreditBalance.objects.get(user__username='bench')
+print(json.dumps({
+    'available': available_credits(balance),
+    'transactions': CreditTransaction.objects.filter(user__username='bench').count(),
+}))
+"""
+
+
+def worker(args):
+    from common import setup_django
+    from pathlib import Path
+    setup_django(Path(args.data_dir))
+    from django.db import OperationalError, close_old_connections
+    from api.credits import charge_credits
+    from api.models import CreditBalance
+
+    latencies, declined, errors = [], 0, 0
+    for _ in range(args.charges):
+        close_old_connections()
+        start = time.perf_counter()
+        try:
+            balance = CreditBalance.objects.get(user__username='bench')
+            if charge_credits(balance, COST, 'bench charge'):
+                latencies.append(time.perf_counter() - start)
+            else:
+                declined += 1
+        except OperationalError:
+            errors += 1
+    print(json.dumps({'latencies': latencies, 'declined': declined, 'errors': errors}))
+
+
+def run_mode(stripes, data_dir, args):
+    env = {'DATABASE_PROFILE': args.profile, 'CREDIT_STRIPES': stripes}
+    initial = COST * args.processes * args.charges
+    manage(data_dir, 'shell', '-c', RESET_SCRIPT.format(credits=initial), **env)
+
+    cmd = [
+        sys.executable, __file__, '--worker',
+        '--data-dir', str(data_dir), '--charges', str(args.charges),
+    ]
+    start = time.perf_counter()
+    procs = [
+        subprocess.Popen(cmd, env=bench_env(data_dir, **env), stdout=subprocess.PIPE, text=True)
+        for _ in range(args.processes)
+    ]
+    outputs = [json.loads(proc.communicate()[0]) for proc in procs]
+    elapsed = time.perf_counter() - start
+
+    latencies = [v for out in outputs for v in out['latencies']]
+    check = json.loads(manage(data_dir, 'shell', '-c', CHECK_SCRIPT, **env).strip().splitlines()[-1])
+    result = summarize(latencies, elapsed)
+    result.update({
+        'declined': sum(out['declined'] for out in outputs),
+        'errors': sum(out['errors'] for out in outputs),
+        'consistent': (
+            check['available'] == initial - COST * len(latencies)
+            and check['transactions'] == len(latencies)
+        ),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--charges', type=int, default=200, help='charges per process')
+    parser.add_argument('--stripes', type=int, nargs='+', default=[0, 8],
+                        help='CREDIT_STRIPES values to compare (0 is the single balance row)')
+    parser.add_argument('--profile', default='production', choices=['default', 'production'])
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    data_dir, _ = prepare_data_dir(args.data_dir)
+    results = {str(stripes): run_mode(stripes, data_dir, args) for stripes in args.stripes}
+
+    write_results(args.output, 'credits', {
+        'processes': args.processes,
+        'charges_per_process': args.charges,
+        'database_profile': args.profile,
+        'stripes': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+JSON encode time of the full /api/locations payload.
+
+'django_decimal' is the previous path: rows from .values() with Decimal
+coordinates through DjangoJSONEncoder. The other serializers encode the
+snapshot rows, whose coordinates are floats. The docs/ dataset has no
+coordinates, so use --synthetic to encode generated locations that do.
+
+    python benchmarks/bench_json_encode.py --synthetic 20000 --output json.json
+"""
+import argparse
+import json
+import statistics
+import time
+
+from common import manage, prepare_data_dir, setup_django, write_results
+
+
+def measure(encode, payload, repeat):
+    encode(payload)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode(payload)
+        timings.append(time.perf_counter() - start)
+    return {
+        'bytes': len(body),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--synthetic', type=int, metavar='N', help='replace the dataset with N generated locations')
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, _ = prepare_data_dir(args.data_dir)
+    if args.synthetic:
+        manage(
+            data_dir, 'generate_dataset', '--clear', '--locations', str(args.synthetic),
+            '--users', '0', '--transactions', '0',
+        )
+    setup_django(data_dir)
+    from django.core.serializers.json import DjangoJSONEncoder
+    from api.models import Location
+    from api.serializers import orjson_dumps, stdlib_dumps
+    from api.snapshot import LOCATION_FIELDS, LocationSnapshot
+
+    decimal_rows = list(Location.objects.filter(is_active=True).values(*LOCATION_FIELDS))
+    snapshot_rows = list(LocationSnapshot.build().rows)
+
+    def django_decimal(rows):
+        return json.dumps({'count': len(rows), 'locations': rows}, cls=DjangoJSONEncoder).encode()
+
+    def payload(rows):
+        return {'count': len(rows), 'locations': rows}
+
+    results = {
+        'django_decimal': measure(django_decimal, decimal_rows, args.repeat),
+        'stdlib': measure(stdlib_dumps, payload(snapshot_rows), args.repeat),
+    }
+    try:
+        results['orjson'] = measure(orjson_dumps, payload(snapshot_rows), args.repeat)
+    except ImportError:
+        pass
+
+    write_results(args.output, 'json_encode', {
+        'locations': len(snapshot_rows),
+        'repeat': args.repeat,
+        'serializers': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Streaming credit ledger export (/api/credits/ledger) of one large ledger.
+
+Gives the bench user --transactions ledger rows, then streams them as CSV
+and NDJSON, recording throughput and peak Python memory (tracemalloc) next
+to loading the same rows in one query. While the export streams, another
+connection records ledger rows after every chunk, as API calls would; their
+latency shows whether the export holds the table. Exits with status 1 when
+an export misses, repeats or reorders rows.
+
+    python benchmarks/bench_ledger.py --transactions 1000000 --output ledger.json
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+
+from common import prepare_data_dir, setup_django, write_results
+
+
+def timed_write(CreditTransaction, user, latencies):
+    from django.db import connection
+    start = time.perf_counter()
+    CreditTransaction.objects.create(user=user, transaction_type='API_CALL', amount=-1, balance_after=0)
+    latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, api_key = prepare_data_dir(args.data_dir)
+    setup_django(data_dir)
+    from django.conf import settings
+    from django.db import transaction
+    from django.test import Client
+    from django.utils import timezone
+    from api.models import CreditTransaction, User
+
+    user = User.objects.get(username='bench')
+    # Another user's API calls write the concurrent rows
+    writer_user, _ = User.objects.get_or_create(username='bench-writer', defaults={'email': 'bench-writer@example.com'})
+    CreditTransaction.objects.filter(user=user).delete()
+    start = timezone.now() - timedelta(days=365)
+    with transaction.atomic():
+        for offset in range(0, args.transactions, 10000):
+            CreditTransaction.objects.bulk_create(
+                CreditTransaction(user=user, transaction_type='API_CALL', amount=-1, balance_after=number,
+                                  description=f'Locations query {number}')
+                for number in range(offset, min(offset + 10000, args.transactions))
+            )
+    # Rows share timestamps in groups of three, as bursts of calls do
+    first_id = CreditTransaction.objects.filter(user=user).order_by('id').values_list('id', flat=True).first()
+    with transaction.atomic():
+        for offset in range(0, args.transactions, 3):
+            CreditTransaction.objects.filter(
+                user=user, id__gte=first_id + offset, id__lt=first_id + offset + 3
+            ).update(created_at=start + timedelta(seconds=offset))
+    expected = list(CreditTransaction.objects.filter(user=user).order_by('created_at', 'id').values_list('id', flat=True))
+
+    results = {'transactions': args.transactions, 'batch_size': settings.LEDGER_EXPORT_BATCH_SIZE}
+    failures = []
+
+    def single_query():
+        return list(CreditTransaction.objects.filter(user=user).order_by('created_at', 'id').values_list())
+
+    begin = time.perf_counter()
+    single_query()
+    seconds = time.perf_counter() - begin
+    tracemalloc.start()
+    single_query()
+    results['single_query'] = {
+        'seconds': round(seconds, 3),
+        'peak_mb': round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1),
+    }
+    tracemalloc.stop()
+
+    client = Client()
+
+    def export(fmt, collect=True):
+        """Stream one export; returns (ids, stream seconds, bytes, concurrent write latencies)"""
+        response = client.get('/api/credits/ledger', {'format': fmt}, HTTP_AUTHORIZATION=f'Bearer {api_key}')
+        chunks = iter(response.streaming_content)
+        ids, seconds, size, write_latencies = [], 0.0, 0, []
+        while True:
+            begin = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds += time.perf_counter() - begin
+            if chunk is None:
+                return ids, seconds, size, write_latencies
+            size += len(chunk)
+            if not collect:
+                pass
+            elif fmt == 'csv':
+                ids.extend(int(line.split(b',', 1)[0]) for line in chunk.splitlines() if line[:1].isdigit())
+            else:
+                ids.extend(json.loads(line)['id'] for line in chunk.splitlines())
+            writer = threading.Thread(target=timed_write, args=(CreditTransaction, writer_user, write_latencies))
+            writer.start()
+            writer.join()
+
+    for fmt in ('csv', 'ndjson'):
+        ids, seconds, size, write_latencies = export(fmt)
+        tracemalloc.start()
+        export(fmt, collect=False)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[fmt] = {
+            'seconds': round(seconds, 3),
+            'rows_per_s': round(len(ids) / seconds),
+            'mb': round(size / 2 ** 20, 1),
+            'peak_mb': round(peak / 2 ** 20, 1),
+            'concurrent_write_max_ms': round(max(write_latencies, default=0) * 1000, 2),
+        }
+        if ids != expected:
+            failures.append(f'{fmt}: exported {len(ids)} rows, expected {len(expected)} in (created_at, id) order')
+
+    write_results(args.output, 'ledger', results)
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Wall time of a full `load_sfexpress_data` run on the docs/ dataset.
+
+Each repeat is a separate manage.py process, so the numbers include Django
+start-up as an operator would see it. The table is emptied before each
+timed load; a second, unchanged load per repeat measures the no-op sync.
+
+    python benchmarks/bench_loader.py --repeat 5 --output loader.json
+"""
+import argparse
+import statistics
+import time
+
+from common import manage, prepare_data_dir, write_results
+
+COUNT_SCRIPT = """
+from api.models import Location
+print(Location.objects.count())
+"""
+
+CLEAR_SCRIPT = """
+from api.models import Location
+Location.objects.all().delete()
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, _ = prepare_data_dir(args.data_dir)
+    runs = []
+    reloads = []
+    for _ in range(args.repeat):
+        manage(data_dir, 'shell', '-c', CLEAR_SCRIPT)
+        start = time.perf_counter()
+        manage(data_dir, 'load_sfexpress_data')
+        runs.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        manage(data_dir, 'load_sfexpress_data')
+        reloads.append(time.perf_counter() - start)
+    locations = int(manage(data_dir, 'shell', '-c', COUNT_SCRIPT).strip().splitlines()[-1])
+
+    median = statistics.median(runs)
+    write_results(args.output, 'loader', {
+        'repeat': args.repeat,
+        'locations': locations,
+        'min_s': round(min(runs), 3),
+        'median_s': round(median, 3),
+        'max_s': round(max(runs), 3),
+        'locations_per_s': round(locations / median, 1),
+        'reload_median_s': round(statistics.median(reloads), 3),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Latency and throughput of /api/locations for each filter at several
+concurrency levels.
+
+Requests go to a local server subprocess ('wsgi' or 'asgi') or, with
+--target client, through the Django test client in this process, which
+leaves out the HTTP server and network entirely.
+
+    python benchmarks/bench_locations.py --target asgi --concurrency 1 8 32 --output locations.json
+"""
+import argparse
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import free_port, prepare_data_dir, setup_django, start_server, summarize, write_results
+
+FILTERS = {
+    'all': '/api/locations',
+    'type': '/api/locations?type=LOCKER',
+    'district': '/api/locations?district=Central',
+    'search': '/api/locations?search=MTR',
+    'combined': '/api/locations?type=SHOP&district=Kowloon&search=Centre',
+}
+
+
+def http_requester(port, api_key):
+    """One keep-alive connection per thread"""
+    local = threading.local()
+
+    def request(path):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            conn.request('GET', path, headers={'Authorization': f'Bearer {api_key}'})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            local.conn = None
+            raise
+        return response.status
+
+    return request
+
+
+def client_requester(api_key):
+    from django.db import close_old_connections
+    from django.test import Client
+
+    local = threading.local()
+
+    def request(path):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        close_old_connections()
+        return client.get(path, HTTP_AUTHORIZATION=f'Bearer {api_key}').status_code
+
+    return request
+
+
+def run_level(request, path, concurrency, requests_per_client):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client():
+        nonlocal errors
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            try:
+                status = request(path)
+            except (OSError, http.client.HTTPException):
+                status = 0
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    result = summarize(latencies, time.perf_counter() - start)
+    result['errors'] = errors
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--target', default='asgi', choices=['wsgi', 'asgi', 'client'])
+    parser.add_argument('--filters', nargs='+', default=list(FILTERS), choices=list(FILTERS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=50, help='requests per client')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests before measuring')
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, api_key = prepare_data_dir(args.data_dir)
+    proc = None
+    if args.target == 'client':
+        setup_django(data_dir)
+        request = client_requester(api_key)
+    else:
+        port = free_port()
+        proc = start_server(args.target, data_dir, port)
+        request = http_requester(port, api_key)
+
+    try:
+        for _ in range(args.warmup):
+            request(FILTERS['all'])
+        results = {
+            name: {
+                str(level): run_level(request, FILTERS[name], level, args.requests)
+                for level in args.concurrency
+            }
+            for name in args.filters
+        }
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    write_results(args.output, 'locations', {
+        'target': args.target,
+        'requests_per_client': args.requests,
+        'paths': {name: FILTERS[name] for name in args.filters},
+        'filters': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
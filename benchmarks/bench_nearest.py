@@ -0,0 +1,93 @@
+"""
+Bulk nearest-location matching (api.nearest) against a brute-force NumPy scan.
+
+Origins are drawn near random locations (customer addresses) and uniformly
+over the bounding box of the data (many far from any location). The
+brute-force scan compares every origin with every location; it runs on a
+sample of the origins, which also checks that the grid search returns the
+same distances, and its time is scaled to all origins. Exits with status 1
+on a mismatch. Needs numpy; the docs/ dataset has no coordinates, so use
+--synthetic.
+
+    python benchmarks/bench_nearest.py --synthetic 100000 --origins 50000 --output nearest.json
+"""
+import argparse
+import sys
+import time
+
+from common import manage, prepare_data_dir, setup_django, write_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--origins', type=int, default=50000)
+    parser.add_argument('-k', type=int, default=3)
+    parser.add_argument('--sample', type=int, default=500, help='origins checked by brute force')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='replace the dataset with N generated locations')
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    data_dir, _ = prepare_data_dir(args.data_dir)
+    if args.synthetic:
+        manage(
+            data_dir, 'generate_dataset', '--clear', '--locations', str(args.synthetic),
+            '--users', '0', '--transactions', '0',
+        )
+    setup_django(data_dir)
+    import numpy as np
+    from api.nearest import EARTH_RADIUS_KM, NearestIndex
+    from api.snapshot import LocationSnapshot
+    from django.conf import settings
+
+    rows = [row for row in LocationSnapshot.build().rows if row['latitude'] is not None]
+    if not rows:
+        sys.exit('No locations with coordinates; use --synthetic N')
+    latitudes = np.array([row['latitude'] for row in rows])
+    longitudes = np.array([row['longitude'] for row in rows])
+
+    start = time.perf_counter()
+    index = NearestIndex(rows, settings.LOCATION_NEAREST_CELL_KM)
+    index.grid(0)
+    results = {'locations': len(rows), 'origins': args.origins, 'k': args.k,
+               'index_build_ms': round((time.perf_counter() - start) * 1000, 2)}
+
+    rng = np.random.default_rng(42)
+    picked = rng.integers(len(rows), size=args.origins)
+    distributions = {
+        'near_locations': (latitudes[picked] + rng.normal(0, 0.01, args.origins),
+                           longitudes[picked] + rng.normal(0, 0.01, args.origins)),
+        'uniform_bbox': (rng.uniform(latitudes.min(), latitudes.max(), args.origins),
+                         rng.uniform(longitudes.min(), longitudes.max(), args.origins)),
+    }
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    failures = []
+    for name, (origin_latitudes, origin_longitudes) in distributions.items():
+        start = time.perf_counter()
+        distances = np.concatenate([found for _, found in index.query(origin_latitudes, origin_longitudes, args.k)])
+        grid_seconds = time.perf_counter() - start
+
+        sample = rng.choice(args.origins, size=min(args.sample, args.origins), replace=False)
+        start = time.perf_counter()
+        for origin in sample:
+            lat1, lon1 = np.radians(origin_latitudes[origin]), np.radians(origin_longitudes[origin])
+            a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+            expected = np.sort(np.partition(2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a)), args.k - 1)[:args.k])
+            if not np.allclose(expected, distances[origin], atol=1e-6):
+                failures.append(f'{name}: origin {origin} expected {expected.tolist()}, got {distances[origin].tolist()}')
+        brute_seconds = (time.perf_counter() - start) * args.origins / len(sample)
+
+        results[name] = {
+            'grid_s': round(grid_seconds, 3),
+            'brute_force_s': round(brute_seconds, 3),
+            'speedup': round(brute_seconds / grid_seconds, 1),
+        }
+
+    write_results(args.output, 'nearest', results)
+    if failures:
+        print('\n'.join(failures[:20]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
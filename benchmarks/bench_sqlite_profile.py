@@ -0,0 +1,112 @@
+"""
+Mixed read/write throughput against SQLite under the 'default' and
+'production' DATABASE_PROFILE settings.
+
+Several worker processes run a loop of API-shaped operations: reads are an
+API key lookup plus a filtered location query, writes are a credit
+deduction with its ledger row. "database is locked" failures are counted
+as errors.
+
+    python benchmarks/bench_sqlite_profile.py --processes 8 --duration 10 --output sqlite.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from common import ROOT, bench_env, prepare_data_dir, summarize, write_results
+
+
+def worker(args):
+    sys.path.insert(0, str(ROOT))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sfexpress_api.settings')
+    import django
+    django.setup()
+    from django.db import OperationalError, close_old_connections
+    from api.models import APIKey, CreditBalance, Location
+    from api.credits import charge_credits
+
+    rng = random.Random(os.getpid())
+    reads, writes, errors = [], [], 0
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        # Emulate the request cycle so CONN_MAX_AGE is honoured
+        close_old_connections()
+        start = time.perf_counter()
+        try:
+            if rng.random() < args.write_ratio:
+                balance = CreditBalance.objects.get(user__username='bench')
+                charge_credits(balance, 5, 'bench write')
+                writes.append(time.perf_counter() - start)
+            else:
+                APIKey.objects.select_related('user').get(key=args.api_key, is_active=True)
+                list(Location.objects.filter(is_active=True, district__icontains='Sha').values())
+                reads.append(time.perf_counter() - start)
+        except OperationalError:
+            errors += 1
+    print(json.dumps({'reads': reads, 'writes': writes, 'errors': errors}))
+
+
+def run_profile(profile, data_dir, api_key, args):
+    cmd = [
+        sys.executable, __file__, '--worker', '--api-key', api_key,
+        '--duration', str(args.duration), '--write-ratio', str(args.write_ratio),
+    ]
+    env = bench_env(data_dir, DATABASE_PROFILE=profile)
+    start = time.perf_counter()
+    procs = [
+        subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, text=True)
+        for _ in range(args.processes)
+    ]
+    outputs = [json.loads(proc.communicate()[0]) for proc in procs]
+    elapsed = time.perf_counter() - start
+
+    reads = [v for out in outputs for v in out['reads']]
+    writes = [v for out in outputs for v in out['writes']]
+    return {
+        'reads': summarize(reads, elapsed),
+        'writes': summarize(writes, elapsed),
+        'total_ops_per_s': round((len(reads) + len(writes)) / elapsed, 1),
+        'errors': sum(out['errors'] for out in outputs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--api-key', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    data_dir, api_key = prepare_data_dir(args.data_dir)
+    results = {}
+    for profile in args.profiles:
+        # WAL mode persists in the database file, so reset it between runs
+        subprocess.run(
+            [sys.executable, '-c', 'import sqlite3, sys; sqlite3.connect(sys.argv[1]).execute("PRAGMA journal_mode=DELETE")',
+             str(data_dir / 'db.sqlite3')],
+            check=True,
+        )
+        results[profile] = run_profile(profile, data_dir, api_key, args)
+
+    write_results(args.output, 'sqlite_profile', {
+        'processes': args.processes,
+        'duration_s': args.duration,
+        'write_ratio': args.write_ratio,
+        'profiles': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
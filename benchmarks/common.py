@@ -0,0 +1,153 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Each benchmark builds a throwaway DATA_DIR with migrations, the real
+location dataset from docs/ and one funded API key, so runs are
+reproducible and never touch data/db.sqlite3.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SETUP_SCRIPT = """
+from api.models import User, APIKey, CreditBalance
+user, _ = User.objects.get_or_create(username='bench', defaults={'email': 'bench@example.com'})
+CreditBalance.objects.update_or_create(user=user, defaults={'credits': 10 ** 9, 'total_earned': 10 ** 9})
+key = APIKey.objects.filter(user=user).first() or APIKey.objects.create(user=user, name='bench')
+print(key.key)
+"""
+
+
+def bench_env(data_dir, **overrides):
+    """Environment for server and manage.py subprocesses"""
+    env = dict(os.environ)
+    env.update({
+        'DATA_DIR': str(data_dir),
+        'DEBUG': 'False',
+        'API_RATE_LIMIT_ENABLED': 'False',
+        'PYTHONUNBUFFERED': '1',
+    })
+    env.update({k: str(v) for k, v in overrides.items()})
+    return env
+
+
+def manage(data_dir, *args, **env):
+    """Run a manage.py command against the benchmark DATA_DIR"""
+    return subprocess.run(
+        [sys.executable, 'manage.py', *args],
+        cwd=ROOT, env=bench_env(data_dir, **env),
+        check=True, capture_output=True, text=True,
+    ).stdout
+
+
+def prepare_data_dir(data_dir=None):
+    """
+    Create (or reuse) a DATA_DIR with the schema, the docs/ dataset and a
+    funded API key. Returns (data_dir, api_key).
+    """
+    data_dir = Path(data_dir or tempfile.mkdtemp(prefix='sfexpress-bench-'))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    manage(data_dir, 'migrate', '--noinput')
+    manage(data_dir, 'load_sfexpress_data')
+    api_key = manage(data_dir, 'shell', '-c', SETUP_SCRIPT).strip().splitlines()[-1]
+    return data_dir, api_key
+
+
+def setup_django(data_dir, **env):
+    """Configure Django in this process against the benchmark DATA_DIR"""
+    os.environ.update(bench_env(data_dir, **env))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sfexpress_api.settings')
+    sys.path.insert(0, str(ROOT))
+    import django
+    django.setup()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def start_server(kind, data_dir, port, **env):
+    """
+    Start a server subprocess: 'wsgi' is manage.py runserver (the current
+    container command), 'asgi' is uvicorn with the async views.
+    """
+    if kind == 'wsgi':
+        cmd = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+    elif kind == 'asgi':
+        cmd = [
+            sys.executable, '-m', 'uvicorn', 'sfexpress_api.asgi:application',
+            '--host', '127.0.0.1', '--port', str(port), '--no-access-log',
+        ]
+    else:
+        raise ValueError(f'unknown server kind: {kind}')
+    proc = subprocess.Popen(
+        cmd, cwd=ROOT, env=bench_env(data_dir, **env),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles (ms) and throughput for a list of seconds"""
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+def write_results(path, name, results):
+    """Write benchmark results as JSON, tagged with the current commit"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    payload = {
+        'benchmark': name,
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    text = json.dumps(payload, indent=2)
+    if path:
+        Path(path).write_text(text + '\n')
+    print(text)
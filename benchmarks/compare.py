@@ -0,0 +1,66 @@
+"""
+Compare two benchmark result files and report regressions.
+
+Latencies and durations (keys ending in _ms or _s) regress when they grow,
+throughput (throughput_rps, *_per_s) when it drops. Exits with status 1 if
+any metric moved the wrong way by more than --threshold percent.
+
+    python benchmarks/compare.py results/abc1234.json results/def5678.json --threshold 15
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def direction(path):
+    """+1 when a larger value is worse, -1 when a smaller one is, 0 to ignore"""
+    name = path.rsplit('.', 1)[-1]
+    if name.endswith('_per_s') or name == 'throughput_rps':
+        return -1
+    if name.endswith('_ms') or name.endswith('_s'):
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=20.0, help='allowed change in percent')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    before = dict(flatten(baseline['results']))
+    after = dict(flatten(candidate['results']))
+
+    print(f'{baseline.get("commit")} -> {candidate.get("commit")} (threshold {args.threshold:g}%)')
+    regressions = 0
+    for path in sorted(before.keys() & after.keys()):
+        sign = direction(path)
+        old, new = before[path], after[path]
+        if not sign or not old:
+            continue
+        change = (new - old) / old * 100
+        regressed = change * sign > args.threshold
+        regressions += regressed
+        marker = 'REGRESSION' if regressed else ''
+        print(f'{path:70} {old:>12g} {new:>12g} {change:>+8.1f}% {marker}')
+
+    if regressions:
+        print(f'{regressions} regression(s) above {args.threshold:g}%')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
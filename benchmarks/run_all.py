@@ -0,0 +1,63 @@
+"""
+Run the benchmark suite with quick settings and write one combined JSON
+file, named after the current commit by default.
+
+All benchmarks share one DATA_DIR, prepared once. Compare two result files
+with compare.py.
+
+    python benchmarks/run_all.py
+    python benchmarks/run_all.py --only locations auth --output before.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from common import ROOT, prepare_data_dir, write_results
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+SUITE = {
+    'locations': ['bench_locations.py', '--target', 'asgi', '--concurrency', '1', '8', '--requests', '30'],
+    'auth': ['bench_auth.py', '--iterations', '1000'],
+    'credits': ['bench_credits.py', '--processes', '4', '--charges', '100'],
+    'loader': ['bench_loader.py', '--repeat', '3'],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--only', nargs='+', choices=list(SUITE), default=list(SUITE))
+    parser.add_argument('--data-dir', help='reuse an existing benchmark DATA_DIR')
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<commit>.json)')
+    args = parser.parse_args()
+
+    data_dir, _ = prepare_data_dir(args.data_dir)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.only:
+            script, *options = SUITE[name]
+            output = Path(tmp) / f'{name}.json'
+            print(f'Running {name}...', file=sys.stderr)
+            subprocess.run(
+                [sys.executable, str(BENCHMARKS_DIR / script), *options,
+                 '--data-dir', str(data_dir), '--output', str(output)],
+                cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+            )
+            results[name] = json.loads(output.read_text())['results']
+
+    output = args.output
+    if not output:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+        ).stdout.strip() or 'latest'
+        results_dir = BENCHMARKS_DIR / 'results'
+        results_dir.mkdir(exist_ok=True)
+        output = results_dir / f'{commit}.json'
+    write_results(output, 'suite', results)
+
+
+if __name__ == '__main__':
+    main()
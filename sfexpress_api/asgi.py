@@ -7,5 +7,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sfexpress_api.settings')
+# Route the JSON API to its async views when served over ASGI
+os.environ.setdefault('API_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -3,6 +3,7 @@ Django settings for sfexpress_api project.
 """
 
 from pathlib import Path
+import ipaddress
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +81,46 @@ DATABASES = {
     }
 }
 
+# Database profile: 'default' uses stock SQLite settings, 'production' enables
+# WAL journaling, the SQLITE_PRAGMAS below and persistent connections so that
+# readers no longer block the credit writers.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'default')
+
+# Applied to every new SQLite connection by api.signals when the production
+# profile is active
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # milliseconds
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'cache_size': -64 * 1024,  # negative means KiB, i.e. 64 MiB
+    'temp_store': 'MEMORY',
+}
+
+if DATABASE_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+    })
+
+# Location database: with LOCATION_DB_ENABLED, each dataset version is also
+# copied to LOCATION_DB_PATH, a separate SQLite file that replaces the previous
+# one atomically, and Location reads go there instead of the account database
+# (see api.location_db). It is opened read-only and immutable, with
+# LOCATION_DB_MMAP_SIZE bytes memory-mapped.
+LOCATION_DB_ENABLED = os.environ.get('LOCATION_DB_ENABLED', 'False') == 'True'
+LOCATION_DB_PATH = Path(os.environ.get('LOCATION_DB_PATH', DATA_DIR / 'locations.sqlite3'))
+LOCATION_DB_MMAP_SIZE = int(os.environ.get('LOCATION_DB_MMAP_SIZE', str(1024 * 1024 * 1024)))
+
+if LOCATION_DB_ENABLED:
+    DATABASES['locations'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        # Django opens SQLite names as URIs
+        'NAME': LOCATION_DB_PATH.resolve().as_uri() + '?mode=ro&immutable=1',
+        'CONN_MAX_AGE': DATABASES['default'].get('CONN_MAX_AGE', 0),
+    }
+    DATABASE_ROUTERS = ['api.routers.LocationRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -123,3 +165,212 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Custom user model
 AUTH_USER_MODEL = 'api.User'
+
+
+# API rate limiting
+# Token buckets per API key (sized by APIKey.rate_limit_tier) and per user.
+# 'rate' is tokens refilled per second, 'burst' is the bucket capacity.
+# API_RATE_LIMIT_STORE = 'sqlite' shares buckets between worker processes; it is
+# the default when WEB_CONCURRENCY asks for more than one worker, since per-process
+# buckets would multiply every limit by the number of workers.
+
+API_RATE_LIMIT_ENABLED = os.environ.get('API_RATE_LIMIT_ENABLED', 'True') == 'True'
+
+API_RATE_LIMIT_STORE = os.environ.get(
+    'API_RATE_LIMIT_STORE', 'sqlite' if int(os.environ.get('WEB_CONCURRENCY') or '1') > 1 else 'memory'
+)
+
+API_RATE_LIMIT_DB = DATA_DIR / 'ratelimit.sqlite3'
+
+API_RATE_LIMIT_TIERS = {
+    'FREE': {'rate': 1, 'burst': 10},
+    'STANDARD': {'rate': 5, 'burst': 30},
+    'PREMIUM': {'rate': 20, 'burst': 100},
+}
+
+API_RATE_LIMIT_DEFAULT_TIER = 'STANDARD'
+
+API_RATE_LIMIT_USER = {'rate': 10, 'burst': 60}
+
+# Buckets kept by the per-process memory store
+API_RATE_LIMIT_MAX_BUCKETS = int(os.environ.get('API_RATE_LIMIT_MAX_BUCKETS', '100000'))
+
+# Seconds an API key's owner and tier are remembered per process
+API_KEY_CACHE_TTL = 60
+
+
+# Async API
+# Serve the JSON API with async views (set automatically by sfexpress_api/asgi.py)
+API_ASYNC_VIEWS = os.environ.get('API_ASYNC_VIEWS', 'False') == 'True'
+
+# Threads available to async views for blocking database work
+API_DB_THREADS = int(os.environ.get('API_DB_THREADS', '4'))
+
+
+# Location snapshot
+# Seconds between dataset version checks for the in-memory location snapshot
+LOCATION_SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('LOCATION_SNAPSHOT_CHECK_INTERVAL', '5'))
+
+# Keep serving the current snapshot while a new dataset version is loaded in the background
+LOCATION_SNAPSHOT_STALE_WHILE_REVALIDATE = os.environ.get('LOCATION_SNAPSHOT_STALE_WHILE_REVALIDATE', 'True') == 'True'
+
+# Seconds snapshot rows and district/search results stay in the two-tier cache
+# (keys include the dataset version), and how long an expired result may still
+# be served while it is recomputed
+LOCATION_CACHE_TTL = int(os.environ.get('LOCATION_CACHE_TTL', '3600'))
+LOCATION_CACHE_STALE_TTL = int(os.environ.get('LOCATION_CACHE_STALE_TTL', '600'))
+
+# District/search results kept in each process in front of the shared cache
+LOCATION_CACHE_LRU_SIZE = int(os.environ.get('LOCATION_CACHE_LRU_SIZE', '256'))
+
+# Filter combinations (without search) whose responses are compressed once per
+# dataset version and served as gzip/brotli; 0 disables precompression
+LOCATION_PRECOMPRESSED_VARIANTS = int(os.environ.get('LOCATION_PRECOMPRESSED_VARIANTS', '64'))
+
+LOCATION_GZIP_LEVEL = 9
+
+# Brotli (needs the optional 'brotli' package); 11 compresses ~13% smaller but takes ~1s for the full dataset
+LOCATION_BROTLI_QUALITY = int(os.environ.get('LOCATION_BROTLI_QUALITY', '9'))
+
+# Highest zoom of /api/locations/tiles; clusters for zoom 0 up to this one are
+# computed once per dataset version
+LOCATION_TILE_MAX_ZOOM = int(os.environ.get('LOCATION_TILE_MAX_ZOOM', '16'))
+
+# Bulk nearest-location matching (/api/locations/nearest-bulk, needs the optional
+# 'numpy' package): origins accepted per request, and the edge of the finest grid
+# cell in km; origins whose matches are farther away are retried on coarser cells
+LOCATION_NEAREST_MAX_ORIGINS = int(os.environ.get('LOCATION_NEAREST_MAX_ORIGINS', '100000'))
+LOCATION_NEAREST_CELL_KM = float(os.environ.get('LOCATION_NEAREST_CELL_KM', '0.1'))
+
+# Largest request body read into memory; room for LOCATION_NEAREST_MAX_ORIGINS origins
+DATA_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get('DATA_UPLOAD_MAX_MEMORY_SIZE', str(8 * 1024 * 1024)))
+
+# Function encoding API payloads to JSON bytes. The default uses the optional
+# 'orjson' package when installed (~10x faster) and the standard library otherwise
+API_JSON_SERIALIZER = os.environ.get('API_JSON_SERIALIZER', 'api.serializers.fast_dumps')
+
+
+# Location exports
+# Directory holding the export files of each dataset version (/api/locations/export)
+EXPORT_DIR = Path(os.environ.get('EXPORT_DIR', DATA_DIR / 'exports'))
+
+# Dataset versions whose export files are kept
+EXPORT_KEEP_VERSIONS = int(os.environ.get('EXPORT_KEEP_VERSIONS', '3'))
+
+# Exports are compressed once per version, so the slowest brotli quality is affordable
+EXPORT_BROTLI_QUALITY = int(os.environ.get('EXPORT_BROTLI_QUALITY', '11'))
+
+# Internal nginx location prefix mapped to EXPORT_DIR (e.g. '/_exports/'); when set,
+# exports are sent by nginx via X-Accel-Redirect instead of the application server
+EXPORT_ACCEL_REDIRECT = os.environ.get('EXPORT_ACCEL_REDIRECT', '')
+
+
+# Credit ledger exports
+# Transactions read per query while streaming /api/credits/ledger and the dashboard download
+LEDGER_EXPORT_BATCH_SIZE = int(os.environ.get('LEDGER_EXPORT_BATCH_SIZE', '2000'))
+
+# Idempotency keys
+# Replay the stored response to retries that repeat an Idempotency-Key header
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'True') == 'True'
+
+# Seconds a response is kept for replay
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', str(24 * 60 * 60)))
+
+# Stored responses per API key; the oldest are deleted beyond this
+IDEMPOTENCY_MAX_RECORDS = int(os.environ.get('IDEMPOTENCY_MAX_RECORDS', '1000'))
+
+# Largest response body stored for replay. Larger and streamed responses
+# (exports) only record that the call was charged; their retries run the call
+# again without charging.
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.environ.get('IDEMPOTENCY_MAX_BODY_BYTES', str(1024 * 1024)))
+
+# Seconds after which a key still marked as in progress is considered abandoned
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+
+# Admin
+# Changelists count rows exactly up to this many; above it they show an estimate
+ADMIN_EXACT_COUNT_LIMIT = int(os.environ.get('ADMIN_EXACT_COUNT_LIMIT', '10000'))
+
+
+# Striped credit counters
+# Number of CreditStripe rows per user; 0 keeps the single CreditBalance row
+CREDIT_STRIPES = int(os.environ.get('CREDIT_STRIPES', '0'))
+
+# Credits moved from the balance into a stripe at a time
+CREDIT_STRIPE_RESERVE = int(os.environ.get('CREDIT_STRIPE_RESERVE', '50'))
+
+# 'random' spreads every call over the stripes, 'api_key' pins each key to one
+CREDIT_STRIPE_SELECTION = os.environ.get('CREDIT_STRIPE_SELECTION', 'random')
+
+
+# Metrics
+# Expose Prometheus metrics at /metrics. They reveal traffic and dataset
+# details, so scrapes can be limited to METRICS_ALLOWED_IPS (comma-separated
+# addresses or networks, as seen in REMOTE_ADDR) and to requests with
+# `Authorization: Bearer <METRICS_BEARER_TOKEN>`; both apply when set.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+METRICS_ALLOWED_IPS = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if network.strip()
+]
+METRICS_BEARER_TOKEN = os.environ.get('METRICS_BEARER_TOKEN', '')
+
+# Add a Server-Timing header (total, db, auth, serialize, ...) to every response
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'False') == 'True'
+
+
+# Slow-request log (api.slowlog)
+# Append requests slower than SLOW_REQUEST_THRESHOLD_MS, plus a random
+# SLOW_REQUEST_SAMPLE_RATE fraction of the others, with their SQL statements and
+# query plans to SLOW_REQUEST_LOG_PATH; summarize with `manage.py slow_requests`
+SLOW_REQUEST_LOG_ENABLED = os.environ.get('SLOW_REQUEST_LOG_ENABLED', 'False') == 'True'
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', '500'))
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', '0'))
+SLOW_REQUEST_LOG_PATH = Path(os.environ.get('SLOW_REQUEST_LOG_PATH', DATA_DIR / 'slow-requests.jsonl'))
+# The log rotates at this size, keeping SLOW_REQUEST_LOG_BACKUPS older files
+SLOW_REQUEST_LOG_MAX_BYTES = int(os.environ.get('SLOW_REQUEST_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+SLOW_REQUEST_LOG_BACKUPS = int(os.environ.get('SLOW_REQUEST_LOG_BACKUPS', '5'))
+# Statements kept per request; further ones are only counted
+SLOW_REQUEST_MAX_QUERIES = int(os.environ.get('SLOW_REQUEST_MAX_QUERIES', '200'))
+if SLOW_REQUEST_LOG_ENABLED:
+    MIDDLEWARE.insert(MIDDLEWARE.index('api.metrics.MetricsMiddleware') + 1, 'api.slowlog.SlowRequestMiddleware')
+
+
+# Cache, sessions and messages
+# 'locmem' is per process; 'file' is shared by all processes using DATA_DIR
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': DATA_DIR / 'cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Two-tier cache (api.tiered_cache): lifetimes are spread by +/- this fraction
+CACHE_TTL_JITTER = float(os.environ.get('CACHE_TTL_JITTER', '0.1'))
+
+# Seconds a process may hold the cross-process lock while computing a value,
+# and how often waiting processes look for its result
+CACHE_LOCK_TIMEOUT = 30
+CACHE_LOCK_POLL_INTERVAL = 0.05
+
+# Lock file for the cross-process lock with CACHE_BACKEND=file
+CACHE_LOCK_PATH = DATA_DIR / 'cache.lock'
+
+# Seconds a user's dashboard balance and transactions are cached (changes invalidate it)
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', '300'))
+
+# 'django.contrib.sessions.backends.signed_cookies' keeps sessions out of the database
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+
+# 'django.contrib.messages.storage.cookie.CookieStorage' never falls back to the session
+MESSAGE_STORAGE = os.environ.get('MESSAGE_STORAGE', 'django.contrib.messages.storage.fallback.FallbackStorage')
@@ -14,9 +14,13 @@ urlpatterns = [
     path('login', views.login_view, name='login'),
     path('logout', views.logout_view, name='logout'),
     path('dashboard', views.dashboard, name='dashboard'),
+    path('dashboard/ledger', views.dashboard_ledger, name='dashboard_ledger'),
     path('dashboard/api-keys/create', views.create_api_key_dashboard, name='create_api_key_dashboard'),
     path('dashboard/api-keys/<int:key_id>/delete', views.delete_api_key, name='delete_api_key'),
 
     # API endpoints
     path('api/', include('api.urls')),
+
+    # Prometheus metrics
+    path('metrics', views.metrics, name='metrics'),
 ]
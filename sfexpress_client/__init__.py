@@ -0,0 +1,19 @@
+"""
+Python client for the SF Express Locations API.
+
+Uses only the standard library; brotli responses are accepted when the
+optional `brotli` package is installed.
+"""
+from .aio import AsyncClient
+from .cache import ResponseCache
+from .client import DEFAULT_BASE_URL, Client, __version__
+from .errors import (
+    APIError, AuthenticationError, FullSyncRequired, InsufficientCredits, RateLimited
+)
+from .index import LocationIndex
+
+__all__ = [
+    'APIError', 'AsyncClient', 'AuthenticationError', 'Client', 'DEFAULT_BASE_URL',
+    'FullSyncRequired', 'InsufficientCredits', 'LocationIndex', 'RateLimited',
+    'ResponseCache', '__version__',
+]
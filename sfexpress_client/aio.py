@@ -0,0 +1,66 @@
+"""
+asyncio variant of the client.
+
+AsyncClient has the methods of Client as coroutines. They run the
+synchronous client on a thread pool with one thread per pooled
+connection, so an event loop can have as many requests in flight as the
+pool holds without blocking, and shares the pool, retries and cache.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import DEFAULT_BASE_URL, Client
+
+
+class AsyncClient:
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, **options):
+        self.client = Client(api_key, base_url, **options)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.client.pool.maxsize, thread_name_prefix='sfexpress-client'
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        self.executor.shutdown(wait=False)
+        self.client.close()
+
+    @property
+    def credits_remaining(self):
+        return self.client.credits_remaining
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def request(self, method, path, params=None, headers=None, body=None):
+        return await self._run(self.client.request, method, path, params, headers, body)
+
+    async def locations(self, type=None, district=None, search=None):
+        return await self._run(self.client.locations, type, district, search)
+
+    async def count(self, type=None, district=None, search=None):
+        return await self._run(self.client.count, type, district, search)
+
+    async def summary(self):
+        return await self._run(self.client.summary)
+
+    async def tile(self, z, x, y):
+        return await self._run(self.client.tile, z, x, y)
+
+    async def nearest_bulk(self, origins, k=1, type=None):
+        return await self._run(self.client.nearest_bulk, origins, k, type)
+
+    async def changes(self, since):
+        return await self._run(self.client.changes, since)
+
+    async def index(self):
+        return await self._run(self.client.index)
+
+    async def refresh_index(self, index):
+        return await self._run(self.client.refresh_index, index)
@@ -0,0 +1,80 @@
+"""
+Persistent response cache.
+
+Each cached GET is one file in the cache directory, named after a hash of
+the server, the API key (itself hashed), the path and the query, so clients
+of different servers or accounts can share a directory without reading each
+other's responses: a JSON header line with the ETag, followed by the
+decoded response body. The file's modification time is when the response
+was last fetched or revalidated. Files are written under a temporary name
+and renamed, so several processes can share a directory.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlencode
+
+
+def cache_key(base_url, api_key, path, params):
+    query = urlencode(sorted((k, v) for k, v in (params or {}).items() if v is not None))
+    account = hashlib.sha256(api_key.encode()).hexdigest()
+    return hashlib.sha256(f'{base_url.rstrip("/")}\n{account}\n{path}?{query}'.encode()).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    etag: str
+    stored_at: float
+    body: bytes
+
+    @property
+    def age(self):
+        return time.time() - self.stored_at
+
+
+class ResponseCache:
+    """Directory of cached response bodies with their ETags"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key):
+        return self.directory / f'{key}.cache'
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                stored_at = os.fstat(f.fileno()).st_mtime
+                header = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(header['etag'], stored_at, body)
+
+    def set(self, key, etag, body):
+        header = json.dumps({'etag': etag}).encode() + b'\n'
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(body)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def touch(self, key):
+        """Mark an entry as just revalidated"""
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for path in self.directory.glob('*.cache'):
+            path.unlink(missing_ok=True)
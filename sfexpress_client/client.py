@@ -0,0 +1,281 @@
+"""
+Synchronous client for the SF Express Locations API.
+
+    from sfexpress_client import Client
+
+    with Client('YOUR_API_KEY', 'https://api.example.com', cache_dir='~/.cache/sfexpress') as client:
+        lockers = client.locations(type='LOCKER')
+        index = client.index()
+        index.filter(district='Sha Tin')
+
+* Connections are kept alive and reused from a pool shared by threads.
+* Failed connections, 429 and 502/503/504 responses are retried with
+  exponential backoff and jitter (429 waits for Retry-After). Every call
+  sends one Idempotency-Key for all its attempts, so a retry whose first
+  attempt was charged is not charged again.
+* With cache_dir, GET responses are stored on disk per server, API key,
+  path and query and revalidated with If-None-Match; an unchanged
+  /api/locations response comes back as 304 and costs no credits. Within
+  max_age seconds of the last fetch, the cached body is used without a
+  request at all.
+"""
+import gzip
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+from .cache import ResponseCache, cache_key
+from .errors import FullSyncRequired, error_for
+from .index import LocationIndex
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__version__ = '1.0.0'
+
+DEFAULT_BASE_URL = 'http://localhost:8000'
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class Response:
+    """Status, lowercased headers and decoded body of one HTTP response"""
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        encoding = headers.get('content-encoding', 'identity')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'br':
+            body = brotli.decompress(body)
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content) if self.content else {}
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one server. Idle connections are reused by
+    any thread; at most `maxsize` are kept open while idle.
+    """
+
+    def __init__(self, base_url, maxsize=10, timeout=30):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'base_url must be http:// or https://, not {base_url!r}')
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize)
+
+    def _get(self):
+        """An idle connection (reused=True) or a new one"""
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _put(self, connection):
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, headers, body=None):
+        while True:
+            connection, reused = self._get()
+            try:
+                connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if reused:
+                    # The server closed the idle connection; try a fresh one right away
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put(connection)
+            return Response(response.status, {k.lower(): v for k, v in response.getheaders()}, body)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Client:
+    """
+    Client for /api/locations and its sibling endpoints. Safe to share
+    between threads.
+    """
+
+    def __init__(
+        self, api_key, base_url=DEFAULT_BASE_URL, *, timeout=30, pool_size=10,
+        retries=3, backoff=0.5, max_backoff=30, cache_dir=None, max_age=0,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.pool = ConnectionPool(base_url, maxsize=pool_size, timeout=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # The most recent balance reported by a charged response
+        self.credits_remaining = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    def headers(self, extra=None):
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Accept': 'application/json',
+            'Accept-Encoding': 'br, gzip' if brotli is not None else 'gzip',
+            'User-Agent': f'sfexpress-client/{__version__}',
+        }
+        headers.update(extra or {})
+        return headers
+
+    def delay(self, attempt, response=None):
+        """Seconds to wait before retry number `attempt` (0-based)"""
+        if response is not None and response.status == 429:
+            try:
+                return min(self.max_backoff, float(response.headers.get('retry-after', '')))
+            except ValueError:
+                pass
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def request(self, method, path, params=None, headers=None, body=None):
+        """
+        Send a request, retrying transient failures. Returns the Response
+        for 2xx and 304, raises an APIError subclass otherwise.
+        """
+        query = urlencode([(k, v) for k, v in (params or {}).items() if v is not None])
+        url = f'{path}?{query}' if query else path
+        # One key for every attempt of this call
+        headers = self.headers({'Idempotency-Key': uuid.uuid4().hex, **(headers or {})})
+
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = self.pool.request(method, url, headers, body)
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries:
+                    raise
+            else:
+                # 409: the first attempt of this call is still being processed
+                if response.status not in RETRY_STATUSES | {409} or attempt == self.retries:
+                    break
+            time.sleep(self.delay(attempt, response))
+
+        if response.status >= 400:
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            raise error_for(response.status, data)
+        return response
+
+    def get_json(self, path, params=None):
+        """
+        GET a JSON resource through the response cache, when there is one:
+        fresh entries are used as they are, others are revalidated
+        """
+        if self.cache is None:
+            return self._record_credits(self.request('GET', path, params).json())
+
+        key = cache_key(self.base_url, self.api_key, path, params)
+        entry = self.cache.get(key)
+        if entry is not None and entry.age < self.max_age:
+            return json.loads(entry.body)
+
+        headers = {'If-None-Match': entry.etag} if entry is not None else None
+        response = self.request('GET', path, params, headers)
+        if response.status == 304 and entry is not None:
+            self.cache.touch(key)
+            return json.loads(entry.body)
+        etag = response.headers.get('etag')
+        if etag:
+            self.cache.set(key, etag, response.content)
+        return self._record_credits(response.json())
+
+    def _record_credits(self, data):
+        if 'credits_remaining' in data:
+            with self.lock:
+                self.credits_remaining = data['credits_remaining']
+        return data
+
+    def locations(self, type=None, district=None, search=None):
+        """The /api/locations response: count, version, locations and credits"""
+        return self.get_json('/api/locations', {'type': type, 'district': district, 'search': search})
+
+    def count(self, type=None, district=None, search=None):
+        """Number of matching locations (count_only=1)"""
+        params = {'type': type, 'district': district, 'search': search, 'count_only': 1}
+        return self.get_json('/api/locations', params)['count']
+
+    def summary(self):
+        """Counts per type, region and district with coordinate bounds"""
+        return self._record_credits(self.request('GET', '/api/locations/summary').json())
+
+    def tile(self, z, x, y):
+        """Clusters of one map tile: count, centroid and representative ids"""
+        return self.get_json(f'/api/locations/tiles/{int(z)}/{int(x)}/{int(y)}')
+
+    def nearest_bulk(self, origins, k=1, type=None):
+        """
+        The k nearest locations of each (latitude, longitude) origin, as
+        {'ids': [...], 'distances_km': [...]} in origin order. Costs 1 credit
+        per started batch of 1000 origins.
+        """
+        body = json.dumps({'origins': [[latitude, longitude] for latitude, longitude in origins]}).encode()
+        response = self.request(
+            'POST', '/api/locations/nearest-bulk', {'k': k, 'type': type},
+            {'Content-Type': 'application/json'}, body
+        )
+        return self._record_credits(response.json())['results']
+
+    def changes(self, since):
+        """Locations changed since a dataset version; raises FullSyncRequired when unavailable"""
+        return self._record_credits(self.request('GET', '/api/locations/changes', {'since': since}).json())
+
+    def index(self):
+        """A LocationIndex over the full dataset"""
+        data = self.locations()
+        return LocationIndex(data['locations'], data['version'])
+
+    def refresh_index(self, index):
+        """
+        Bring an index up to the current dataset version through the change
+        log, or by downloading the dataset again when that is not possible
+        """
+        try:
+            index.apply_changes(self.changes(index.version))
+        except FullSyncRequired:
+            data = self.locations()
+            index.reset(data['locations'], data['version'])
+        return index
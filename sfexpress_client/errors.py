@@ -0,0 +1,36 @@
+class APIError(Exception):
+    """An error response from the API"""
+
+    def __init__(self, status, data):
+        self.status = status
+        # Decoded JSON error body, or {} when it was not JSON
+        self.data = data
+        super().__init__(f'HTTP {status}: {data.get("error", "") if isinstance(data, dict) else data}')
+
+
+class AuthenticationError(APIError):
+    """401: the API key is missing, invalid or inactive"""
+
+
+class InsufficientCredits(APIError):
+    """402: the account cannot pay for the call"""
+
+
+class FullSyncRequired(APIError):
+    """410 from /api/locations/changes: download the full dataset again"""
+
+
+class RateLimited(APIError):
+    """429 after all retries were used"""
+
+
+ERRORS = {
+    401: AuthenticationError,
+    402: InsufficientCredits,
+    410: FullSyncRequired,
+    429: RateLimited,
+}
+
+
+def error_for(status, data):
+    return ERRORS.get(status, APIError)(status, data)
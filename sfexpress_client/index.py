@@ -0,0 +1,87 @@
+"""
+In-memory index over a downloaded copy of the dataset.
+
+LocationIndex answers the same filters as /api/locations (and a few more
+lookups) without a request. Client.index() builds one from the full
+dataset and Client.refresh_index() keeps it current through
+/api/locations/changes.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class LocationIndex:
+    """Locations of one dataset version, indexed by id, type and district"""
+
+    def __init__(self, locations, version):
+        self.reset(locations, version)
+
+    def reset(self, locations, version):
+        """Replace the contents with a full download of the dataset"""
+        self.version = version
+        self.by_id = {location['id']: location for location in locations}
+        self._reindex()
+
+    def _reindex(self):
+        # Same order as the API: district, then name
+        self.rows = sorted(self.by_id.values(), key=lambda row: (row['district'], row['name']))
+        self.by_type = {}
+        self.by_district = {}
+        for row in self.rows:
+            self.by_type.setdefault(row['location_type'], []).append(row)
+            self.by_district.setdefault(row['district'].lower(), []).append(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def get(self, location_id):
+        return self.by_id.get(location_id)
+
+    def filter(self, type=None, district=None, search=None):
+        """
+        Same semantics as the /api/locations query parameters: exact type,
+        case-insensitive substring match on district and name
+        """
+        rows = self.by_type.get(type.upper(), []) if type else self.rows
+        if district:
+            district = district.lower()
+            rows = [row for row in rows if district in row['district'].lower()]
+        if search:
+            search = search.lower()
+            rows = [row for row in rows if search in row['name'].lower()]
+        return list(rows)
+
+    def count(self, type=None, district=None, search=None):
+        return len(self.filter(type, district, search))
+
+    def districts(self):
+        return sorted({row['district'] for row in self.rows})
+
+    def nearest(self, latitude, longitude, limit=5, type=None):
+        """The `limit` closest locations with coordinates, each with its `distance_km`"""
+        rows = self.by_type.get(type.upper(), []) if type else self.rows
+        distances = [
+            (haversine_km(latitude, longitude, row['latitude'], row['longitude']), row)
+            for row in rows if row['latitude'] is not None and row['longitude'] is not None
+        ]
+        distances.sort(key=lambda item: item[0])
+        return [{**row, 'distance_km': round(distance, 3)} for distance, row in distances[:limit]]
+
+    def apply_changes(self, changes):
+        """Apply a /api/locations/changes response"""
+        for row in changes['upserts']:
+            self.by_id[row['id']] = row
+        for location_id in changes['deleted']:
+            self.by_id.pop(location_id, None)
+        self.version = changes['version']
+        self._reindex()